@@ -0,0 +1,508 @@
+"""Load test for the disease detection and Palm chat services.
+
+`run` starts both Flask apps locally on spare ports. The chat service uses
+the fake LLM (PALM_PROVIDER=fake, --llm-latency-ms), and --random-model
+serves a tiny randomly initialised classifier, so nothing is downloaded.
+It then replays a weighted mix of AI/Images and egypt_model_data photos and
+chat prompts at the target concurrency, one stage per endpoint. For each
+stage it records p50/p95/p99 latency, requests/s, and the RSS and CPU time
+of each service's processes, and writes everything to a JSON file.
+`compare` diffs two such files and exits non-zero on regressions.
+
+  python benchmark.py run --random-model --concurrency 8 --requests 200
+  python benchmark.py run --stages detect,tiled --server gunicorn --workers 2
+  python benchmark.py run --detect-url http://localhost:5006 --stages detect
+  python benchmark.py compare benchmark_results/before.json benchmark_results/after.json
+
+By default each image upload gets unique trailing bytes and each prompt a
+unique suffix, so the prediction and generation caches never answer and
+the model and LLM paths are measured. --cache replays identical requests.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from importlib import metadata
+
+import numpy as np
+import psutil
+import requests
+
+AI_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT_DIR = os.path.join(AI_DIR, 'benchmark_results')
+STAGES = ('detect', 'tiled', 'chat')
+SOURCES = ('images', 'egypt')
+SAMPLE_INTERVAL = 0.1
+
+CHAT_PROMPTS = [
+    "How often should I water tomato plants in summer?",
+    "What causes yellow leaves on my orange trees?",
+    "Which fertilizer is best for corn before planting?",
+    "How do I control early blight on potatoes without chemicals?",
+    "When is the right time to prune grape vines in Egypt?",
+    "My mango flowers are covered in white powder. What should I do?",
+    "How can I tell if my soil needs more nitrogen?",
+    "What is the best way to store wheat after harvest?",
+]
+CHAT_DISEASE_CONTEXT = ("Plant: Tomato\nDisease: Early Blight\nConfidence: 87.5%\n"
+                        "Treatment: Remove infected leaves and apply a copper fungicide.")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def parse_mix(text):
+    """'images=1,egypt=3' -> {'images': 1.0, 'egypt': 3.0}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in SOURCES:
+            raise argparse.ArgumentTypeError(f"Unknown image source '{name}'. Choose from: {', '.join(SOURCES)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def image_pool(mix, per_class, seed=0):
+    """{source: [(path, bytes)]} for the sources with a non-zero weight"""
+    paths = {
+        'images': sorted(glob.glob(os.path.join(AI_DIR, 'Images', '*.jpg'))),
+        'egypt': [],
+    }
+    rng = random.Random(seed)
+    for class_dir in sorted(glob.glob(os.path.join(AI_DIR, 'egypt_model_data', 'train', '*'))):
+        files = sorted(glob.glob(os.path.join(class_dir, '*.jpg')))
+        paths['egypt'] += rng.sample(files, min(per_class, len(files)))
+    pool = {}
+    for source, weight in mix.items():
+        if weight > 0 and paths[source]:
+            pool[source] = []
+            for path in paths[source]:
+                with open(path, 'rb') as f:
+                    pool[source].append((path, f.read()))
+    if not pool:
+        raise SystemExit("No images found for the requested --mix")
+    return pool
+
+
+def image_requests(pool, mix, count, unique, seed=0):
+    """`count` (filename, bytes) uploads drawn from the sources in proportion to their weights"""
+    rng = random.Random(seed)
+    sources = list(pool)
+    weights = [mix[source] for source in sources]
+    for n in range(count):
+        path, data = rng.choice(pool[rng.choices(sources, weights)[0]])
+        if unique:
+            # Decoders ignore bytes after the JPEG end marker; the content hash does not
+            data += f"\nbenchmark-{n}".encode()
+        yield os.path.basename(path), data
+
+
+def chat_requests(count, unique, seed=0):
+    rng = random.Random(seed)
+    for n in range(count):
+        prompt = rng.choice(CHAT_PROMPTS)
+        payload = {'prompt': f"{prompt} (request {n})" if unique else prompt,
+                   'session_id': f"benchmark-{n}"}
+        # Every third question follows a detection, as the app's chat flow does
+        if n % 3 == 0:
+            payload['disease_context'] = CHAT_DISEASE_CONTEXT
+        yield payload
+
+
+class Service:
+    """One app under test: a subprocess we started, or an existing URL"""
+
+    def __init__(self, name, url, command=None, env=None, ready_path='/stats', log_path=None):
+        self.name = name
+        self.url = url.rstrip('/')
+        self.command = command
+        self.env = env
+        self.ready_path = ready_path
+        self.log_path = log_path
+        self.process = None
+        self.startup_seconds = None
+
+    def start(self, timeout=600):
+        if self.command is None:
+            return
+        log = open(self.log_path, 'w') if self.log_path else subprocess.DEVNULL
+        t0 = time.perf_counter()
+        self.process = subprocess.Popen(self.command, cwd=AI_DIR, env=self.env, stdout=log,
+                                        stderr=subprocess.STDOUT)
+        while time.perf_counter() - t0 < timeout:
+            if self.process.poll() is not None:
+                raise SystemExit(f"{self.name} exited during startup; see {self.log_path}")
+            try:
+                if requests.get(self.url + self.ready_path, timeout=2).status_code == 200:
+                    self.startup_seconds = time.perf_counter() - t0
+                    print(f"{self.name} ready in {self.startup_seconds:.1f}s at {self.url}")
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.25)
+        self.stop()
+        raise SystemExit(f"{self.name} was not ready after {timeout}s; see {self.log_path}")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def processes(self):
+        """The service process and its children (gunicorn workers)"""
+        if self.process is None:
+            return []
+        try:
+            root = psutil.Process(self.process.pid)
+            return [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def usage(self):
+        """(RSS bytes, user + system CPU seconds) summed over the process tree"""
+        rss = cpu = 0.0
+        for process in self.processes():
+            try:
+                rss += process.memory_info().rss
+                times = process.cpu_times()
+                cpu += times.user + times.system
+            except psutil.NoSuchProcess:
+                pass
+        return rss, cpu
+
+    def server_stats(self):
+        try:
+            return requests.get(self.url + '/stats', timeout=10).json()
+        except (requests.RequestException, ValueError):
+            return None
+
+
+class ResourceSampler(threading.Thread):
+    """Samples RSS of the services every SAMPLE_INTERVAL seconds while a stage runs"""
+
+    def __init__(self, services):
+        super().__init__(daemon=True)
+        self.services = services
+        self.samples = {service.name: [] for service in services}
+        self.cpu_start = {service.name: service.usage()[1] for service in services}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            for service in self.services:
+                self.samples[service.name].append(service.usage()[0])
+            self._stop_event.wait(SAMPLE_INTERVAL)
+
+    def finish(self, seconds):
+        self._stop_event.set()
+        self.join()
+        report = {}
+        for service in self.services:
+            rss, cpu = service.usage()
+            samples = self.samples[service.name] + [rss]
+            cpu_seconds = cpu - self.cpu_start[service.name]
+            report[service.name] = {
+                'rss_mb_peak': max(samples) / 2 ** 20,
+                'rss_mb_mean': sum(samples) / len(samples) / 2 ** 20,
+                'cpu_seconds': cpu_seconds,
+                # 100% = one core busy for the whole stage
+                'cpu_percent': 100.0 * cpu_seconds / seconds if seconds else 0.0,
+            }
+        return report
+
+
+def send(session, stage, url, payload):
+    if stage == 'chat':
+        return session.post(url, json=payload, timeout=300)
+    filename, data = payload
+    return session.post(url, files={'image': (filename, data, 'image/jpeg')}, timeout=300)
+
+
+def run_stage(stage, url, payloads, concurrency, warmup, services):
+    """Closed-loop load: `concurrency` clients each send their next request as soon as the last returns"""
+    payloads = list(payloads)
+    for payload in payloads[:warmup]:
+        send(requests, stage, url, payload)
+    payloads = payloads[warmup:]
+
+    latencies, statuses, errors = [], {}, []
+    lock = threading.Lock()
+    queue = iter(payloads)
+
+    def client():
+        session = requests.Session()
+        while True:
+            with lock:
+                payload = next(queue, None)
+            if payload is None:
+                return
+            t0 = time.perf_counter()
+            try:
+                status = send(session, stage, url, payload).status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - t0
+            with lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+                elif len(errors) < 5:
+                    errors.append(str(status))
+
+    # Only services started here can be measured
+    sampler = ResourceSampler([service for service in services if service.process is not None])
+    sampler.start()
+    t0 = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    seconds = time.perf_counter() - t0
+    resources = sampler.finish(seconds)
+
+    ms = np.asarray(latencies) * 1000.0
+    return {
+        'url': url,
+        'requests': len(payloads),
+        'ok': len(latencies),
+        'statuses': statuses,
+        'seconds': seconds,
+        'requests_per_second': len(latencies) / seconds if seconds else 0.0,
+        'latency_ms': {
+            'mean': float(ms.mean()) if len(ms) else 0.0,
+            'p50': float(np.percentile(ms, 50)) if len(ms) else 0.0,
+            'p95': float(np.percentile(ms, 95)) if len(ms) else 0.0,
+            'p99': float(np.percentile(ms, 99)) if len(ms) else 0.0,
+            'max': float(ms.max()) if len(ms) else 0.0,
+        },
+        'resources': resources,
+    }
+
+
+def environment():
+    versions = {}
+    for package in ('torch', 'transformers', 'flask', 'onnxruntime', 'numpy'):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            pass
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=AI_DIR, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'memory_gb': psutil.virtual_memory().total / 2 ** 30,
+        'packages': versions,
+        'commit': commit,
+    }
+
+
+def build_services(args, workdir):
+    """(detect service, chat service); started by us unless a URL was given"""
+    env = dict(os.environ)
+    env.update({'PALM_PROVIDER': 'fake', 'FAKE_LLM_LATENCY_MS': str(args.llm_latency_ms)})
+    if args.random_model:
+        registry = os.path.join(workdir, 'random_registry.json')
+        with open(registry, 'w') as f:
+            json.dump({'default': 'random', 'models': [{'name': 'random', 'path': 'random'}]}, f)
+        env['MODEL_REGISTRY'] = registry
+        env.setdefault('HF_HUB_OFFLINE', '1')
+
+    chat_port = detect_port = None
+    if args.chat_url:
+        chat = Service('chat', args.chat_url)
+    else:
+        chat_port = free_port()
+        chat = Service('chat', f"http://127.0.0.1:{chat_port}", [sys.executable, 'palm_api.py'],
+                       dict(env, PORT=str(chat_port)), log_path=os.path.join(workdir, 'chat.log'))
+    if args.detect_url:
+        detect = Service('detect', args.detect_url, ready_path='/ready')
+    else:
+        detect_port = free_port()
+        detect_env = dict(env, PORT=str(detect_port), PALM_CHAT_URL=f"{chat.url}/palm-chat")
+        if args.server == 'gunicorn':
+            command = [sys.executable, 'serve.py', '--bind', f"127.0.0.1:{detect_port}",
+                       '--workers', str(args.workers)]
+        else:
+            command = [sys.executable, 'detect_disease_api.py']
+        detect = Service('detect', f"http://127.0.0.1:{detect_port}", command, detect_env,
+                         ready_path='/ready', log_path=os.path.join(workdir, 'detect.log'))
+    return detect, chat
+
+
+def run(args):
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    for stage in stages:
+        if stage not in STAGES:
+            raise SystemExit(f"Unknown stage '{stage}'. Choose from: {', '.join(STAGES)}")
+    os.makedirs(args.output_dir, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    output = args.output or os.path.join(args.output_dir, f"benchmark-{stamp}.json")
+    workdir = tempfile.mkdtemp(prefix='benchmark-', dir=args.output_dir)
+
+    detect, chat = build_services(args, workdir)
+    needed = [detect] if any(stage != 'chat' for stage in stages) else []
+    if 'chat' in stages:
+        needed.append(chat)
+    unique = not args.cache
+    pool = image_pool(args.mix, args.per_class, args.seed) if detect in needed else None
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            'stages': stages, 'requests': args.requests, 'concurrency': args.concurrency,
+            'warmup': args.warmup, 'mix': args.mix, 'per_class': args.per_class, 'cache': args.cache,
+            'random_model': args.random_model, 'llm_latency_ms': args.llm_latency_ms,
+            'server': None if args.detect_url else args.server,
+            'workers': args.workers if args.server == 'gunicorn' and not args.detect_url else None,
+            'seed': args.seed,
+        },
+        'environment': environment(),
+        'services': {},
+        'stages': {},
+    }
+    try:
+        for service in needed:
+            service.start()
+        for service in needed:
+            report['services'][service.name] = {'url': service.url, 'startup_seconds': service.startup_seconds,
+                                                'started_here': service.process is not None}
+
+        count = args.requests + args.warmup
+        for stage in stages:
+            if stage == 'chat':
+                url, payloads = chat.url + '/palm-chat', chat_requests(count, unique, args.seed)
+                service = chat
+            else:
+                path = '/detect-disease' if stage == 'detect' else '/detect-disease/tiled'
+                url, payloads = detect.url + path, image_requests(pool, args.mix, count, unique, args.seed)
+                service = detect
+            print(f"Stage '{stage}': {args.requests} requests at concurrency {args.concurrency}...")
+            result = run_stage(stage, url, payloads, args.concurrency, args.warmup, needed)
+            result['server_stats'] = service.server_stats()
+            report['stages'][stage] = result
+            print_stage(stage, result)
+    finally:
+        for service in needed:
+            service.stop()
+
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output} (service logs in {workdir})")
+
+
+def print_stage(stage, result):
+    latency = result['latency_ms']
+    print(f"  {stage}: {result['ok']}/{result['requests']} ok, {result['requests_per_second']:.1f} req/s, "
+          f"p50 {latency['p50']:.0f} ms, p95 {latency['p95']:.0f} ms, p99 {latency['p99']:.0f} ms")
+    for name, usage in result['resources'].items():
+        print(f"    {name}: RSS peak {usage['rss_mb_peak']:.0f} MB, CPU {usage['cpu_percent']:.0f}%")
+    failed = {status: n for status, n in result['statuses'].items() if status != '200'}
+    if failed:
+        print(f"    failed: {failed}")
+
+
+# (metric, path in a stage result, True if higher is better)
+COMPARED_METRICS = [
+    ('req/s', ('requests_per_second',), True),
+    ('p50 ms', ('latency_ms', 'p50'), False),
+    ('p95 ms', ('latency_ms', 'p95'), False),
+    ('p99 ms', ('latency_ms', 'p99'), False),
+]
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    for key in ('concurrency', 'requests', 'random_model', 'server', 'workers', 'cache'):
+        if baseline['config'].get(key) != candidate['config'].get(key):
+            print(f"Note: {key} differs ({baseline['config'].get(key)} vs {candidate['config'].get(key)})")
+
+    regressions = 0
+    print(f"{'stage':8} {'metric':22} {'baseline':>10} {'candidate':>10} {'change':>8}")
+    for stage in baseline['stages']:
+        if stage not in candidate['stages']:
+            continue
+        old, new = baseline['stages'][stage], candidate['stages'][stage]
+        rows = list(COMPARED_METRICS)
+        for service in old['resources']:
+            if service in new['resources']:
+                rows.append((f"{service} RSS peak MB", ('resources', service, 'rss_mb_peak'), False))
+                rows.append((f"{service} CPU s", ('resources', service, 'cpu_seconds'), False))
+        for name, path, higher in rows:
+            a, b = old, new
+            for key in path:
+                a, b = a[key], b[key]
+            change = (b - a) / a if a else 0.0
+            worse = -change if higher else change
+            flag = ''
+            # Only throughput and latency gate the exit status; memory and CPU are informational
+            if worse > args.tolerance and path[0] != 'resources':
+                flag = '  REGRESSION'
+                regressions += 1
+            print(f"{stage:8} {name:22} {a:10.1f} {b:10.1f} {100 * change:+7.1f}%{flag}")
+    if regressions:
+        print(f"{regressions} metric(s) worse by more than {100 * args.tolerance:.0f}%")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_cmd = sub.add_parser('run', help='Start the services, replay traffic and write a JSON report')
+    run_cmd.add_argument('--stages', default='detect,chat', help=f"Comma-separated: {', '.join(STAGES)}")
+    run_cmd.add_argument('--requests', type=int, default=200, help='Measured requests per stage')
+    run_cmd.add_argument('--warmup', type=int, default=5, help='Unmeasured requests sent first in each stage')
+    run_cmd.add_argument('--concurrency', type=int, default=8)
+    run_cmd.add_argument('--mix', type=parse_mix, default=parse_mix('images=1,egypt=1'),
+                         help='Relative weights of the AI/Images and egypt_model_data images')
+    run_cmd.add_argument('--per-class', type=int, default=10, help='egypt_model_data images per class')
+    run_cmd.add_argument('--cache', action='store_true',
+                         help='Replay identical requests so the prediction and generation caches answer')
+    run_cmd.add_argument('--random-model', action='store_true',
+                         help='Serve a tiny randomly initialised classifier instead of the real model')
+    run_cmd.add_argument('--llm-latency-ms', type=float, default=200, help='Latency of the fake LLM')
+    run_cmd.add_argument('--server', choices=('flask', 'gunicorn'), default='flask',
+                         help='Run the detection API on the Flask dev server or via serve.py')
+    run_cmd.add_argument('--workers', type=int, default=2, help='gunicorn workers (--server gunicorn)')
+    run_cmd.add_argument('--detect-url', help='Benchmark an already running detection API instead')
+    run_cmd.add_argument('--chat-url', help='Benchmark an already running chat API instead')
+    run_cmd.add_argument('--seed', type=int, default=0)
+    run_cmd.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    run_cmd.add_argument('--output', help='Report path (default: <output-dir>/benchmark-<time>.json)')
+    compare_cmd = sub.add_parser('compare', help='Diff two reports; exit 1 if throughput or latency regressed')
+    compare_cmd.add_argument('baseline')
+    compare_cmd.add_argument('candidate')
+    compare_cmd.add_argument('--tolerance', type=float, default=0.1,
+                             help='Allowed relative change before a metric counts as a regression')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
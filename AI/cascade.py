@@ -0,0 +1,335 @@
+"""Confidence-gated two-stage classification for the disease classifier.
+
+Stage 1 runs the model on a reduced-resolution copy of each batch
+(CASCADE_RESOLUTION, 160 px by default: about a third of the 224 px cost
+for MobileNetV2) on a cheaper backend. Images whose top softmax probability
+reaches the threshold are answered there. The rest are escalated to the
+full-resolution model, or with CASCADE_ESCALATION=tta to multi-crop
+test-time augmentation (the image, its mirror and four corner crops, with
+the softmax averaged).
+
+The threshold is tuned per model on the local sample images. The run prints
+escalation rate, accuracy and latency for each candidate threshold and stores
+the lowest one that keeps agreement with the escalation stage at the target:
+
+  python cascade.py calibrate --per-class 20
+  python cascade.py --model mango calibrate --escalation tta --target-agreement 0.99
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from cascade_calibration import DEFAULT_CALIBRATION_PATH, load_calibration, resolve, save_calibration
+
+ESCALATIONS = ('full', 'tta')
+
+# Corner crops keep this fraction of each side before being resized back
+TTA_CROP_FRACTION = 0.875
+TTA_VIEWS = 6
+
+
+def downscale(pixel_values, size):
+    """Resize an (N, 3, H, W) batch to size x size"""
+    if not size or pixel_values.shape[-2:] == (size, size):
+        return pixel_values
+    return F.interpolate(pixel_values, size=(size, size), mode='bilinear',
+                         antialias=True, align_corners=False)
+
+
+def tta_views(pixel_values, crop_fraction=TTA_CROP_FRACTION):
+    """(TTA_VIEWS * N, 3, H, W): the batch, its mirror and four corner crops, view by view"""
+    height, width = pixel_values.shape[-2:]
+    ch, cw = int(round(height * crop_fraction)), int(round(width * crop_fraction))
+    corners = torch.cat([pixel_values[..., :ch, :cw], pixel_values[..., :ch, -cw:],
+                         pixel_values[..., -ch:, :cw], pixel_values[..., -ch:, -cw:]])
+    corners = F.interpolate(corners, size=(height, width), mode='bilinear', align_corners=False)
+    return torch.cat([pixel_values, pixel_values.flip(-1), corners])
+
+
+def top_k(probs, k):
+    """Per row: [[class index, probability], ...], most likely first"""
+    values, indices = probs.topk(min(k, probs.shape[-1]), dim=-1)
+    return [[[i, p] for i, p in zip(idx, val)] for idx, val in zip(indices.tolist(), values.tolist())]
+
+
+def accepts_resolution(backend, size):
+    """Whether a backend runs at size x size (ONNX exports and ViTs are fixed at 224)"""
+    try:
+        backend(torch.zeros(1, 3, size, size))
+        return True
+    except Exception:
+        return False
+
+
+class Cascade:
+    """Cheap stage first, escalating images below `threshold`; threshold None runs only the full model.
+
+    `run()` returns [pred_idx, confidence, top_k, stage] per image, where
+    stage is 'fast', 'full' or 'tta'.
+    """
+
+    def __init__(self, backend, fast_backend=None, resolution=None, threshold=None,
+                 escalation='full', k=3):
+        if escalation not in ESCALATIONS:
+            raise ValueError(f"Unknown escalation '{escalation}'. Choose one of: {', '.join(ESCALATIONS)}")
+        self.backend = backend
+        self.fast_backend = fast_backend or backend
+        self.resolution = resolution
+        self.threshold = threshold
+        self.escalation = escalation
+        self.k = k
+
+        self._lock = threading.Lock()
+        self.images = 0
+        self.answered_fast = 0
+        self.escalated = 0
+        self.seconds = {'fast': 0.0, escalation: 0.0}
+
+    def fast_probs(self, pixel_values):
+        return torch.softmax(self.fast_backend(downscale(pixel_values, self.resolution)), dim=-1)
+
+    def full_probs(self, pixel_values):
+        return torch.softmax(self.backend(pixel_values), dim=-1)
+
+    def tta_probs(self, pixel_values):
+        probs = torch.softmax(self.backend(tta_views(pixel_values)), dim=-1)
+        return probs.view(TTA_VIEWS, len(pixel_values), -1).mean(dim=0)
+
+    def escalate(self, pixel_values):
+        if self.escalation == 'tta':
+            return self.tta_probs(pixel_values)
+        return self.full_probs(pixel_values)
+
+    @torch.inference_mode()
+    def classify(self, pixel_values):
+        """(softmax probabilities (N, classes), stage per image)"""
+        n = len(pixel_values)
+        t0 = time.perf_counter()
+        if self.threshold is None:
+            probs = self.escalate(pixel_values)
+            fast_seconds = 0.0
+            stages = [self.escalation] * n
+            escalated = n
+        else:
+            probs = self.fast_probs(pixel_values)
+            fast_seconds = time.perf_counter() - t0
+            ambiguous = (probs.max(dim=-1).values < self.threshold).nonzero().flatten()
+            escalated = len(ambiguous)
+            stages = ['fast'] * n
+            if escalated:
+                probs[ambiguous] = self.escalate(pixel_values[ambiguous])
+                for i in ambiguous.tolist():
+                    stages[i] = self.escalation
+        seconds = time.perf_counter() - t0
+
+        with self._lock:
+            self.images += n
+            self.escalated += escalated
+            self.answered_fast += n - escalated
+            self.seconds['fast'] += fast_seconds
+            self.seconds[self.escalation] += seconds - fast_seconds
+        return probs, stages
+
+    def run(self, pixel_values):
+        probs, stages = self.classify(pixel_values)
+        return [[top[0][0], top[0][1], top, stage] for top, stage in zip(top_k(probs, self.k), stages)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.threshold is not None,
+                'threshold': self.threshold,
+                'resolution': self.resolution,
+                'escalation': self.escalation,
+                'images': self.images,
+                'answered_fast': self.answered_fast,
+                'escalated': self.escalated,
+                'escalation_rate': self.escalated / self.images if self.images else 0.0,
+                'seconds': dict(self.seconds),
+            }
+
+
+def load_cascade(model, backend, model_path, enabled=False, resolution=160, fast_backend='quantized',
+                 threshold=None, escalation=None, calibration_path=DEFAULT_CALIBRATION_PATH, k=3):
+    """Cascade for a served model; the threshold and escalation come from its calibration unless given"""
+    from inference_backends import load_backend
+
+    if not enabled:
+        return Cascade(backend, k=k)
+    calibration = load_calibration(model_path, calibration_path) or {}
+    explicit_threshold = threshold is not None
+    threshold, escalation = resolve(calibration, threshold, escalation)
+
+    try:
+        # Share the serving backend's weights when both stages use the same backend
+        fast = backend if fast_backend == backend.name else load_backend(fast_backend, model)
+    except Exception as e:
+        print(f"Cascade backend '{fast_backend}' unavailable ({e}); using the serving backend.")
+        fast = backend
+    if resolution and not accepts_resolution(fast, resolution):
+        print(f"Model {model_path} does not run at {resolution}px; the cascade's first stage stays at full size.")
+        resolution = None
+
+    if not explicit_threshold:
+        if calibration and (calibration.get('resolution') != resolution
+                            or calibration.get('escalation') != escalation):
+            print(f"Cascade calibration for {model_path} was made with different settings; re-run "
+                  f"`python cascade.py calibrate`.")
+    print(f"Cascade: {fast.name} at {resolution or 'full'}px, escalating below {threshold:.2f} to {escalation}")
+    return Cascade(backend, fast, resolution, threshold, escalation, k)
+
+
+def calibration_samples(per_class, label_table):
+    """(path, true class index or None) for the local sample images.
+
+    egypt_model_data folders give the true class when the model has it;
+    AI/Images photos are unlabelled and only count towards agreement.
+    """
+    from inference_backends import sample_images
+    from label_table import display_label
+
+    index = {info.label: info.index for info in label_table}
+    samples = []
+    for path in sample_images(per_class):
+        folder = os.path.basename(os.path.dirname(path))
+        samples.append((path, index.get(display_label(folder))))
+    return samples
+
+
+def calibrate(cascade, preprocessor, samples, target_agreement=0.99, thresholds=None):
+    """Per-threshold escalation rate, agreement with the escalation stage, accuracy and latency.
+
+    Every image goes through the fast, full and TTA stages one at a time
+    (batch size 1, as an interactive upload would), so each threshold's
+    outcome and mean latency follow without re-running the model.
+    """
+    if thresholds is None:
+        thresholds = [round(t, 2) for t in np.arange(0.0, 1.0001, 0.05)]
+    fast_conf, fast_pred, full_pred, tta_pred, truth = [], [], [], [], []
+    ms = {'fast': [], 'full': [], 'tta': []}
+    for path, label in samples:
+        with open(path, 'rb') as f:
+            pixel_values = preprocessor([preprocessor.decode(f)])
+        for stage, probs_fn in (('fast', cascade.fast_probs), ('full', cascade.full_probs),
+                                ('tta', cascade.tta_probs)):
+            t0 = time.perf_counter()
+            with torch.inference_mode():
+                probs = probs_fn(pixel_values)[0]
+            ms[stage].append((time.perf_counter() - t0) * 1000.0)
+            if stage == 'fast':
+                fast_conf.append(probs.max().item())
+                fast_pred.append(probs.argmax().item())
+            else:
+                (full_pred if stage == 'full' else tta_pred).append(probs.argmax().item())
+        truth.append(-1 if label is None else label)
+
+    fast_conf, fast_pred = np.array(fast_conf), np.array(fast_pred)
+    truth = np.array(truth)
+    labelled = truth >= 0
+    mean_ms = {stage: float(np.mean(values)) if values else 0.0 for stage, values in ms.items()}
+
+    def accuracy(pred):
+        return float((pred[labelled] == truth[labelled]).mean()) if labelled.any() else None
+
+    report = {
+        'images': len(samples),
+        'labelled_images': int(labelled.sum()),
+        'resolution': cascade.resolution,
+        'fast_backend': cascade.fast_backend.name,
+        'target_agreement': target_agreement,
+        'stages': {
+            stage: {'ms_per_image': mean_ms[stage], 'accuracy': accuracy(np.array(pred))}
+            for stage, pred in (('fast', fast_pred), ('full', full_pred), ('tta', tta_pred))
+        },
+        'escalations': {},
+    }
+    for escalation, reference in (('full', np.array(full_pred)), ('tta', np.array(tta_pred))):
+        rows = []
+        for threshold in thresholds:
+            escalate = fast_conf < threshold
+            pred = np.where(escalate, reference, fast_pred)
+            rows.append({
+                'threshold': threshold,
+                'escalation_rate': float(escalate.mean()),
+                'agreement': float((pred == reference).mean()),
+                'accuracy': accuracy(pred),
+                'ms_per_image': mean_ms['fast'] + float(escalate.mean()) * mean_ms[escalation],
+            })
+        # Lowest threshold (fewest escalations) that still matches the escalation stage often enough
+        chosen = next((row for row in rows if row['agreement'] >= target_agreement), rows[-1])
+        report['escalations'][escalation] = {'chosen': chosen, 'thresholds': rows}
+    return report
+
+
+def print_report(report):
+    print(f"{report['images']} images ({report['labelled_images']} labelled), "
+          f"first stage {report['fast_backend']} at {report['resolution'] or 'full'}px")
+    for stage, values in report['stages'].items():
+        accuracy = values['accuracy']
+        print(f"  {stage:>4} only: {values['ms_per_image']:7.1f} ms/image"
+              + (f", accuracy {accuracy:.3f}" if accuracy is not None else ""))
+    for escalation, result in report['escalations'].items():
+        print(f"\nEscalating to {escalation}:")
+        print("  threshold  escalated  agreement  accuracy  ms/image")
+        for row in result['thresholds']:
+            accuracy = f"{row['accuracy']:.3f}" if row['accuracy'] is not None else "    -"
+            marker = '  <-' if row is result['chosen'] else ''
+            print(f"  {row['threshold']:9.2f}  {row['escalation_rate']:9.1%}  {row['agreement']:9.3f}"
+                  f"  {accuracy:>8}  {row['ms_per_image']:8.1f}{marker}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', help='MODEL_REGISTRY model name (default: the default model)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    calibrate_cmd = sub.add_parser('calibrate', help='Tune the confidence threshold on the local sample images')
+    calibrate_cmd.add_argument('--per-class', type=int, default=20)
+    calibrate_cmd.add_argument('--escalation', choices=ESCALATIONS, default='full')
+    calibrate_cmd.add_argument('--target-agreement', type=float, default=0.99,
+                               help='Minimum top-1 agreement with the escalation stage')
+    calibrate_cmd.add_argument('--output', default=os.environ.get('CASCADE_CALIBRATION', DEFAULT_CALIBRATION_PATH))
+    calibrate_cmd.add_argument('--json', action='store_true', help='Print the full report as JSON')
+    args = parser.parse_args()
+
+    # Calibrate the cascade exactly as the service builds it (CASCADE_* settings)
+    os.environ['CASCADE'] = '1'
+    from detect_disease_api import default_model, models
+
+    name = args.model or default_model
+    try:
+        served = models.get(name)
+    except Exception as e:
+        raise SystemExit(f"Could not load model '{name}': {e}")
+    cascade = served.cascade
+    samples = calibration_samples(args.per_class, served.label_table)
+    report = calibrate(cascade, served.preprocessor, samples, args.target_agreement)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    chosen = report['escalations'][args.escalation]['chosen']
+    entry = {
+        'threshold': chosen['threshold'],
+        'escalation': args.escalation,
+        'resolution': cascade.resolution,
+        'fast_backend': cascade.fast_backend.name,
+        'escalation_rate': chosen['escalation_rate'],
+        'agreement': chosen['agreement'],
+        'accuracy': chosen['accuracy'],
+        'ms_per_image': chosen['ms_per_image'],
+        'images': report['images'],
+    }
+    path = save_calibration(models.specs[name].path, entry, args.output)
+    print(f"\nThreshold {chosen['threshold']:.2f} for '{name}' ({chosen['escalation_rate']:.0%} escalated) "
+          f"saved to {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Stored cascade thresholds (cascade_calibration.json), readable without torch.
+
+`python cascade.py calibrate` writes one entry per model path. The API also
+reads it at import time to key its prediction cache on the threshold that
+will actually be served.
+"""
+import json
+import os
+
+AI_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CALIBRATION_PATH = os.path.join(AI_DIR, 'cascade_calibration.json')
+DEFAULT_THRESHOLD = 0.9
+
+
+def load_calibration(model_path, path=DEFAULT_CALIBRATION_PATH):
+    """The stored calibration entry for a model, or None"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f).get(model_path)
+
+
+def save_calibration(model_path, entry, path=DEFAULT_CALIBRATION_PATH):
+    calibrations = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            calibrations = json.load(f)
+    calibrations[model_path] = entry
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(calibrations, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+    return path
+
+
+def resolve(calibration, threshold=None, escalation=None):
+    """(threshold, escalation) a cascade runs with: explicit settings first, then the calibration entry"""
+    calibration = calibration or {}
+    escalation = escalation or calibration.get('escalation', 'full')
+    if threshold is None:
+        threshold = calibration.get('threshold', DEFAULT_THRESHOLD)
+    return threshold, escalation
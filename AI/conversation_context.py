@@ -0,0 +1,160 @@
+from collections import deque
+
+SYSTEM_PREAMBLE = "You are AgroMind, an expert agricultural AI assistant specializing in crop disease detection and agricultural advice. You help farmers with CONCISE, FOCUSED advice. Keep responses brief and practical - aim for 2-3 sentences unless specifically asked for more detail.\n\n"
+
+# Rough chars-per-token ratio, only used for the reported token estimate
+CHARS_PER_TOKEN = 4
+
+
+def _clip(text, limit):
+    text = ' '.join(text.split())
+    return text if len(text) <= limit else text[:limit].rstrip() + "..."
+
+
+def render_turn(msg, max_chars):
+    """One exchange as it appears in the prompt; very long answers are clipped"""
+    assistant = msg.assistant
+    if len(assistant) > max_chars:
+        assistant = assistant[:max_chars].rstrip() + "..."
+    return f"User: {msg.user}\nAssistant: {assistant}\n\n"
+
+
+def summarize_turn(msg):
+    """Single summary line for a turn compacted out of the verbatim history"""
+    answer = msg.assistant.split('. ')[0]
+    return f"- User asked: {_clip(msg.user, 100)} -> advised: {_clip(answer, 150)}\n"
+
+
+class ConversationContext:
+    """Rendered history for one session, updated one turn at a time.
+
+    Recent turns are kept verbatim while they fit `max_chars` (and
+    `max_turns`); older ones are compacted into a rolling summary of at most
+    `summary_max_chars`, oldest lines dropping off first.
+
+    The state can be saved with `state()` and picked up again with
+    `restore()`, so stores that reload a session's messages on every request
+    resume from the last rendered turn (`last_seq`) instead of starting over.
+    """
+
+    __slots__ = ('max_chars', 'max_turns', 'summary_max_chars', 'turns', 'turn_chars',
+                 'summary', 'summary_chars', 'last_message', 'last_seq', 'rendered',
+                 'compacted', 'rebuilds', 'last_prompt_chars', 'revision')
+
+    def __init__(self, max_chars=6000, max_turns=10, summary_max_chars=1000):
+        self.max_chars = max_chars
+        self.max_turns = max_turns
+        self.summary_max_chars = summary_max_chars
+        self.rebuilds = 0
+        self.last_prompt_chars = 0
+        # Bumped whenever the rendered history changes, so callers know when to save it
+        self.revision = 0
+        self.reset()
+
+    def reset(self):
+        self.turns = deque()  # (summary line, rendered text)
+        self.turn_chars = 0
+        self.summary = deque()
+        self.summary_chars = 0
+        self.last_message = None
+        self.last_seq = None
+        self.rendered = None
+        self.compacted = 0
+        self.revision += 1
+
+    def _add_summary(self, line):
+        self.summary.append(line)
+        self.summary_chars += len(line)
+        while self.summary_chars > self.summary_max_chars and len(self.summary) > 1:
+            self.summary_chars -= len(self.summary.popleft())
+
+    def _append(self, msg):
+        text = render_turn(msg, self.max_chars // 2)
+        self.turns.append((summarize_turn(msg), text))
+        self.turn_chars += len(text)
+        while len(self.turns) > 1 and (
+                self.turn_chars > self.max_chars or len(self.turns) > self.max_turns):
+            line, old_text = self.turns.popleft()
+            self.turn_chars -= len(old_text)
+            self._add_summary(line)
+            self.compacted += 1
+        self.last_message = msg
+        self.last_seq = msg.seq
+        self.rendered = None
+        self.revision += 1
+
+    def sync(self, messages):
+        """Catch up with the session's messages, rendering only the new turns"""
+        if self.last_message is None and self.last_seq is None:
+            start = 0
+        else:
+            start = None
+            for i in range(len(messages) - 1, -1, -1):
+                msg = messages[i]
+                if msg is self.last_message or (self.last_seq is not None and msg.seq == self.last_seq):
+                    start = i + 1
+                    break
+            if start is None:
+                # History was cleared or reloaded; start again from what is stored
+                self.reset()
+                self.rebuilds += 1
+                start = 0
+        for msg in messages[start:]:
+            self._append(msg)
+        return self
+
+    def history(self):
+        """Preamble, rolling summary and recent turns, ready for the current exchange"""
+        if self.rendered is None:
+            parts = [SYSTEM_PREAMBLE]
+            if self.summary:
+                parts.append("Summary of earlier conversation:\n")
+                parts.extend(self.summary)
+                parts.append("\n")
+            if self.turns:
+                parts.append("Previous conversation:\n")
+                parts.extend(text for _, text in self.turns)
+            parts.append("Current conversation:\n")
+            self.rendered = ''.join(parts)
+        return self.rendered
+
+    @property
+    def size(self):
+        """Characters held for this context, including the cached rendered prompt"""
+        return (self.turn_chars + sum(len(line) for line, _ in self.turns)
+                + self.summary_chars + len(self.rendered or ''))
+
+    def state(self):
+        """JSON-serialisable snapshot of the rendered history and its cursor"""
+        return {
+            'turns': [list(turn) for turn in self.turns],
+            'summary': list(self.summary),
+            'compacted': self.compacted,
+            'last_seq': self.last_seq,
+            'last_prompt_chars': self.last_prompt_chars,
+        }
+
+    def restore(self, state):
+        """Resume from a state() snapshot; sync() then renders only later messages"""
+        self.reset()
+        for line, text in state['turns']:
+            self.turns.append((line, text))
+            self.turn_chars += len(text)
+        for line in state['summary']:
+            self._add_summary(line)
+        self.compacted = state['compacted']
+        self.last_seq = state['last_seq']
+        self.last_prompt_chars = state.get('last_prompt_chars', 0)
+        return self
+
+    def stats(self):
+        return {
+            'turns_in_context': len(self.turns),
+            'compacted_turns': self.compacted,
+            'history_chars': self.turn_chars,
+            'summary_chars': self.summary_chars,
+            'last_prompt_chars': self.last_prompt_chars,
+            'last_prompt_tokens_est': self.last_prompt_chars // CHARS_PER_TOKEN,
+            'max_chars': self.max_chars,
+            'rebuilds': self.rebuilds,
+        }
@@ -0,0 +1,170 @@
+"""Crop recommendation from soil nutrients and climate (Data/Crop_recommendation.csv).
+
+A distance-weighted k-nearest-neighbour model over the standardized table
+(see knn_recommender.py), serialized to a single .npz. Scoring is fully
+vectorized: a block of samples is compared against every reference row with
+one matrix product, so bulk requests with thousands of field samples cost a
+few milliseconds.
+
+Usage:
+  python crop_recommendation.py build
+  python crop_recommendation.py bench --samples 20000
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import time
+
+import numpy as np
+
+from knn_recommender import KnnRecommender, file_digest, load_or_build, standardization
+
+AI_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_PATH = os.path.join(AI_DIR, 'Data', 'Crop_recommendation.csv')
+DEFAULT_MODEL_PATH = os.path.join(AI_DIR, 'recommenders', 'crop_knn.npz')
+FEATURES = ('N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall')
+
+
+def load_table(path=DEFAULT_DATA_PATH):
+    """(features float32 [n, 7], label strings) from the CSV"""
+    with open(path, encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    X = np.array([[float(r[name]) for name in FEATURES] for r in rows], dtype=np.float32)
+    return X, [r['label'] for r in rows]
+
+
+class CropRecommender(KnnRecommender):
+    """Distance-weighted kNN over the whole standardized table"""
+
+    label = 'crop'
+
+    def __init__(self, X, y, classes, mean, std, k=15, digest=''):
+        super().__init__(X, y, classes, mean, std, k, digest)
+
+    @classmethod
+    def fit(cls, X, labels, k=15, digest=''):
+        classes = sorted(set(labels))
+        index = {c: i for i, c in enumerate(classes)}
+        mean, std = standardization(X)
+        return cls((X - mean) / std, [index[c] for c in labels], classes, mean, std, k, digest)
+
+    def scores(self, samples):
+        """Class probabilities [m, n_classes] for raw (unscaled) samples [m, 7]"""
+        return self.votes(self.standardize(samples))
+
+    def recommend(self, samples, top_k=3):
+        """Top-k crops per sample as lists of {'crop', 'score'}"""
+        t0 = time.perf_counter()
+        return self.top(self.scores(samples), top_k, t0)
+
+
+def build_model(data_path=DEFAULT_DATA_PATH, model_path=DEFAULT_MODEL_PATH, k=15):
+    X, labels = load_table(data_path)
+    model = CropRecommender.fit(X, labels, k=k, digest=file_digest(data_path))
+    model.save(model_path)
+    return model
+
+
+def load_recommender(model_path=DEFAULT_MODEL_PATH, data_path=DEFAULT_DATA_PATH):
+    """Load the serialized model, rebuilding it if missing or older than the CSV"""
+    return load_or_build(CropRecommender, model_path, data_path, build_model)
+
+
+def parse_samples(payload):
+    """Feature matrix from a request: one sample, a list of samples or column arrays.
+
+    Samples may be dicts keyed by feature name or lists in FEATURES order.
+    Raises ValueError with a client-facing message on bad input.
+    """
+    if 'columns' in payload:
+        columns = payload['columns']
+        if not isinstance(columns, dict):
+            raise ValueError("'columns' must be an object of feature arrays")
+        missing = [name for name in FEATURES if name not in columns]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        try:
+            X = np.stack([np.asarray(columns[name], dtype=np.float32) for name in FEATURES], axis=1)
+        except (TypeError, ValueError):
+            raise ValueError("Columns must be numeric arrays of equal length")
+    else:
+        samples = payload['samples'] if 'samples' in payload else [payload]
+        if not isinstance(samples, list) or not samples:
+            raise ValueError("'samples' must be a non-empty list")
+        try:
+            X = np.array([[s[name] for name in FEATURES] if isinstance(s, dict) else s
+                          for s in samples], dtype=np.float32)
+        except KeyError as e:
+            raise ValueError(f"Missing field {e} (required: {', '.join(FEATURES)})")
+        except (TypeError, ValueError):
+            raise ValueError(f"Samples must be numeric: {', '.join(FEATURES)}")
+    if X.ndim != 2 or X.shape[1] != len(FEATURES):
+        raise ValueError(f"Each sample needs {len(FEATURES)} values: {', '.join(FEATURES)}")
+    if not np.isfinite(X).all():
+        raise ValueError("Samples contain non-finite values")
+    return X
+
+
+def columns_from_csv(text):
+    """Column dict (for parse_samples) from CSV text with a header row"""
+    rows = list(csv.DictReader(io.StringIO(text)))
+    if not rows:
+        raise ValueError("CSV has no rows")
+    try:
+        return {name: [float(r[name]) for r in rows] for name in rows[0]
+                if name in FEATURES}
+    except (TypeError, ValueError):
+        raise ValueError(f"CSV columns {', '.join(FEATURES)} must be numeric")
+
+
+def benchmark(model, n_samples=20000, top_k=3, seed=0):
+    """Hold-out accuracy on the CSV and bulk scoring throughput on jittered rows"""
+    X, labels = load_table()
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(X))
+    test, train = order[:len(X) // 5], order[len(X) // 5:]
+    holdout = CropRecommender.fit(X[train], [labels[i] for i in train], k=model.k)
+    predicted = np.argmax(holdout.scores(X[test]), axis=1)
+    accuracy = float(np.mean([holdout.classes[p] == labels[i] for p, i in zip(predicted, test)]))
+
+    samples = X[rng.integers(len(X), size=n_samples)] * rng.normal(1.0, 0.05, (n_samples, X.shape[1]))
+    samples = samples.astype(np.float32)
+    model.recommend(samples[:10], top_k)  # warm up BLAS
+    t0 = time.perf_counter()
+    model.recommend(samples, top_k)
+    bulk = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for row in samples[:1000]:
+        model.recommend(row[None, :], top_k)
+    single = (time.perf_counter() - t0) / min(1000, n_samples)
+    return {
+        'holdout_accuracy': accuracy,
+        'bulk_samples': n_samples,
+        'bulk_seconds': bulk,
+        'bulk_samples_per_second': n_samples / bulk,
+        'single_request_ms': single * 1000.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=os.environ.get('CROP_MODEL_PATH', DEFAULT_MODEL_PATH))
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_cmd = sub.add_parser('build', help='Fit the model from the CSV and save it')
+    build_cmd.add_argument('--data', default=DEFAULT_DATA_PATH)
+    build_cmd.add_argument('-k', type=int, default=15)
+    bench_cmd = sub.add_parser('bench', help='Accuracy and throughput benchmark')
+    bench_cmd.add_argument('--samples', type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        model = build_model(args.data, args.model, k=args.k)
+        print(f"Saved {len(model.X)} rows, {len(model.classes)} crops to {args.model}")
+        return
+    print(json.dumps(benchmark(load_recommender(args.model), args.samples), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,235 @@
+import time
+# Boot-to-ready is measured from here (see startup_report())
+STARTUP_STARTED = time.perf_counter()
 import os
-from flask import Flask, request, jsonify
+import io
+import tarfile
+import zipfile
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from PIL import Image
-import torch
-from transformers import AutoImageProcessor, AutoModelForImageClassification
-import requests
 import json
+import threading
+# torch, transformers and the modules built on them are imported when the
+# first model is loaded (ServedModel), not with this module
+from inference_batcher import MicroBatcher
+from prediction_cache import PredictionCache, content_key
+from label_table import build_label_table, display_label, parse_label
+from model_registry import RANDOM_MODEL, ModelRegistry, load_specs, random_classifier
+from cascade_calibration import DEFAULT_CALIBRATION_PATH, load_calibration, resolve as resolve_cascade
+from model_snapshot import DEFAULT_SNAPSHOT_DIR, find_snapshot, load_snapshot, read_id2label, timed
+import tiled_analysis
+from palm_enrichment import PalmEnrichment
+from metrics import Registry, install as install_metrics, load_profiler
+import crop_recommendation
+import fertilizer_recommendation
 
 app = Flask(__name__)
 CORS(app)
 
-# Enhanced model with 38 classes supporting more Egyptian crops
+# Per-stage timers, prediction counters and cache/queue state at GET /metrics
+# (Prometheus format, see metrics.py). PROFILE_SLOW_MS=<ms> also writes
+# flame-graph stacks of requests slower than that to PROFILE_DIR.
+metrics = Registry('disease_api')
+install_metrics(app, metrics, load_profiler())
+predictions_total = metrics.counter('predictions', 'Detection results returned, per model and label',
+                                    ['model', 'label'])
+palm_seconds = metrics.histogram('palm_seconds', 'Latency of Palm AI /palm-chat calls')
+palm_errors = metrics.counter('palm_errors', 'Failed Palm AI /palm-chat calls', ['error'])
+
+# Default model: 38 PlantVillage classes supporting more Egyptian crops.
+# MODEL_REGISTRY points at a JSON file listing more models to serve next to it
+# (see model_registry.py); they are loaded on first use and kept within
+# MODEL_MEMORY_BUDGET_MB (0: no limit), least recently used unloaded first.
 MODEL_NAME = "linkanjarad/mobilenet_v2_1.0_224-plant-disease-identification"
+MODEL_REGISTRY = os.environ.get("MODEL_REGISTRY")
+MODEL_MEMORY_BUDGET_MB = float(os.environ.get("MODEL_MEMORY_BUDGET_MB", "0"))
+
+# CPU inference backend: eager | torchscript | compile | quantized | onnx.
+# TORCH_NUM_THREADS also sets the onnxruntime intra-op thread count.
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "eager")
+# Non-eager backends hold their own copy of the weights, so the fp32 model is
+# released once they are built; KEEP_EAGER_MODEL=1 keeps it (export/parity CLIs)
+KEEP_EAGER_MODEL = os.environ.get("KEEP_EAGER_MODEL", "0") == "1"
+TORCH_NUM_THREADS = int(os.environ.get("TORCH_NUM_THREADS", "0"))
+TORCH_INTEROP_THREADS = os.environ.get("TORCH_INTEROP_THREADS")
+
+# Cold start. Hub models with a local snapshot in MODEL_SNAPSHOT_DIR (made by
+# `python model_snapshot.py save`), and local model directories with
+# safetensors weights, load offline with memory-mapped weights
+# (MODEL_SNAPSHOT=0 to always go through from_pretrained). LAZY_STARTUP=1
+# defers torch, transformers and the default model to warm_up(), so
+# importing this module is cheap and /ready reports 503 until it is done.
+MODEL_SNAPSHOT = os.environ.get("MODEL_SNAPSHOT", "1") == "1"
+MODEL_SNAPSHOT_DIR = os.environ.get("MODEL_SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+LAZY_STARTUP = os.environ.get("LAZY_STARTUP", "0") == "1"
+
+# Draft-mode JPEG decode + vectorized NumPy preprocessing instead of
+# AutoImageProcessor on the request path (FAST_PREPROCESS=0 to disable).
+FAST_PREPROCESS = os.environ.get("FAST_PREPROCESS", "1") == "1"
+
+# Micro-batching: concurrent uploads are grouped into one forward pass of up to
+# BATCH_MAX_SIZE images, waiting at most BATCH_MAX_WAIT_MS for stragglers.
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "10"))
+# Longest a request waits for its micro-batch result before failing
+BATCH_TIMEOUT = float(os.environ.get("BATCH_TIMEOUT", "30"))
+WARM_UP_TIMEOUT = float(os.environ.get("WARM_UP_TIMEOUT", "600"))
+
+# Confidence-gated cascade (CASCADE=1, see cascade.py): a cheap pass at
+# CASCADE_RESOLUTION answers confident images and only the rest are escalated
+# to the full model (or multi-crop TTA). The threshold comes from
+# `python cascade.py calibrate` unless CASCADE_THRESHOLD is set.
+CASCADE = os.environ.get("CASCADE", "0") == "1"
+CASCADE_RESOLUTION = int(os.environ.get("CASCADE_RESOLUTION", "160"))
+CASCADE_BACKEND = os.environ.get("CASCADE_BACKEND", "quantized")
+CASCADE_THRESHOLD = os.environ.get("CASCADE_THRESHOLD")
+CASCADE_ESCALATION = os.environ.get("CASCADE_ESCALATION")
+# Default: cascade.DEFAULT_CALIBRATION_PATH
+CASCADE_CALIBRATION = os.environ.get("CASCADE_CALIBRATION")
+# Alternatives returned with every prediction
+TOP_K = int(os.environ.get("TOP_K", "3"))
+
+
+class ServedModel:
+    """One loaded classifier with its own backend, preprocessor, label table and batcher"""
+
+    def __init__(self, spec):
+        self.name = spec.name
+        # Seconds per load phase; the default model's are part of startup_report()
+        self.load_phases = {}
+        with timed(self.load_phases, 'imports'):
+            from inference_backends import EAGER_BACKENDS, backend_bytes, configure_threads, load_backend
+            from fast_preprocess import load_preprocessor
+            from cascade import load_cascade
+        configure_threads(TORCH_NUM_THREADS, TORCH_INTEROP_THREADS)
+
+        self.snapshot = find_snapshot(spec.path, MODEL_SNAPSHOT_DIR) if MODEL_SNAPSHOT else None
+        if spec.path == RANDOM_MODEL:
+            with timed(self.load_phases, 'weights'):
+                self.processor, self.model = random_classifier(random_model_labels())
+        elif self.snapshot is not None:
+            self.processor, self.model = load_snapshot(self.snapshot, self.load_phases)
+        else:
+            with timed(self.load_phases, 'imports'):
+                from transformers import AutoImageProcessor, AutoModelForImageClassification
+            with timed(self.load_phases, 'config'):
+                self.processor = AutoImageProcessor.from_pretrained(spec.path)
+            with timed(self.load_phases, 'weights'):
+                self.model = AutoModelForImageClassification.from_pretrained(
+                    spec.path, ignore_mismatched_sizes=True)
+        self.config = self.model.config
+        source = f"snapshot {self.snapshot}" if self.snapshot else spec.path
+        print(f"Successfully loaded model '{spec.name}': {source} ({len(self.config.id2label)} labels)")
+
+        backend = spec.backend or INFERENCE_BACKEND
+        # Quantize the fp32 model itself unless it is still needed afterwards
+        # (export/parity, or an eager-style cascade first stage built from it)
+        inplace = not KEEP_EAGER_MODEL and (not CASCADE or CASCADE_BACKEND == backend)
+        onnx_path = spec.onnx_path or (
+            os.environ.get("ONNX_MODEL_PATH") if spec.path == MODEL_NAME else None)
+        with timed(self.load_phases, 'backend'):
+            try:
+                self.backend = load_backend(
+                    backend, self.model, onnx_path=onnx_path, num_threads=TORCH_NUM_THREADS, inplace=inplace)
+            except Exception as e:
+                print(f"Error loading inference backend '{backend}': {e}. Falling back to eager.")
+                self.backend = load_backend("eager", self.model)
+        print(f"Inference backend: {self.backend.name}")
+
+        self.preprocessor = load_preprocessor(self.processor, fast=FAST_PREPROCESS)
+
+        # Resolve plant, disease, advice and messages for every class index once, so
+        # the request path is a single lookup and unparseable labels show up at load.
+        self.label_table, label_problems = build_label_table(
+            self.config.id2label, MODEL_PLANT_PREFIXES, advice_dict)
+        for problem in label_problems:
+            print(f"Warning: {spec.name} label {problem}")
+
+        with timed(self.load_phases, 'cascade'):
+            self.cascade = load_cascade(
+                self.model, self.backend, spec.path, enabled=CASCADE, resolution=CASCADE_RESOLUTION,
+                fast_backend=CASCADE_BACKEND,
+                threshold=float(CASCADE_THRESHOLD) if CASCADE_THRESHOLD else None,
+                escalation=CASCADE_ESCALATION, calibration_path=CASCADE_CALIBRATION or DEFAULT_CALIBRATION_PATH,
+                k=TOP_K)
+
+        # Weights actually served, each set counted once: eager-style backends
+        # run self.model itself, the others hold their own copy
+        served = {id(b): b for b in (self.cascade.backend, self.cascade.fast_backend)}.values()
+        weights = {'eager' if b.name in EAGER_BACKENDS else id(b): backend_bytes(b, self.model) for b in served}
+        self.memory_bytes = sum(weights.values())
+        if not KEEP_EAGER_MODEL and not any(b.name in EAGER_BACKENDS for b in served):
+            # Only the backends' own copies stay resident; self.config keeps the labels
+            self.model = None
+
+        self.batcher = MicroBatcher(self.predict_batch, max_batch_size=BATCH_MAX_SIZE,
+                                    max_wait_ms=BATCH_MAX_WAIT_MS, timeout=BATCH_TIMEOUT)
+
+    def predict_batch(self, pixel_batches):
+        """Classify preprocessed images, return [pred_idx, confidence, top_k, stage] per image"""
+        import torch
+        return self.cascade.run(torch.cat(pixel_batches, dim=0))
+
+    def close(self):
+        self.batcher.close()
+
+    def stats(self):
+        return {
+            'backend': self.backend.name,
+            'snapshot': self.snapshot,
+            'load_phases': self.load_phases,
+            'preprocessor': self.preprocessor.name,
+            'batcher': self.batcher.stats(),
+            'cascade': self.cascade.stats(),
+        }
+
+
+# Palm AI enrichment runs off the request path on a pooled keep-alive session
+# with bounded concurrency and a circuit breaker.
+palm_enrichment = PalmEnrichment(
+    os.environ.get("PALM_CHAT_URL", "http://localhost:5005/palm-chat"),
+    max_concurrency=int(os.environ.get("ENRICHMENT_MAX_CONCURRENCY", "4")),
+    max_pending=int(os.environ.get("ENRICHMENT_MAX_PENDING", "64")),
+    timeout=float(os.environ.get("ENRICHMENT_TIMEOUT", "30")),
+    # Shared by every worker so a poll can reach any of them (serve.py sets it)
+    db_path=os.environ.get("ENRICHMENT_DB_PATH") or None,
+    observer=lambda seconds, error: (palm_seconds.observe(seconds) if error is None
+                                     else palm_errors.inc(error=type(error).__name__)))
+
+# Crop recommendation from soil and climate readings (Data/Crop_recommendation.csv),
+# a vectorized kNN model built once and loaded from an .npz file.
+RECOMMEND_MAX_SAMPLES = int(os.environ.get("RECOMMEND_MAX_SAMPLES", "100000"))
 try:
-    processor = AutoImageProcessor.from_pretrained(MODEL_NAME)
-    model = AutoModelForImageClassification.from_pretrained(
-        MODEL_NAME, ignore_mismatched_sizes=True)
-    print(f"Successfully loaded enhanced model: {MODEL_NAME}")
-    print("Model supports 38 plant disease classes including Egyptian crops")
-    print("Model config id2label:", model.config.id2label)
+    crop_recommender = crop_recommendation.load_recommender(
+        os.environ.get("CROP_MODEL_PATH", crop_recommendation.DEFAULT_MODEL_PATH))
 except Exception as e:
-    print(f"Error loading model {MODEL_NAME}: {e}")
-    processor = None
-    model = None
+    print(f"Crop recommendation unavailable: {e}")
+    crop_recommender = None
+
+# Fertilizer recommendation (Data/data_core.csv): kNN within (soil, crop)
+# partitions. /detect-disease adds one when soil readings are sent with the image.
+try:
+    fertilizer_recommender = fertilizer_recommendation.load_recommender(
+        os.environ.get("FERTILIZER_MODEL_PATH", fertilizer_recommendation.DEFAULT_MODEL_PATH))
+except Exception as e:
+    print(f"Fertilizer recommendation unavailable: {e}")
+    fertilizer_recommender = None
+
+# Batch endpoint: uploads are decoded and classified BATCH_ENDPOINT_CHUNK images
+# at a time so the first results stream back before the last image is decoded.
+BATCH_ENDPOINT_CHUNK = int(os.environ.get("BATCH_ENDPOINT_CHUNK", "16"))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff')
+
+# Tiled analysis of whole-canopy photos (see tiled_analysis.py): the photo is
+# decoded with its long side at TILE_MAX_SIDE px (a request may ask for up to
+# TILE_MAX_SIDE_LIMIT), cut into tiles overlapping by TILE_OVERLAP, and tiles
+# whose grey-level standard deviation is below TILE_MIN_STD are skipped. The
+# kept tiles are classified BATCH_ENDPOINT_CHUNK at a time.
+TILE_MAX_SIDE = int(os.environ.get("TILE_MAX_SIDE", str(tiled_analysis.DEFAULT_MAX_SIDE)))
+TILE_MAX_SIDE_LIMIT = int(os.environ.get("TILE_MAX_SIDE_LIMIT", "2240"))
+TILE_OVERLAP = float(os.environ.get("TILE_OVERLAP", str(tiled_analysis.DEFAULT_OVERLAP)))
+TILE_MIN_STD = float(os.environ.get("TILE_MIN_STD", str(tiled_analysis.DEFAULT_MIN_STD)))
 
 # ENHANCED_PLANT_MAPPING for 38-class PlantVillage model supporting Egyptian crops
 KNOWN_PLANT_MAPPING = {
@@ -71,7 +278,13 @@ KNOWN_PLANT_MAPPING = {
     "strawberries": "Strawberry",
     "soybean": "Soybean",
     "soybeans": "Soybean",
-    "squash": "Squash"
+    "squash": "Squash",
+
+    # Egyptian mango orchards (egypt_model_data, served by a separately trained model)
+    "mango": "Mango",
+    "mangoes": "Mango",
+    "مانجو": "Mango",  # Arabic for mango
+    "مانجا": "Mango"
 }
 
 MODEL_PLANT_PREFIXES = sorted(
@@ -184,153 +397,688 @@ advice_dict = {
     # Additional Pepper Diseases (Extended)
     'Bell Pepper with Anthracnose': "Apply fungicides (copper, chlorothalonil) preventively. Remove infected fruit immediately. Improve air circulation. Practice crop rotation. Avoid overhead watering.",
     'Bell Pepper with Phytophthora Blight': "CRITICAL: Improve drainage immediately. Use raised beds. Apply fungicides (metalaxyl, copper) preventively. Remove infected plants. Practice crop rotation.",
-    'Bell Pepper with Cercospora Leaf Spot': "Apply fungicides (chlorothalonil, copper) preventively. Remove infected leaves. Improve air circulation. Avoid overhead watering. Practice crop rotation."
+    'Bell Pepper with Cercospora Leaf Spot': "Apply fungicides (chlorothalonil, copper) preventively. Remove infected leaves. Improve air circulation. Avoid overhead watering. Practice crop rotation.",
+
+    # MANGO DISEASES - egypt_model_data classes (folder labels like 'Mango___Die Back')
+    'Mango with Anthracnose': "Spray copper oxychloride or mancozeb at flowering and fruit set, especially in humid weather. Prune dense canopy and remove fallen leaves, twigs and infected fruit.",
+    'Mango with Bacterial Canker': "Apply copper-based bactericides after rain and at fruit set. Prune and burn infected twigs. Avoid wounding fruit and use windbreaks to reduce spread.",
+    'Mango with Cutting Weevil': "Collect and destroy fallen cut shoots and leaves daily. Rake the soil under trees to expose pupae. Protect new flushes with a recommended insecticide.",
+    'Mango with Die Back': "Prune affected branches 5-10 cm below the dead tissue and seal the cuts with Bordeaux paste. Spray copper oxychloride after pruning. Avoid water stress.",
+    'Mango with Gall Midge': "Remove and destroy galled leaves and shoots. Rake the soil under the canopy to kill pupae. Spray a recommended insecticide at bud burst and new flush.",
+    'Mango with Powdery Mildew': "Apply wettable sulfur or a systemic fungicide (hexaconazole) at panicle emergence and repeat after 2 weeks. Remove infected panicles.",
+    'Mango with Sooty Mould': "Control the honeydew-producing insects (hoppers, scales, mealybugs) first. Wash leaves with a dilute starch spray, then prune for light and air circulation."
 }
 
+def random_model_labels():
+    """Classes of the random benchmark model: the advice labels with a known plant"""
+    return [label for label in advice_dict if parse_label(label, MODEL_PLANT_PREFIXES)[0]]
 
-def send_to_palm_ai(disease_context, user_prompt="", session_id="default"):
-    """Send disease detection results to Palm AI for concise, focused response"""
+
+def config_crops(spec):
+    """Plants a model can recognise, read from its config without loading weights"""
     try:
-        palm_url = "http://localhost:5005/palm-chat"
+        snapshot = find_snapshot(spec.path, MODEL_SNAPSHOT_DIR) if MODEL_SNAPSHOT else None
+        if spec.path == RANDOM_MODEL:
+            id2label = dict(enumerate(random_model_labels()))
+        elif snapshot is not None:
+            id2label = read_id2label(snapshot)
+        else:
+            from transformers import AutoConfig
+            id2label = AutoConfig.from_pretrained(spec.path).id2label
+    except Exception as e:
+        print(f"Could not read labels of model '{spec.name}': {e}")
+        return []
+    plants = {parse_label(display_label(label), MODEL_PLANT_PREFIXES)[0] for label in id2label.values()}
+    return sorted(plant for plant in plants if plant)
 
-        # Create a very specific concise prompt
-        if not user_prompt:
-            user_prompt = "Give me ONLY the essential treatment in 1-2 sentences. No explanations, no background, just the immediate action needed."
 
-        payload = {
-            'prompt': user_prompt,
-            'session_id': session_id,
-            'disease_context': disease_context
-        }
+model_specs, default_model = load_specs(MODEL_REGISTRY, 'default', MODEL_NAME)
+models = ModelRegistry(model_specs, default_model, ServedModel,
+                       memory_budget_bytes=MODEL_MEMORY_BUDGET_MB * 2 ** 20,
+                       aliases=KNOWN_PLANT_MAPPING)
+if len(model_specs) > 1:
+    # Models without an explicit crop list serve every plant their labels name
+    models.set_crops({spec.name: config_crops(spec) for spec in model_specs if not spec.crops})
+if not LAZY_STARTUP:
+    try:
+        models.get(default_model)
+    except Exception as e:
+        print(f"Error loading model {models.specs[default_model].path}: {e}")
 
-        response = requests.post(palm_url, json=payload, timeout=30)
-        if response.status_code == 200:
-            ai_response = response.json().get('response', 'AI response not available')
 
-            # Aggressive truncation to ensure concise advice
-            sentences = ai_response.split('.')
-            if len(sentences) > 3:
-                # Keep only first 2-3 sentences
-                ai_response = '. '.join(sentences[:3]) + '.'
+def prediction_cache_path(name):
+    """PREDICTION_CACHE_PATH for the default model, a sibling file for each other model"""
+    path = os.environ.get("PREDICTION_CACHE_PATH")
+    if not path or name == default_model:
+        return path or None
+    root, ext = os.path.splitext(path)
+    return f"{root}.{name}{ext}"
 
-            # Final character limit
-            if len(ai_response) > 250:
-                ai_response = ai_response[:250] + "..."
 
-            return ai_response
-        else:
-            # Fallback to basic advice without AI enhancement
-            return disease_context
+# Prediction cache keyed on the upload bytes (plus an optional perceptual-hash
+# tier for re-encoded copies), one per model and kept while that model is
+# unloaded. PREDICTION_CACHE_PATH adds a sqlite tier that survives restarts;
+# it is wiped automatically when a model's path, backend, preprocessing,
+# cascade (including a re-run calibration) or top-k settings change.
+def prediction_namespace(spec):
+    """Everything that changes what a model predicts for the same upload"""
+    cascade = "cascade=off"
+    if CASCADE:
+        threshold, escalation = resolve_cascade(
+            load_calibration(spec.path, CASCADE_CALIBRATION or DEFAULT_CALIBRATION_PATH),
+            float(CASCADE_THRESHOLD) if CASCADE_THRESHOLD else None, CASCADE_ESCALATION)
+        cascade = f"cascade={CASCADE_RESOLUTION}/{CASCADE_BACKEND}/{threshold}/{escalation}"
+    return (f"{spec.path}|backend={spec.backend or INFERENCE_BACKEND}|fast={FAST_PREPROCESS}|"
+            f"{cascade}|top_k={TOP_K}")
+
+
+prediction_caches = {
+    spec.name: PredictionCache(
+        prediction_namespace(spec),
+        max_entries=int(os.environ.get("PREDICTION_CACHE_MAX_ENTRIES", "10000")),
+        max_bytes=int(os.environ.get("PREDICTION_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+        disk_path=prediction_cache_path(spec.name),
+        use_phash=os.environ.get("PREDICTION_CACHE_PHASH", "0") == "1")
+    for spec in model_specs
+}
+
+
+def send_to_palm_ai(disease_context, user_prompt="", session_id="default"):
+    """Send disease detection results to Palm AI for concise, focused response (blocking)"""
+    try:
+        return palm_enrichment.request_palm(disease_context, user_prompt, session_id)
     except Exception as e:
         # Fallback to basic advice without AI enhancement
         return disease_context
 
 
+def build_disease_context(result):
+    """Summarise a detection result as context for Palm AI"""
+    condition = 'healthy' if result['healthy'] else result['disease']
+    return (f"Plant: {result['plant']}\n"
+            f"Condition: {condition}\n"
+            f"Confidence: {result['confidence']:.1%}\n"
+            f"Advice: {result['detailed_advice']}")
+
+
+def build_detection_result(served, prediction, session_id="default"):
+    """Turn a model prediction into the /detect-disease response payload"""
+    pred_idx, confidence = prediction[0], prediction[1]
+    result = served.label_table[pred_idx].result(confidence, session_id)
+    result['model'] = served.name
+    # Predictions cached before top-k was added only hold (pred_idx, confidence)
+    top = prediction[2] if len(prediction) > 2 else [[pred_idx, confidence]]
+    result['top_k'] = [{'label': served.label_table[i].label, 'plant': served.label_table[i].plant,
+                        'confidence': p} for i, p in top]
+    if len(prediction) > 3:
+        result['stage'] = prediction[3]
+    predictions_total.inc(model=served.name, label=result['top_k'][0]['label'])
+    return result
+
+
+def load_routed_model():
+    """The model for this request's optional `crop` hint (English or Arabic), or None if it failed to load"""
+    name = models.route(request.form.get('crop') or request.args.get('crop'))
+    try:
+        return models.get(name)
+    except Exception as e:
+        print(f"Error loading model '{name}': {e}")
+        return None
+
+
 @app.route('/detect-disease', methods=['POST'])
 def detect_disease():
-    if not model or not processor:
+    # The multipart body is parsed on first access to request.files
+    with metrics.stage('upload'):
+        file = request.files.get('image')
+    if file is None:
+        return jsonify({'error': 'Image is required.'}), 400
+
+    served = load_routed_model()
+    if served is None:
+        return jsonify({'error': 'Model not loaded. Please check server logs.'}), 500
+    prediction_cache = prediction_caches[served.name]
+
+    user_prompt = request.form.get('prompt', '')  # Optional user prompt
+    # Session ID for conversation memory
+    session_id = request.form.get('session_id', 'default')
+
+    # Optional soil readings: answer with a fertilizer recommendation too
+    fertilizer_query = None
+    if any(name in request.form for name in fertilizer_recommendation.FIELDS):
+        if fertilizer_recommender is None:
+            return jsonify({'error': 'Fertilizer recommendation model not loaded. Please check server logs.'}), 500
+        try:
+            fertilizer_query = fertilizer_recommendation.parse_queries(request.form.to_dict())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    # Repeat uploads (retries, shared photos) are answered from the cache
+    data = file.read()
+    with metrics.stage('cache'):
+        key = content_key(data)
+        prediction = prediction_cache.get(key)
+    if prediction is None:
+        try:
+            with metrics.stage('decode'):
+                img = served.preprocessor.decode(io.BytesIO(data))
+        except Exception as e:
+            return jsonify({'error': f"Invalid image file: {e}"}), 400
+
+        with metrics.stage('cache'):
+            prediction, phash = prediction_cache.get_similar(img)
+        if prediction is None:
+            with metrics.stage('preprocess'):
+                pixel_values = served.preprocessor([img])
+            t0 = time.perf_counter()
+            try:
+                # Includes the wait for the micro-batch to fill
+                with metrics.stage('inference'):
+                    prediction = served.batcher.predict(pixel_values)
+            except Exception as e:
+                return jsonify({'error': f"Inference failed: {e}"}), 500
+            models.record(served.name, time.perf_counter() - t0)
+            prediction_cache.put(key, prediction, phash)
+
+    with metrics.stage('labels'):
+        result = build_detection_result(served, prediction, session_id)
+
+    if fertilizer_query is not None:
+        X, soils, crops = fertilizer_query
+        # Without an explicit crop_type, use the plant the model detected; an
+        # unidentified image with no crop_type gets no recommendation
+        crop = crops[0] or result.get('plant')
+        if crop is not None:
+            with metrics.stage('fertilizer'):
+                result['fertilizer'] = fertilizer_recommender.recommend(X, soils, [crop])[0]
+
+    # Optional Palm AI enrichment runs in the background; the client polls
+    # GET /enrichment/<ticket> instead of waiting on the LLM here
+    if result['confirmation'] and request.form.get('enrich', '').lower() in ('1', 'true', 'yes'):
+        ticket = palm_enrichment.submit(build_disease_context(result), user_prompt, session_id)
+        if ticket is None:
+            # Enrichment queue full: the built-in advice is the answer
+            result['enrichment'] = 'dropped'
+        else:
+            result['enrichment'] = 'pending'
+            result['enrichment_ticket'] = ticket
+    return jsonify(result)
+
+
+def is_image_member(name):
+    """Skip directories, hidden files and macOS resource forks inside archives"""
+    base = os.path.basename(name)
+    return (base and not base.startswith('.') and '__MACOSX/' not in name
+            and base.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def iter_archive_images(stream):
+    """Yield (filename, stream) for every image inside a zip or tar archive"""
+    stream.seek(0)
+    if zipfile.is_zipfile(stream):
+        stream.seek(0)
+        with zipfile.ZipFile(stream) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and is_image_member(info.filename):
+                    yield info.filename, io.BytesIO(zf.read(info))
+    else:
+        stream.seek(0)
+        with tarfile.open(fileobj=stream, mode='r:*') as tf:
+            for member in tf:
+                if member.isfile() and is_image_member(member.name):
+                    yield member.name, io.BytesIO(tf.extractfile(member).read())
+
+
+def is_supported_archive(stream):
+    stream.seek(0)
+    if zipfile.is_zipfile(stream):
+        return True
+    stream.seek(0)
+    try:
+        with tarfile.open(fileobj=stream, mode='r:*'):
+            return True
+    except tarfile.TarError:
+        return False
+
+
+def detach_upload(file):
+    """Take ownership of an upload's stream so it outlives the request.
+
+    Flask closes request.files when the view returns, which is before a
+    streamed response body is generated.
+    """
+    stream = file.stream
+    file.stream = io.BytesIO()
+    return stream
+
+
+def stream_batch_detection(uploads, session_id, served, field_id=None):
+    """Decode, classify and yield NDJSON lines chunk by chunk, ending with a field summary"""
+    prediction_cache = prediction_caches[served.name]
+    summary = {
+        'field_id': field_id,
+        'model': served.name,
+        'images': 0,
+        'classified': 0,
+        'errors': 0,
+        'healthy': 0,
+        'diseased': 0,
+        'unidentified': 0,
+        'labels': {},
+    }
+    confidence_total = 0.0
+    chunk = []
+
+    def record(index, filename, prediction):
+        nonlocal confidence_total
+        pred_idx, confidence = prediction[0], prediction[1]
+        result = build_detection_result(served, prediction, session_id)
+
+        label = served.label_table[pred_idx].label
+        label_stats = summary['labels'].setdefault(
+            label, {'count': 0, 'mean_confidence': 0.0})
+        label_stats['count'] += 1
+        # Running mean keeps the summary O(classes) for large surveys
+        label_stats['mean_confidence'] += (
+            confidence - label_stats['mean_confidence']) / label_stats['count']
+
+        summary['classified'] += 1
+        confidence_total += confidence
+        if not result['confirmation']:
+            summary['unidentified'] += 1
+        elif result['healthy']:
+            summary['healthy'] += 1
+        else:
+            summary['diseased'] += 1
+
+        return json.dumps({'index': index, 'filename': filename, **result}) + "\n"
+
+    def classify_chunk():
+        with metrics.stage('preprocess'):
+            pixel_values = served.preprocessor([img for _, _, img, _, _ in chunk])
+        t0 = time.perf_counter()
+        predictions = served.predict_batch([pixel_values])
+        models.record(served.name, time.perf_counter() - t0, len(chunk))
+        metrics.observe_stage('inference', time.perf_counter() - t0)
+        for (index, filename, _, key, phash), prediction in zip(chunk, predictions):
+            prediction_cache.put(key, prediction, phash)
+            yield record(index, filename, prediction)
+        chunk.clear()
+
+    for index, (filename, stream) in enumerate(uploads):
+        summary['images'] += 1
+        data = stream.read()
+        key = content_key(data)
+        cached = prediction_cache.get(key)
+        if cached is not None:
+            yield record(index, filename, cached)
+            continue
+
+        try:
+            with metrics.stage('decode'):
+                img = served.preprocessor.decode(io.BytesIO(data))
+        except Exception as e:
+            summary['errors'] += 1
+            yield json.dumps({'index': index, 'filename': filename,
+                              'error': f"Invalid image file: {e}"}) + "\n"
+            continue
+
+        cached, phash = prediction_cache.get_similar(img)
+        if cached is not None:
+            yield record(index, filename, cached)
+            continue
+
+        chunk.append((index, filename, img, key, phash))
+        if len(chunk) >= BATCH_ENDPOINT_CHUNK:
+            yield from classify_chunk()
+
+    if chunk:
+        yield from classify_chunk()
+
+    summary['mean_confidence'] = (
+        confidence_total / summary['classified']) if summary['classified'] else 0.0
+    yield json.dumps({'summary': summary}) + "\n"
+
+
+@app.route('/detect-disease/batch', methods=['POST'])
+def detect_disease_batch():
+    """Classify many images (multipart `images` files and/or a zip/tar `archive`), streamed as NDJSON"""
+    images = request.files.getlist('images')
+    archive = request.files.get('archive')
+    if not images and archive is None:
+        return jsonify({'error': 'Upload images as `images` files or a zip/tar `archive`.'}), 400
+    if archive is not None and not is_supported_archive(archive.stream):
+        return jsonify({'error': 'Archive must be a zip or tar file.'}), 400
+
+    # Every image of a batch goes to the model for its `crop` hint
+    served = load_routed_model()
+    if served is None:
         return jsonify({'error': 'Model not loaded. Please check server logs.'}), 500
 
+    session_id = request.form.get('session_id', 'default')
+    field_id = request.form.get('field_id')
+
+    image_streams = [(file.filename, detach_upload(file)) for file in images]
+    archive_stream = detach_upload(archive) if archive is not None else None
+
+    def uploads():
+        try:
+            yield from image_streams
+            if archive_stream is not None:
+                yield from iter_archive_images(archive_stream)
+        finally:
+            for _, stream in image_streams:
+                stream.close()
+            if archive_stream is not None:
+                archive_stream.close()
+
+    return Response(stream_with_context(stream_batch_detection(uploads(), session_id, served, field_id)),
+                    mimetype='application/x-ndjson')
+
+
+def tiled_options(form):
+    """(max_side, overlap, min_std) from optional form fields, bounded by the server settings"""
+    try:
+        max_side = int(form.get('max_side', TILE_MAX_SIDE))
+        overlap = float(form.get('overlap', TILE_OVERLAP))
+        min_std = float(form.get('min_std', TILE_MIN_STD))
+    except ValueError:
+        raise ValueError("max_side, overlap and min_std must be numbers")
+    if not 224 <= max_side <= TILE_MAX_SIDE_LIMIT:
+        raise ValueError(f"max_side must be between 224 and {TILE_MAX_SIDE_LIMIT}")
+    if not 0.0 <= overlap <= 0.75:
+        raise ValueError("overlap must be between 0 and 0.75")
+    if min_std < 0:
+        raise ValueError("min_std must not be negative")
+    return max_side, overlap, min_std
+
+
+@app.route('/detect-disease/tiled', methods=['POST'])
+def detect_disease_tiled():
+    """Classify overlapping tiles of a field photo; per-tile heatmap plus plant/disease shares"""
     if 'image' not in request.files:
         return jsonify({'error': 'Image is required.'}), 400
+    try:
+        max_side, overlap, min_std = tiled_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    file = request.files['image']
-    user_prompt = request.form.get('prompt', '')  # Optional user prompt
-    # Session ID for conversation memory
+    served = load_routed_model()
+    if served is None:
+        return jsonify({'error': 'Model not loaded. Please check server logs.'}), 500
     session_id = request.form.get('session_id', 'default')
 
+    stream = io.BytesIO(request.files['image'].read())
     try:
-        img = Image.open(file.stream).convert('RGB')
+        Image.open(stream).verify()
     except Exception as e:
         return jsonify({'error': f"Invalid image file: {e}"}), 400
+    stream.seek(0)
+
+    t0 = time.perf_counter()
+    try:
+        with metrics.stage('tiled_analysis'):
+            report = tiled_analysis.analyse(served, stream, max_side, overlap, min_std, session_id,
+                                            BATCH_ENDPOINT_CHUNK)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f"Inference failed: {e}"}), 500
+    models.record(served.name, time.perf_counter() - t0, max(1, report['summary']['analysed_tiles']))
+    return jsonify(report)
+
+
+@app.route('/enrichment/<ticket_id>', methods=['GET'])
+def get_enrichment(ticket_id):
+    """Fetch an enrichment result; `wait` (seconds, max 30) long-polls until it is ready"""
+    try:
+        wait = float(request.args.get('wait', 0) or 0)
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    # NaN compares false everywhere, so it falls through to 0 here
+    wait = min(wait, 30.0) if wait > 0 else 0.0
+    ticket = palm_enrichment.get(ticket_id, wait=wait)
+    if ticket is None:
+        return jsonify({'error': 'Enrichment ticket not found'}), 404
+    return jsonify(ticket)
+
+
+@app.route('/enrichment/<ticket_id>/events', methods=['GET'])
+def stream_enrichment(ticket_id):
+    """Server-sent event stream that emits the enrichment result once it resolves"""
+    if palm_enrichment.get(ticket_id) is None:
+        return jsonify({'error': 'Enrichment ticket not found'}), 404
+
+    def events():
+        ticket = palm_enrichment.get(ticket_id, wait=palm_enrichment.timeout + 5)
+        if ticket is None or ticket['status'] == 'pending':
+            yield "event: timeout\ndata: {}\n\n"
+        else:
+            yield f"data: {json.dumps(ticket)}\n\n"
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
 
-    inputs = processor(images=img, return_tensors="pt")
-    with torch.no_grad():
-        outputs = model(**inputs)
-        logits = outputs.logits
-        pred_idx = logits.argmax(-1).item()
-        model_full_label = model.config.id2label[pred_idx]
-        confidence = torch.softmax(logits, dim=-1)[0, pred_idx].item()
-
-    # Parse the model prediction to extract plant and disease information
-    detected_model_plant_actual = None
-    detected_model_disease_part = None
-
-    # Check if the prediction matches any of our supported plants
-    for prefix in MODEL_PLANT_PREFIXES:
-        if prefix in model_full_label:
-            detected_model_plant_actual = prefix
-            # Extract disease part - everything after the plant name
-            if model_full_label.startswith("Healthy"):
-                detected_model_disease_part = "healthy"
-            else:
-                # For diseased plants, the format is usually "Plant with Disease" or "Disease"
-                if " with " in model_full_label:
-                    detected_model_disease_part = model_full_label.split(" with ", 1)[
-                        1]
-                elif model_full_label.startswith(prefix):
-                    # Handle cases like "Apple Scab" where plant is at the beginning
-                    detected_model_disease_part = model_full_label[len(
-                        prefix):].strip()
-                else:
-                    detected_model_disease_part = model_full_label
-            break
-
-    if not detected_model_plant_actual:
-        return jsonify({
-            'confirmation': False,
-            'message': f"Could not identify plant type from image. Model prediction: '{model_full_label}'. Please ensure the image shows a clear view of plant leaves.",
-            'confidence': confidence
-        })
-
-    # Provide concise, enhanced advice
-    if "healthy" in model_full_label.lower():
-        # Clean message without emojis
-        short_message = f"Your {detected_model_plant_actual} plant looks healthy! Continue proper care and monitor regularly."
-        detailed_message = f"Your {detected_model_plant_actual} plant appears to be in excellent health with no signs of disease detected. To maintain this healthy state, continue with your current care routine including proper watering, adequate sunlight, and regular monitoring. Keep an eye out for any changes in leaf color, spots, or unusual growth patterns. Preventive measures such as proper spacing for air circulation, avoiding overhead watering, and maintaining clean garden tools will help prevent future disease issues."
-
-        return jsonify({
-            'confirmation': True,
-            'healthy': True,
-            'plant': detected_model_plant_actual,
-            'message': short_message,
-            'detailed_advice': detailed_message,
-            'confidence': confidence,
-            'session_id': session_id
-        })
+def read_recommendation_payload(columns_from_csv):
+    """JSON body, or an uploaded CSV `samples` file as columns; plus whether it is a bulk request"""
+    upload = request.files.get('samples')
+    if upload is not None:
+        payload = {'columns': columns_from_csv(upload.read().decode('utf-8-sig'))}
     else:
-        # Get advice for the specific disease
-        advice = advice_dict.get(
-            model_full_label, "Specific treatment advice not found. Please consult a local agricultural expert.")
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            raise ValueError("Send JSON (one sample, `samples` or `columns`) or a CSV `samples` file.")
+    return payload, 'samples' in payload or 'columns' in payload
+
+
+def check_sample_count(n):
+    if n > RECOMMEND_MAX_SAMPLES:
+        raise ValueError(f"At most {RECOMMEND_MAX_SAMPLES} samples per request.")
+
+
+def parse_top_k(payload):
+    """`top_k` from the JSON body or form; ValueError (a 400) for null or non-integer values"""
+    try:
+        return int(payload.get('top_k', request.form.get('top_k', 3)))
+    except (TypeError, ValueError):
+        raise ValueError("top_k must be an integer")
+
+
+@app.route('/recommend-crop', methods=['POST'])
+def recommend_crop():
+    """Top-k crops for one soil sample or many (JSON `samples`/`columns`, or a CSV upload)"""
+    if crop_recommender is None:
+        return jsonify({'error': 'Crop recommendation model not loaded. Please check server logs.'}), 500
+    try:
+        payload, bulk = read_recommendation_payload(crop_recommendation.columns_from_csv)
+        X = crop_recommendation.parse_samples(payload)
+        check_sample_count(len(X))
+        top_k = parse_top_k(payload)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    results = crop_recommender.recommend(X, top_k)
+    if not bulk:
+        return jsonify({'recommendations': results[0]})
+    return jsonify({'count': len(results), 'results': results})
+
+
+@app.route('/recommend-fertilizer', methods=['POST'])
+def recommend_fertilizer():
+    """Top-k fertilizers for one field reading or many (JSON `samples`/`columns`, or a CSV upload)"""
+    if fertilizer_recommender is None:
+        return jsonify({'error': 'Fertilizer recommendation model not loaded. Please check server logs.'}), 500
+    try:
+        payload, bulk = read_recommendation_payload(fertilizer_recommendation.columns_from_csv)
+        X, soils, crops = fertilizer_recommendation.parse_queries(payload)
+        check_sample_count(len(X))
+        top_k = parse_top_k(payload)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    results = fertilizer_recommender.recommend(X, soils, crops, top_k)
+    if not bulk:
+        return jsonify(results[0])
+    return jsonify({'count': len(results), 'results': results})
+
+
+# Readiness: a worker only reports ready once warm_up() has pushed an image
+# through the full preprocess + inference path. serve.py replaces
+# warm_worker_pids with a shared array so every forked worker sees the others.
+worker_ready = False
+expected_workers = 1
+warm_worker_pids = None
+
+
+def warm_up():
+    """Load the default model if needed and run one inference so lazy initialisation happens before real traffic"""
+    global worker_ready
+    try:
+        models.get(default_model)
+    except Exception as e:
+        print(f"Error loading model {models.specs[default_model].path}: {e}")
+        return False
+    t0 = time.perf_counter()
+    img = Image.new('RGB', (256, 256), (90, 140, 60))
+    for name in list(models.specs):
+        served = models.peek(name)
+        if served is not None:
+            try:
+                # The first pass may compile kernels, so it gets longer than BATCH_TIMEOUT
+                served.batcher.predict(served.preprocessor([img]), timeout=WARM_UP_TIMEOUT)
+            except Exception as e:
+                print(f"Warm-up of model '{name}' failed: {e!r}")
+                return False
+    startup_phases['warm_up'] = time.perf_counter() - t0
+    startup_phases['ready'] = time.perf_counter() - STARTUP_STARTED
+    worker_ready = True
+    if warm_worker_pids is not None:
+        with warm_worker_pids.get_lock():
+            for i, pid in enumerate(warm_worker_pids):
+                if pid == 0:
+                    warm_worker_pids[i] = os.getpid()
+                    break
+    report = startup_report()
+    print(f"Ready in {report['ready_seconds']:.2f}s ({'lazy' if LAZY_STARTUP else 'eager'} startup; "
+          + ', '.join(f"{name} {seconds:.2f}s" for name, seconds in report['phases'].items()) + ")")
+    return True
+
+
+def startup_report():
+    """Boot-to-ready time of this process and where it went"""
+    served = models.peek(default_model)
+    phases = {'module_import': startup_phases['module_import']}
+    if served is not None:
+        phases.update(served.load_phases)
+    if 'warm_up' in startup_phases:
+        phases['warm_up'] = startup_phases['warm_up']
+    return {
+        'mode': 'lazy' if LAZY_STARTUP else 'eager',
+        'snapshot': served.snapshot if served is not None else None,
+        'pid': os.getpid(),
+        'ready_seconds': startup_phases.get('ready'),
+        'phases': phases,
+    }
+
+
+def count_warm_workers():
+    if warm_worker_pids is None:
+        return int(worker_ready)
+    return sum(1 for pid in warm_worker_pids if pid)
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 only after every worker has finished its warm-up inference"""
+    warm = count_warm_workers()
+    status = {
+        'ready': worker_ready and warm >= expected_workers,
+        'pid': os.getpid(),
+        'warm_workers': warm,
+        'expected_workers': expected_workers
+    }
+    return jsonify(status), 200 if status['ready'] else 503
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Expose per-model load state, latency, queue and cache statistics"""
+    model_stats = models.stats()
+    for name, cache in prediction_caches.items():
+        model_stats['models'][name]['prediction_cache'] = cache.stats()
+    return jsonify({
+        'models': model_stats,
+        'enrichment': palm_enrichment.stats(),
+        'startup': startup_report(),
+        'crop_recommendation': crop_recommender.stats() if crop_recommender else None,
+        'fertilizer_recommendation': fertilizer_recommender.stats() if fertilizer_recommender else None
+    })
 
-        # Extract disease name for display
-        disease_name_to_display = detected_model_disease_part if detected_model_disease_part else model_full_label
 
-        # Create clean message without emojis
-        short_message = f"{detected_model_plant_actual} with {disease_name_to_display} detected ({confidence:.1%} confidence)."
+@metrics.collector
+def collect_metrics():
+    """Model, batcher, cascade, prediction cache and enrichment state for /metrics"""
+    registry = models.stats()
+    loaded, memory, loads, evictions = [], [], [], []
+    queue_depth, batches, batched_images, cascade_images, escalated = [], [], [], [], []
+    cache_lookups, cache_entries = [], []
+    for name, model in registry['models'].items():
+        labels = {'model': name}
+        loaded.append((labels, int(model['loaded'])))
+        memory.append((labels, model['memory_mb'] * 2 ** 20))
+        loads.append((labels, model['loads']))
+        evictions.append((labels, model['evictions']))
+        if 'batcher' in model:
+            queue_depth.append((labels, model['batcher']['queue_depth']))
+            batches.append((labels, model['batcher']['batches_processed']))
+            batched_images.append((labels, model['batcher']['items_processed']))
+            cascade_images.append((labels, model['cascade']['images']))
+            escalated.append((labels, model['cascade']['escalated']))
+        cache = prediction_caches[name].stats()
+        for result in ('hits', 'phash_hits', 'disk_hits', 'misses'):
+            cache_lookups.append(({'model': name, 'result': result}, cache[result]))
+        cache_entries.append((labels, cache['entries']))
 
-        # Create brief treatment summary (first sentence of advice)
-        brief_treatment = advice.split(
-            '.')[0] + '.' if '.' in advice else advice[:100] + '...'
+    enrichment = palm_enrichment.stats()
+    startup = startup_report()
+    return [
+        ('model_loaded', 'gauge', 'Whether the model is loaded', loaded),
+        ('model_memory_bytes', 'gauge', 'Weights of the model at its last load', memory),
+        ('model_loads', 'counter', 'Model loads', loads),
+        ('model_evictions', 'counter', 'Models unloaded to stay within the memory budget', evictions),
+        ('batcher_queue_depth', 'gauge', 'Images waiting for a micro-batch', queue_depth),
+        ('batches', 'counter', 'Micro-batches run', batches),
+        ('batched_images', 'counter', 'Images classified through the micro-batcher', batched_images),
+        ('cascade_images', 'counter', 'Images classified through the cascade', cascade_images),
+        ('cascade_escalated', 'counter', 'Images escalated past the cascade fast stage', escalated),
+        ('prediction_cache_lookups', 'counter', 'Prediction cache lookups by result', cache_lookups),
+        ('prediction_cache_entries', 'gauge', 'Predictions held in memory', cache_entries),
+        ('enrichment_pending', 'gauge', 'Palm AI enrichments queued or running',
+         [({}, enrichment['pending'])]),
+        ('enrichments', 'counter', 'Palm AI enrichments by outcome',
+         [({'outcome': outcome}, enrichment[outcome]) for outcome in ('completed', 'fallbacks', 'rejected')]),
+        ('enrichment_circuit_open', 'gauge', 'Whether the Palm AI circuit breaker is open',
+         [({}, int(enrichment['circuit'] == 'open'))]),
+        ('startup_seconds', 'gauge', 'Time spent in each startup phase of this worker',
+         [({'phase': phase}, seconds) for phase, seconds in startup['phases'].items()]),
+        ('ready_seconds', 'gauge', 'Time from import to the end of warm-up',
+         [({}, startup['ready_seconds'])] if startup['ready_seconds'] is not None else []),
+    ]
 
-        # Full detailed advice remains the same
-        detailed_advice = advice
 
-        return jsonify({
-            'confirmation': True,
-            'healthy': False,
-            'plant': detected_model_plant_actual,
-            'disease': disease_name_to_display,
-            'confidence': confidence,
-            'message': short_message,
-            'brief_treatment': brief_treatment,
-            'detailed_advice': detailed_advice,
-            'session_id': session_id
-        })
+# Time to import this module, less the default model load (unless LAZY_STARTUP)
+startup_phases = {'module_import': time.perf_counter() - STARTUP_STARTED - sum(
+    getattr(models.peek(default_model), 'load_phases', {}).values())}
 
 
 if __name__ == '__main__':
-    if model and processor:
-        app.run(port=5006)
+    if LAZY_STARTUP:
+        # Serve /ready (503), /metrics and the recommenders while the model loads
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+        app.run(port=int(os.environ.get("PORT", "5006")))
+    elif models.peek(default_model) is not None:
+        warm_up()
+        app.run(port=int(os.environ.get("PORT", "5006")))
     else:
         print("API could not start because the model failed to load.")
@@ -0,0 +1,198 @@
+"""Fast image decode and preprocessing for the disease classifier.
+
+Replaces AutoImageProcessor on the request path:
+  * JPEGs are decoded with PIL draft mode, so a 12 MP phone photo is
+    DCT-scaled to roughly twice the target size instead of decoded in full.
+  * Resize and center crop follow the HF processor config (PIL, in C).
+  * Rescale + normalize is one fused multiply-add in NumPy, written straight
+    into a float32 batch buffer allocated once per batch.
+
+Usage:
+  python fast_preprocess.py validate --per-class 5
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+# Draft decode to at least this multiple of the resize target; a little
+# headroom keeps the final (antialiased) resize close to a full decode.
+DRAFT_OVERSAMPLE = 2
+
+
+def _get(config, key, default=None):
+    if config is None:
+        return default
+    if isinstance(config, dict):
+        return config.get(key, default)
+    return getattr(config, key, default)
+
+
+class HFPreprocessor:
+    """Plain AutoImageProcessor path, used when fast preprocessing is disabled or unsupported"""
+
+    name = 'hf'
+
+    def __init__(self, processor):
+        self.processor = processor
+
+    def decode(self, stream):
+        return Image.open(stream).convert('RGB')
+
+    def __call__(self, images):
+        return self.processor(images=images, return_tensors="pt")['pixel_values']
+
+
+class FastPreprocessor:
+    name = 'fast'
+
+    def __init__(self, processor, draft_oversample=DRAFT_OVERSAMPLE):
+        self.draft_oversample = draft_oversample
+
+        size = getattr(processor, 'size', None)
+        self.do_resize = bool(getattr(processor, 'do_resize', True))
+        self.shortest_edge = _get(size, 'shortest_edge')
+        self.resize_hw = None
+        if self.shortest_edge is None:
+            height, width = _get(size, 'height'), _get(size, 'width')
+            if height is None or width is None:
+                raise ValueError(f"Unsupported processor size config: {size}")
+            self.resize_hw = (int(height), int(width))
+        resample = getattr(processor, 'resample', Image.BILINEAR)
+        self.resample = int(resample) if resample is not None else Image.BILINEAR
+
+        crop = getattr(processor, 'crop_size', None)
+        self.do_center_crop = bool(getattr(processor, 'do_center_crop', False)) and crop is not None
+        if self.do_center_crop:
+            self.out_hw = (int(_get(crop, 'height')), int(_get(crop, 'width')))
+        elif self.resize_hw is not None:
+            self.out_hw = self.resize_hw
+        else:
+            raise ValueError("Shortest-edge resize without a center crop gives variable output sizes")
+
+        # (x * rescale - mean) / std  ==  x * scale + offset
+        rescale = float(getattr(processor, 'rescale_factor', 1 / 255)) if getattr(
+            processor, 'do_rescale', True) else 1.0
+        if getattr(processor, 'do_normalize', True):
+            mean = np.asarray(getattr(processor, 'image_mean'), dtype=np.float32)
+            std = np.asarray(getattr(processor, 'image_std'), dtype=np.float32)
+        else:
+            mean = np.zeros(3, dtype=np.float32)
+            std = np.ones(3, dtype=np.float32)
+        self.scale = (rescale / std).reshape(3, 1, 1).astype(np.float32)
+        self.offset = (-mean / std).reshape(3, 1, 1).astype(np.float32)
+
+    def resize_target(self, width, height):
+        """(width, height) the processor would resize an image of this size to"""
+        if not self.do_resize:
+            return width, height
+        if self.resize_hw is not None:
+            return self.resize_hw[1], self.resize_hw[0]
+        short, long = (width, height) if width <= height else (height, width)
+        new_short, new_long = self.shortest_edge, int(self.shortest_edge * long / short)
+        return (new_short, new_long) if width <= height else (new_long, new_short)
+
+    def decode(self, stream):
+        """Open an image, letting the JPEG decoder skip resolution we will throw away"""
+        img = Image.open(stream)
+        if img.format == 'JPEG':
+            width, height = self.resize_target(*img.size)
+            img.draft('RGB', (width * self.draft_oversample, height * self.draft_oversample))
+        return img.convert('RGB')
+
+    def _resize_crop(self, img):
+        if self.do_resize:
+            target = self.resize_target(*img.size)
+            if img.size != target:
+                img = img.resize(target, resample=self.resample)
+        if self.do_center_crop:
+            crop_h, crop_w = self.out_hw
+            width, height = img.size
+            top = (height - crop_h) // 2
+            left = (width - crop_w) // 2
+            img = img.crop((left, top, left + crop_w, top + crop_h))
+        return img
+
+    def __call__(self, images):
+        """Preprocess a list of RGB PIL images into an (N, 3, H, W) float32 tensor"""
+        out_h, out_w = self.out_hw
+        batch = np.empty((len(images), 3, out_h, out_w), dtype=np.float32)
+        for i, img in enumerate(images):
+            pixels = np.asarray(self._resize_crop(img), dtype=np.uint8).transpose(2, 0, 1)
+            np.multiply(pixels, self.scale, out=batch[i], casting='unsafe')
+            batch[i] += self.offset
+        return torch.from_numpy(batch)
+
+
+def load_preprocessor(processor, fast=True):
+    """FastPreprocessor for supported processor configs, HF processor otherwise"""
+    if fast:
+        try:
+            return FastPreprocessor(processor)
+        except Exception as e:
+            print(f"Fast preprocessing unavailable ({e}); using AutoImageProcessor.")
+    return HFPreprocessor(processor)
+
+
+def validate(processor, paths, fast):
+    """Compare fast decode + preprocess against the HF processor on full-resolution decodes"""
+    hf = HFPreprocessor(processor)
+    max_abs = 0.0
+    mean_abs = []
+    timings = {'hf': 0.0, 'fast': 0.0}
+    for path in paths:
+        t0 = time.perf_counter()
+        with open(path, 'rb') as f:
+            expected = hf([hf.decode(f)])
+        t1 = time.perf_counter()
+        with open(path, 'rb') as f:
+            actual = fast([fast.decode(f)])
+        t2 = time.perf_counter()
+        timings['hf'] += t1 - t0
+        timings['fast'] += t2 - t1
+
+        diff = (expected - actual).abs()
+        max_abs = max(max_abs, diff.max().item())
+        mean_abs.append(diff.mean().item())
+
+    return {
+        'images': len(paths),
+        'max_abs_diff': max_abs,
+        'mean_abs_diff': float(np.mean(mean_abs)) if mean_abs else 0.0,
+        'worst_mean_abs_diff': max(mean_abs) if mean_abs else 0.0,
+        'ms_per_image': {name: total * 1000.0 / max(1, len(paths)) for name, total in timings.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    validate_cmd = sub.add_parser('validate', help='Compare against the HF processor on the local sample images')
+    validate_cmd.add_argument('--per-class', type=int, default=5)
+    validate_cmd.add_argument('--tolerance', type=float, default=0.05,
+                              help='Maximum allowed mean absolute difference per image')
+    validate_cmd.add_argument('--no-draft', action='store_true',
+                              help='Decode at full resolution (isolates the resize/normalize path)')
+    args = parser.parse_args()
+
+    from detect_disease_api import default_model, models
+    from inference_backends import sample_images
+
+    processor = models.get(default_model).processor
+
+    fast = FastPreprocessor(processor)
+    if args.no_draft:
+        fast.decode = HFPreprocessor(processor).decode
+    report = validate(processor, sample_images(args.per_class), fast)
+    report['tolerance'] = args.tolerance
+    report['ok'] = report['worst_mean_abs_diff'] <= args.tolerance
+    print(json.dumps(report, indent=2))
+    if not report['ok']:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
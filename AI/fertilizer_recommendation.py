@@ -0,0 +1,260 @@
+"""Fertilizer recommendation from soil, crop and nutrient readings (Data/data_core.csv).
+
+Soil and crop types are encoded once and the rows are stored sorted by
+(soil, crop), so every partition is a contiguous slice of the standardized
+numeric matrix. A query is matched against its own partition (falling back
+to all crops on that soil, then to every row, for unknown types) with the
+distance-weighted kNN of knn_recommender.py. Bulk queries are grouped by
+partition and each group is scored with one matrix product.
+
+Usage:
+  python fertilizer_recommendation.py build
+  python fertilizer_recommendation.py bench --samples 20000
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import time
+
+import numpy as np
+
+from knn_recommender import KnnRecommender, file_digest, load_or_build, standardization
+
+AI_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_PATH = os.path.join(AI_DIR, 'Data', 'data_core.csv')
+DEFAULT_MODEL_PATH = os.path.join(AI_DIR, 'recommenders', 'fertilizer_knn.npz')
+
+# API field -> data_core.csv column
+NUMERIC_FIELDS = {
+    'temperature': 'Temparature',
+    'humidity': 'Humidity',
+    'moisture': 'Moisture',
+    'nitrogen': 'Nitrogen',
+    'potassium': 'Potassium',
+    'phosphorous': 'Phosphorous',
+}
+FIELDS = tuple(NUMERIC_FIELDS)
+
+# Names the disease model (and farmers) use for crops in the dataset
+CROP_ALIASES = {
+    'corn': 'Maize',
+    'corn (maize)': 'Maize',
+    'rice': 'Paddy',
+    'groundnut': 'Ground Nuts',
+    'groundnuts': 'Ground Nuts',
+    'peanut': 'Ground Nuts',
+    'millet': 'Millets',
+    'oilseeds': 'Oil seeds',
+    'oil seed': 'Oil seeds',
+    'soybean': 'Oil seeds',
+}
+
+
+def field_name(column):
+    """API field name for a CSV/JSON column ('Soil Type' -> 'soil_type', 'Temparature' -> 'temperature')"""
+    name = column.strip().lower().replace(' ', '_')
+    return 'temperature' if name == 'temparature' else name
+
+
+class FertilizerRecommender(KnnRecommender):
+    """Distance-weighted kNN within (soil, crop) partitions"""
+
+    label = 'fertilizer'
+
+    def __init__(self, X, y, classes, soils, crops, part_ptr, mean, std, k=7, digest=''):
+        super().__init__(X, y, classes, mean, std, k, digest)
+        self.soils = [str(s) for s in soils]
+        self.crops = [str(c) for c in crops]
+        self.part_ptr = np.asarray(part_ptr, dtype=np.int64)
+        self.soil_index = {s.lower(): i for i, s in enumerate(self.soils)}
+        self.crop_index = {c.lower(): i for i, c in enumerate(self.crops)}
+        for alias, crop in CROP_ALIASES.items():
+            if crop.lower() in self.crop_index:
+                self.crop_index.setdefault(alias, self.crop_index[crop.lower()])
+
+    @classmethod
+    def fit(cls, rows, k=7, digest=''):
+        soils = sorted({r['Soil Type'] for r in rows})
+        crops = sorted({r['Crop Type'] for r in rows})
+        classes = sorted({r['Fertilizer Name'] for r in rows})
+        soil_idx = np.array([soils.index(r['Soil Type']) for r in rows])
+        crop_idx = np.array([crops.index(r['Crop Type']) for r in rows])
+        X = np.array([[float(r[col]) for col in NUMERIC_FIELDS.values()] for r in rows], dtype=np.float32)
+        y = np.array([classes.index(r['Fertilizer Name']) for r in rows])
+
+        part = soil_idx * len(crops) + crop_idx
+        order = np.argsort(part, kind='stable')
+        counts = np.bincount(part, minlength=len(soils) * len(crops))
+        part_ptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=part_ptr[1:])
+
+        mean, std = standardization(X)
+        return cls((X[order] - mean) / std, y[order], classes, soils, crops, part_ptr, mean, std, k, digest)
+
+    def _arrays(self):
+        return dict(super()._arrays(), soils=np.array(self.soils), crops=np.array(self.crops),
+                    part_ptr=self.part_ptr)
+
+    def row_ranges(self, soils, crops):
+        """Row slice [start, end) and match level for each query's soil/crop"""
+        n_crops = len(self.crops)
+        starts = np.zeros(len(soils), dtype=np.int64)
+        ends = np.full(len(soils), len(self.X), dtype=np.int64)
+        matched = []
+        for i, (soil, crop) in enumerate(zip(soils, crops)):
+            s = self.soil_index.get((soil or '').strip().lower())
+            c = self.crop_index.get((crop or '').strip().lower())
+            if s is None:
+                matched.append('all')
+                continue
+            if c is not None and self.part_ptr[s * n_crops + c + 1] > self.part_ptr[s * n_crops + c]:
+                starts[i], ends[i] = self.part_ptr[s * n_crops + c], self.part_ptr[s * n_crops + c + 1]
+                matched.append('soil+crop')
+            else:
+                starts[i], ends[i] = self.part_ptr[s * n_crops], self.part_ptr[(s + 1) * n_crops]
+                matched.append('soil')
+        return starts, ends, matched
+
+    def scores(self, samples, starts, ends):
+        """Fertilizer probabilities [m, n_classes]; query i only sees rows starts[i]:ends[i]"""
+        Q = self.standardize(samples)
+        out = np.zeros((len(Q), len(self.classes)), dtype=np.float32)
+        # One matrix product per distinct row range (at most soils x crops + soils + 1)
+        ranges, group = np.unique(np.stack([starts, ends], axis=1), axis=0, return_inverse=True)
+        group = group.ravel()
+        for g, (start, end) in enumerate(ranges):
+            members = np.flatnonzero(group == g)
+            out[members] = self.votes(Q[members], start, end)
+        return out
+
+    def recommend(self, samples, soils, crops, top_k=3):
+        """Top-k fertilizers per query as {'recommendations': [{'fertilizer', 'score'}], 'matched': ...}"""
+        t0 = time.perf_counter()
+        starts, ends, matched = self.row_ranges(soils, crops)
+        top = self.top(self.scores(samples, starts, ends), top_k, t0)
+        return [{'recommendations': r, 'matched': m} for r, m in zip(top, matched)]
+
+    def stats(self):
+        return dict(super().stats(), soils=self.soils, crops=self.crops)
+
+
+def load_rows(path=DEFAULT_DATA_PATH):
+    with open(path, encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def build_model(data_path=DEFAULT_DATA_PATH, model_path=DEFAULT_MODEL_PATH, k=7):
+    model = FertilizerRecommender.fit(load_rows(data_path), k=k, digest=file_digest(data_path))
+    model.save(model_path)
+    return model
+
+
+def load_recommender(model_path=DEFAULT_MODEL_PATH, data_path=DEFAULT_DATA_PATH):
+    """Load the serialized model, rebuilding it if missing or older than the CSV"""
+    return load_or_build(FertilizerRecommender, model_path, data_path, build_model)
+
+
+def parse_queries(payload):
+    """(numeric matrix [m, 6], soil types, crop types) from one query, `samples` or `columns`.
+
+    Raises ValueError with a client-facing message on bad input.
+    """
+    if 'columns' in payload:
+        if not isinstance(payload['columns'], dict):
+            raise ValueError("'columns' must be an object of field arrays")
+        columns = {field_name(name): values for name, values in payload['columns'].items()}
+        missing = [name for name in FIELDS if name not in columns]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        try:
+            X = np.stack([np.asarray(columns[name], dtype=np.float32) for name in FIELDS], axis=1)
+        except (TypeError, ValueError):
+            raise ValueError("Columns must be numeric arrays of equal length")
+        soils = columns.get('soil_type') or [None] * len(X)
+        crops = columns.get('crop_type') or [None] * len(X)
+        if not isinstance(soils, list) or not isinstance(crops, list) or \
+                len(soils) != len(X) or len(crops) != len(X):
+            raise ValueError("soil_type and crop_type must have one value per sample")
+    else:
+        samples = payload['samples'] if 'samples' in payload else [payload]
+        if not isinstance(samples, list) or not samples:
+            raise ValueError("'samples' must be a non-empty list")
+        if not all(isinstance(s, dict) for s in samples):
+            raise ValueError("Each sample must be an object")
+        samples = [{field_name(k): v for k, v in s.items()} for s in samples]
+        try:
+            X = np.array([[s[name] for name in FIELDS] for s in samples], dtype=np.float32)
+        except KeyError as e:
+            raise ValueError(f"Missing field {e} (required: {', '.join(FIELDS)})")
+        except (TypeError, ValueError):
+            raise ValueError(f"Fields must be numeric: {', '.join(FIELDS)}")
+        soils = [s.get('soil_type') for s in samples]
+        crops = [s.get('crop_type') for s in samples]
+    if not np.isfinite(X).all():
+        raise ValueError("Samples contain non-finite values")
+    if not all(v is None or isinstance(v, str) for v in soils + crops):
+        raise ValueError("soil_type and crop_type must be strings")
+    return X, soils, crops
+
+
+def columns_from_rows(rows):
+    """Column dict (for parse_queries) from CSV-style row dicts"""
+    if not rows:
+        raise ValueError("CSV has no rows")
+    return {name: [r[name] for r in rows] for name in rows[0]}
+
+
+def columns_from_csv(text):
+    """Column dict (for parse_queries) from CSV text with a header row"""
+    return columns_from_rows(list(csv.DictReader(io.StringIO(text))))
+
+
+def benchmark(model, n_samples=20000, top_k=3, seed=0):
+    """Hold-out accuracy on the CSV and bulk scoring throughput on jittered rows"""
+    rows = load_rows()
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(rows))
+    test, train = order[:len(rows) // 5], order[len(rows) // 5:]
+    holdout = FertilizerRecommender.fit([rows[i] for i in train], k=model.k)
+    X_test, soils, crops = parse_queries({'columns': columns_from_rows([rows[i] for i in test])})
+    top1 = holdout.recommend(X_test, soils, crops, top_k=1)
+    accuracy = float(np.mean([r['recommendations'][0]['fertilizer'] == rows[i]['Fertilizer Name']
+                              for r, i in zip(top1, test)]))
+
+    picks = rng.integers(len(rows), size=n_samples)
+    X, soils, crops = parse_queries({'columns': columns_from_rows([rows[i] for i in picks])})
+    X *= rng.normal(1.0, 0.05, X.shape).astype(np.float32)
+    model.recommend(X[:10], soils[:10], crops[:10], top_k)
+    t0 = time.perf_counter()
+    model.recommend(X, soils, crops, top_k)
+    bulk = time.perf_counter() - t0
+    return {
+        'holdout_accuracy': accuracy,
+        'bulk_samples': n_samples,
+        'bulk_seconds': bulk,
+        'bulk_samples_per_second': n_samples / bulk,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=os.environ.get('FERTILIZER_MODEL_PATH', DEFAULT_MODEL_PATH))
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_cmd = sub.add_parser('build', help='Fit the model from the CSV and save it')
+    build_cmd.add_argument('--data', default=DEFAULT_DATA_PATH)
+    build_cmd.add_argument('-k', type=int, default=7)
+    bench_cmd = sub.add_parser('bench', help='Accuracy and throughput benchmark')
+    bench_cmd.add_argument('--samples', type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        model = build_model(args.data, args.model, k=args.k)
+        print(f"Saved {len(model.X)} rows, {len(model.soils)} soils x {len(model.crops)} crops to {args.model}")
+        return
+    print(json.dumps(benchmark(load_recommender(args.model), args.samples), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    return _WHITESPACE.sub(' ', (text or '').strip()).lower()
+
+
+def generation_key(prompt, disease_context='', history_digest='', options=''):
+    """Cache key for one generation: normalized prompt, disease context, history digest and options"""
+    h = hashlib.blake2b(digest_size=16)
+    for part in (normalize_text(prompt), normalize_text(disease_context), history_digest or '', options or ''):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class GenerationCache:
+    """TTL + LRU cache of LLM responses with single-flight request coalescing.
+
+    Concurrent requests for the same key wait on the first one's upstream
+    call instead of issuing their own. Errors are shared with the waiters
+    but never cached. Waiters give up after `wait_timeout` seconds.
+    """
+
+    def __init__(self, max_entries=1000, ttl=3600.0, wait_timeout=120.0):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.wait_timeout = float(wait_timeout)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, text)
+        self._flights = {}
+
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.upstream_errors = 0
+        self.evictions = 0
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, text = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return text
+
+    def _store(self, key, text):
+        self._entries[key] = (time.monotonic() + self.ttl, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        """Cached text for key or None (counts as a hit or miss)"""
+        with self._lock:
+            text = self._lookup(key)
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return text
+
+    def put(self, key, text):
+        """Store a response generated outside get_or_generate (e.g. a finished stream)"""
+        with self._lock:
+            self._store(key, text)
+
+    def get_or_generate(self, key, generate):
+        """Return (text, source) where source is 'cache', 'coalesced' or 'upstream'"""
+        with self._lock:
+            text = self._lookup(key)
+            if text is not None:
+                self.hits += 1
+                return text, 'cache'
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            if not flight.done.wait(self.wait_timeout):
+                raise TimeoutError(f"No response from the coalesced generation within {self.wait_timeout:.0f}s")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, 'coalesced'
+
+        try:
+            flight.result = generate()
+        except BaseException as e:
+            # Interrupts and green-thread timeouts too: the waiters get an error either way
+            flight.error = e if isinstance(e, Exception) else RuntimeError(
+                f"Generation aborted ({type(e).__name__})")
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None:
+                    self._store(key, flight.result)
+                else:
+                    self.upstream_errors += 1
+                self._flights.pop(key, None)
+            flight.done.set()
+        return flight.result, 'upstream'
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.coalesced + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'in_flight': len(self._flights),
+                'hits': self.hits,
+                'coalesced': self.coalesced,
+                'misses': self.misses,
+                'upstream_errors': self.upstream_errors,
+                'evictions': self.evictions,
+                'hit_rate': ((self.hits + self.coalesced) / lookups) if lookups else 0.0,
+            }
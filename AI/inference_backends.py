@@ -0,0 +1,244 @@
+"""Selectable CPU inference backends for the disease classifier.
+
+Backends (INFERENCE_BACKEND):
+  eager        plain PyTorch fp32 (default)
+  torchscript  traced, frozen and optimized TorchScript graph
+  compile      torch.compile
+  quantized    dynamic int8 quantization of the Linear layers
+  onnx         exported ONNX model run with onnxruntime (see `export`)
+
+Usage:
+  python inference_backends.py export --output onnx/model.onnx
+  python inference_backends.py parity --backend onnx --per-class 5
+"""
+import argparse
+import glob
+import inspect
+import json
+import os
+import time
+
+import torch
+
+from metrics import percentile
+
+AI_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKENDS = ('eager', 'torchscript', 'compile', 'quantized', 'onnx')
+DEFAULT_ONNX_PATH = os.path.join(AI_DIR, 'onnx', 'model.onnx')
+
+
+def configure_threads(num_threads=None, interop_threads=None):
+    """Pin torch intra-op/inter-op thread counts (0 or None keeps torch's default)"""
+    if num_threads:
+        torch.set_num_threads(int(num_threads))
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(int(interop_threads))
+        except RuntimeError:
+            # Can only be set once, before any inter-op work has started
+            pass
+    return torch.get_num_threads()
+
+
+class LogitsOnly(torch.nn.Module):
+    """Wrap a HF classifier so tracing/export sees a plain tensor -> tensor function"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).logits
+
+
+class TorchBackend:
+    """Runs any torch callable that maps pixel_values to logits"""
+
+    def __init__(self, name, module):
+        self.name = name
+        self.module = module
+
+    def __call__(self, pixel_values):
+        with torch.inference_mode():
+            return self.module(pixel_values)
+
+
+class OnnxBackend:
+    name = 'onnx'
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = int(num_threads)
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.model_bytes = os.path.getsize(path)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, pixel_values):
+        logits = self.session.run(None, {self.input_name: pixel_values.numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+def example_input(batch_size=1, image_size=224):
+    return torch.zeros(batch_size, 3, image_size, image_size)
+
+
+def export_onnx(model, path, image_size=224, opset=17):
+    """Export the classifier to ONNX with a dynamic batch dimension"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        kwargs['dynamo'] = False
+    torch.onnx.export(
+        LogitsOnly(model).eval(), (example_input(1, image_size),), path,
+        input_names=['pixel_values'], output_names=['logits'],
+        dynamic_axes={'pixel_values': {0: 'batch'}, 'logits': {0: 'batch'}},
+        opset_version=opset, **kwargs)
+    return path
+
+
+def load_backend(name, model, onnx_path=None, num_threads=None, image_size=224, inplace=False):
+    """Build the requested backend around an already loaded eager model.
+
+    With inplace=True the quantized backend converts `model` itself instead
+    of a deep copy, for callers that no longer need the fp32 model.
+    """
+    model.eval()
+    if name == 'eager':
+        return TorchBackend(name, LogitsOnly(model))
+    if name == 'torchscript':
+        with torch.inference_mode():
+            traced = torch.jit.trace(LogitsOnly(model), example_input(1, image_size), strict=False)
+        traced = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+        return TorchBackend(name, traced)
+    if name == 'compile':
+        return TorchBackend(name, torch.compile(LogitsOnly(model)))
+    if name == 'quantized':
+        quantized = torch.ao.quantization.quantize_dynamic(
+            LogitsOnly(model), {torch.nn.Linear}, dtype=torch.qint8, inplace=inplace)
+        return TorchBackend(name, quantized)
+    if name == 'onnx':
+        path = onnx_path or DEFAULT_ONNX_PATH
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"ONNX model not found at {path}. Run `python inference_backends.py export` first.")
+        return OnnxBackend(path, num_threads=num_threads)
+    raise ValueError(f"Unknown inference backend '{name}'. Choose one of: {', '.join(BACKENDS)}")
+
+
+# Backends that run the eager module itself rather than their own copy of the weights
+EAGER_BACKENDS = ('eager', 'compile')
+
+
+def tensor_bytes(values):
+    """Bytes held by the tensors in a (possibly nested) sequence, e.g. a state_dict's values"""
+    total = 0
+    for value in values:
+        if isinstance(value, torch.Tensor):
+            total += value.numel() * value.element_size()
+        elif isinstance(value, (tuple, list)):
+            # Dynamically quantized Linear layers keep (weight, bias) packed in a tuple
+            total += tensor_bytes(value)
+    return total
+
+
+def backend_bytes(backend, model):
+    """Bytes of weights a backend serves from; `model` is the eager module it was built from"""
+    if isinstance(backend, OnnxBackend):
+        return backend.model_bytes
+    size = 0 if backend.name in EAGER_BACKENDS else tensor_bytes(backend.module.state_dict().values())
+    # Frozen TorchScript keeps its weights as graph constants, not in the state_dict
+    return size or tensor_bytes(model.state_dict().values())
+
+
+def sample_images(per_class=5):
+    """Local parity samples: AI/Images plus the first few images of each egypt_model_data class"""
+    paths = sorted(glob.glob(os.path.join(AI_DIR, 'Images', '*.jpg')))
+    for class_dir in sorted(glob.glob(os.path.join(AI_DIR, 'egypt_model_data', 'train', '*'))):
+        paths += sorted(glob.glob(os.path.join(class_dir, '*.jpg')))[:per_class]
+    return paths
+
+
+def parity_check(model, processor, backend, per_class=5, batch_size=8):
+    """Compare a backend against eager fp32: top-1 agreement, max logit error and latency"""
+    from PIL import Image
+
+    reference = load_backend('eager', model)
+    paths = sample_images(per_class)
+    agree = 0
+    max_abs_err = 0.0
+    latencies = {'eager': [], backend.name: []}
+    for start in range(0, len(paths), batch_size):
+        images = [Image.open(p).convert('RGB') for p in paths[start:start + batch_size]]
+        pixel_values = processor(images=images, return_tensors='pt')['pixel_values']
+
+        t0 = time.perf_counter()
+        expected = reference(pixel_values)
+        t1 = time.perf_counter()
+        actual = backend(pixel_values)
+        t2 = time.perf_counter()
+        latencies['eager'].append((t1 - t0) * 1000.0)
+        latencies[backend.name].append((t2 - t1) * 1000.0)
+
+        agree += (expected.argmax(-1) == actual.argmax(-1)).sum().item()
+        max_abs_err = max(max_abs_err, (expected - actual).abs().max().item())
+
+    return {
+        'backend': backend.name,
+        'images': len(paths),
+        'top1_agreement': agree / len(paths) if paths else 0.0,
+        'max_abs_logit_error': max_abs_err,
+        'batch_size': batch_size,
+        'latency_ms': {
+            name: {'p50': percentile(values, 50), 'p99': percentile(values, 99)}
+            for name, values in latencies.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', help='MODEL_REGISTRY model name (default: the default model)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    export_cmd = sub.add_parser('export', help='Export the disease model to ONNX')
+    export_cmd.add_argument('--output', default=DEFAULT_ONNX_PATH)
+    export_cmd.add_argument('--opset', type=int, default=17)
+
+    parity_cmd = sub.add_parser('parity', help='Check a backend against eager PyTorch on the local sample images')
+    parity_cmd.add_argument('--backend', choices=BACKENDS, default='onnx')
+    parity_cmd.add_argument('--onnx-path', default=DEFAULT_ONNX_PATH)
+    parity_cmd.add_argument('--per-class', type=int, default=5)
+    parity_cmd.add_argument('--batch-size', type=int, default=8)
+    parity_cmd.add_argument('--threads', type=int, default=0)
+    args = parser.parse_args()
+
+    # Reuse the service's own model loading so export/parity see exactly what is served,
+    # keeping the fp32 model they export and compare against
+    os.environ['KEEP_EAGER_MODEL'] = '1'
+    from detect_disease_api import default_model, models
+    name = args.model or default_model
+    try:
+        served = models.get(name)
+    except Exception as e:
+        raise SystemExit(f"Could not load model '{name}': {e}")
+    model, processor = served.model, served.processor
+
+    if args.command == 'export':
+        path = export_onnx(model, args.output, opset=args.opset)
+        print(f"Exported {models.specs[name].path} to {path}")
+        return
+
+    configure_threads(args.threads)
+    backend = load_backend(args.backend, model, onnx_path=args.onnx_path, num_threads=args.threads)
+    report = parity_check(model, processor, backend, per_class=args.per_class, batch_size=args.batch_size)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
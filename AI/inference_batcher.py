@@ -0,0 +1,175 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Collect concurrent inference requests into small batches.
+
+    Request threads call `submit()` with one preprocessed item and get back a
+    Future. A single background thread drains the queue, waiting at most
+    `max_wait_ms` for up to `max_batch_size` items, runs `run_batch` once on
+    the whole batch and hands each result back to its waiting request.
+    Every future is resolved, with a result or an exception, and `predict()`
+    gives up after `timeout` seconds (None waits forever).
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=10, timeout=None):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.timeout = timeout
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._closed = False
+
+        # Stats (guarded by self._lock)
+        self._batch_size_hist = [0] * (self.max_batch_size + 1)
+        self._queue_depth_hist = {}
+        self._max_queue_depth = 0
+        self._items_processed = 0
+        self._batches_processed = 0
+        self._batch_errors = 0
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so a batcher created before the
+        # server forks its workers has to start its own thread in each child.
+        if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._closed or (self._worker is not None and self._worker_pid == os.getpid()
+                                and self._worker.is_alive()):
+                return
+            if self._worker_pid != os.getpid():
+                # Inherited across fork(): the requests waiting on these are in the
+                # parent, but fail them rather than drop them unresolved
+                stale, self._queue = self._queue, queue.Queue()
+                self._fail_queued(stale, RuntimeError("Inference batcher was forked"))
+            # A worker that died in this process leaves its queue to the new one
+            self._worker_pid = os.getpid()
+            self._worker = threading.Thread(
+                target=self._run, name="inference-batcher", daemon=True)
+            self._worker.start()
+
+    def submit(self, item):
+        """Queue one item for inference and return a Future for its result"""
+        future = Future()
+        self._ensure_worker()
+        with self._lock:
+            if not self._closed:
+                self._queue.put((item, future))
+                return future
+        # A request that raced with close() still gets answered, unbatched
+        try:
+            future.set_result(self.run_batch([item])[0])
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def close(self):
+        """Stop the worker thread once the queued items are done, releasing run_batch"""
+        with self._lock:
+            self._closed = True
+            if self._worker is not None and self._worker_pid == os.getpid():
+                self._queue.put(None)
+
+    def predict(self, item, timeout=None):
+        """Submit one item and block until its result is ready (at most `timeout`, default self.timeout)"""
+        return self.submit(item).result(timeout=self.timeout if timeout is None else timeout)
+
+    @staticmethod
+    def _fail_queued(pending, error):
+        while True:
+            try:
+                entry = pending.get_nowait()
+            except queue.Empty:
+                return
+            if entry is not None and not entry[1].done():
+                entry[1].set_exception(error)
+
+    def _collect_batch(self):
+        # Block for the first item, then keep collecting until the batch is
+        # full or the oldest item has waited max_wait.
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    item = self._queue.get_nowait()
+                else:
+                    item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # close() was called; finish this batch, then exit on the next call
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+            queue_depth = self._queue.qsize()
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+
+            try:
+                results = self.run_batch(items)
+                error = None
+                if len(results) != len(items):
+                    raise RuntimeError(f"run_batch returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                results = None
+                error = e
+
+            with self._lock:
+                self._batch_size_hist[len(batch)] += 1
+                self._queue_depth_hist[queue_depth] = self._queue_depth_hist.get(
+                    queue_depth, 0) + 1
+                self._max_queue_depth = max(self._max_queue_depth, queue_depth)
+                self._items_processed += len(batch)
+                self._batches_processed += 1
+                if error is not None:
+                    self._batch_errors += 1
+
+            for i, future in enumerate(futures):
+                try:
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(results[i])
+                except Exception as e:
+                    # Keep the worker alive; this request gets the failure instead
+                    if not future.done():
+                        future.set_exception(e)
+
+    def stats(self):
+        """Snapshot of queue depth and batch size histograms"""
+        with self._lock:
+            batches = self._batches_processed
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'queue_depth_histogram': {
+                    str(depth): count for depth, count in sorted(self._queue_depth_hist.items())},
+                'batch_size_histogram': {
+                    str(size): count for size, count in enumerate(self._batch_size_hist) if count},
+                'batches_processed': batches,
+                'items_processed': self._items_processed,
+                'mean_batch_size': (self._items_processed / batches) if batches else 0.0,
+                'batch_errors': self._batch_errors,
+            }
@@ -0,0 +1,131 @@
+"""Distance-weighted k-nearest-neighbour scoring shared by the recommenders.
+
+KnnRecommender holds a standardized reference table (float32 rows, class
+ids and class names) serialized to a single .npz. Scoring is vectorized: a
+block of queries is compared against a contiguous slice of the reference
+rows with one matrix product, and neighbour votes are summed per class with
+one bincount. crop_recommendation.py scores against the whole table;
+fertilizer_recommendation.py against per-(soil, crop) slices.
+"""
+import hashlib
+import os
+import time
+
+import numpy as np
+
+# Queries scored per matrix product; bounds the (block x rows) distance matrix
+BLOCK_SIZE = 2048
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def standardization(X):
+    """(mean, std) per column, with constant columns left unscaled"""
+    mean = X.mean(axis=0)
+    std = X.std(axis=0)
+    std[std == 0] = 1.0
+    return mean, std
+
+
+class KnnRecommender:
+    """Distance-weighted kNN over standardized rows; subclasses add their own query API.
+
+    `label` names the class in recommendation dicts (e.g. {'crop': ..., 'score': ...}).
+    Subclass constructors take the stored arrays as keyword arguments, so any
+    extra arrays they return from _arrays() are saved and loaded as well.
+    """
+
+    label = 'class'
+
+    def __init__(self, X, y, classes, mean, std, k, digest=''):
+        self.X = np.ascontiguousarray(X, dtype=np.float32)
+        self.y = np.asarray(y, dtype=np.int32)
+        self.classes = [str(c) for c in classes]
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.std = np.asarray(std, dtype=np.float32)
+        self.k = int(k)
+        self.digest = digest
+        self.X_sq = (self.X ** 2).sum(axis=1)
+        self.requests = 0
+        self.samples = 0
+        self.seconds = 0.0
+
+    def _arrays(self):
+        """Everything save() writes, keyed by constructor argument name"""
+        return {'X': self.X, 'y': self.y, 'classes': np.array(self.classes), 'mean': self.mean,
+                'std': self.std, 'k': np.array(self.k), 'digest': np.array(self.digest)}
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, **self._arrays())
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        arrays['k'] = int(arrays['k'])
+        arrays['digest'] = str(arrays['digest'])
+        return cls(**arrays)
+
+    def standardize(self, samples):
+        return (np.asarray(samples, dtype=np.float32) - self.mean) / self.std
+
+    def votes(self, Q, start=0, end=None):
+        """Class probabilities [m, n_classes] for standardized queries against rows start:end"""
+        end = len(self.X) if end is None else end
+        X, y, X_sq = self.X[start:end], self.y[start:end], self.X_sq[start:end]
+        n_classes = len(self.classes)
+        k = min(self.k, len(X))
+        out = np.empty((len(Q), n_classes), dtype=np.float32)
+        for first in range(0, len(Q), BLOCK_SIZE):
+            block = Q[first:first + BLOCK_SIZE]
+            # ||q - x||^2 = ||q||^2 - 2 q.x + ||x||^2
+            d2 = (block ** 2).sum(axis=1)[:, None] - 2.0 * (block @ X.T) + X_sq[None, :]
+            nearest = np.argpartition(d2, k - 1, axis=1)[:, :k]
+            dist = np.sqrt(np.maximum(np.take_along_axis(d2, nearest, axis=1), 0.0))
+            weights = 1.0 / (dist + 1e-3)
+            # Sum neighbour weights per (query, class) in one bincount
+            rows = np.arange(len(block))[:, None] * n_classes
+            counts = np.bincount((rows + y[nearest]).ravel(), weights=weights.ravel(),
+                                 minlength=len(block) * n_classes).reshape(len(block), n_classes)
+            out[first:first + len(block)] = counts / counts.sum(axis=1, keepdims=True)
+        return out
+
+    def top(self, probs, top_k, t0):
+        """Top-k lists of {label, 'score'} per row of probs; records the request in stats()"""
+        top_k = max(1, min(int(top_k), len(self.classes)))
+        top = np.argsort(-probs, axis=1)[:, :top_k]
+        top_scores = np.take_along_axis(probs, top, axis=1)
+        results = [[{self.label: self.classes[c], 'score': round(float(s), 4)} for c, s in zip(cs, ss)]
+                   for cs, ss in zip(top.tolist(), top_scores.tolist())]
+        self.requests += 1
+        self.samples += len(results)
+        self.seconds += time.perf_counter() - t0
+        return results
+
+    def stats(self):
+        return {
+            'rows': len(self.X),
+            f'{self.label}s': len(self.classes),
+            'k': self.k,
+            'requests': self.requests,
+            'samples': self.samples,
+            'samples_per_second': (self.samples / self.seconds) if self.seconds else 0.0,
+        }
+
+
+def load_or_build(cls, model_path, data_path, build_model):
+    """cls.load(model_path), rebuilt with build_model(data_path, model_path) if missing or older than the CSV"""
+    if os.path.exists(model_path):
+        model = cls.load(model_path)
+        if not os.path.exists(data_path) or model.digest == file_digest(data_path):
+            return model
+    print(f"Building {cls.label} recommendation model at {model_path}...")
+    return build_model(data_path, model_path)
+
@@ -0,0 +1,111 @@
+DEFAULT_ADVICE = "Specific treatment advice not found. Please consult a local agricultural expert."
+
+HEALTHY_MESSAGE = "Your {plant} plant looks healthy! Continue proper care and monitor regularly."
+HEALTHY_DETAILED_MESSAGE = "Your {plant} plant appears to be in excellent health with no signs of disease detected. To maintain this healthy state, continue with your current care routine including proper watering, adequate sunlight, and regular monitoring. Keep an eye out for any changes in leaf color, spots, or unusual growth patterns. Preventive measures such as proper spacing for air circulation, avoiding overhead watering, and maintaining clean garden tools will help prevent future disease issues."
+UNIDENTIFIED_MESSAGE = "Could not identify plant type from image. Model prediction: '{label}'. Please ensure the image shows a clear view of plant leaves."
+
+
+def parse_label(label, plant_prefixes):
+    """Split a model label into (plant, disease part), or (None, None) if no known plant matches"""
+    for prefix in plant_prefixes:
+        if prefix in label:
+            if label.startswith("Healthy"):
+                return prefix, "healthy"
+            # For diseased plants, the format is usually "Plant with Disease" or "Disease"
+            if " with " in label:
+                return prefix, label.split(" with ", 1)[1]
+            if label.startswith(prefix):
+                # Handle cases like "Apple Scab" where plant is at the beginning
+                return prefix, label[len(prefix):].strip()
+            return prefix, label
+    return None, None
+
+
+def display_label(label):
+    """Readable form of ImageFolder-style labels: 'Mango___Die Back' -> 'Mango with Die Back'"""
+    if '___' not in label:
+        return label
+    plant, condition = label.split('___', 1)
+    plant = plant.replace('_', ' ').strip()
+    condition = condition.replace('_', ' ').strip()
+    if condition.lower() == 'healthy':
+        return f"Healthy {plant} Plant"
+    return f"{plant} with {condition}"
+
+
+def brief_treatment(advice):
+    """First sentence of the advice text"""
+    return advice.split('.')[0] + '.' if '.' in advice else advice[:100] + '...'
+
+
+class LabelInfo:
+    """Everything /detect-disease needs for one class index, resolved once at load time"""
+
+    __slots__ = ('index', 'label', 'plant', 'disease', 'healthy', 'advice',
+                 'brief_treatment', 'message', 'response_fields')
+
+    def __init__(self, index, label, plant_prefixes, advice_dict):
+        self.index = index
+        self.label = label
+        self.plant, disease_part = parse_label(label, plant_prefixes)
+        self.healthy = self.plant is not None and "healthy" in label.lower()
+        self.disease = None
+        self.advice = None
+        self.brief_treatment = None
+
+        if self.plant is None:
+            self.message = UNIDENTIFIED_MESSAGE.format(label=label)
+            self.response_fields = {'confirmation': False}
+        elif self.healthy:
+            self.message = HEALTHY_MESSAGE.format(plant=self.plant)
+            self.response_fields = {
+                'confirmation': True,
+                'healthy': True,
+                'plant': self.plant,
+                'detailed_advice': HEALTHY_DETAILED_MESSAGE.format(plant=self.plant),
+            }
+        else:
+            self.disease = disease_part if disease_part else label
+            self.advice = advice_dict.get(label, DEFAULT_ADVICE)
+            self.brief_treatment = brief_treatment(self.advice)
+            # Completed with the confidence per request
+            self.message = f"{self.plant} with {self.disease} detected"
+            self.response_fields = {
+                'confirmation': True,
+                'healthy': False,
+                'plant': self.plant,
+                'disease': self.disease,
+                'brief_treatment': self.brief_treatment,
+                'detailed_advice': self.advice,
+            }
+
+    def result(self, confidence, session_id="default"):
+        """Build the response payload for a prediction of this class"""
+        result = dict(self.response_fields)
+        result['confidence'] = confidence
+        result['message'] = self.message
+        if self.plant is not None:
+            result['session_id'] = session_id
+            if not self.healthy:
+                result['message'] = f"{self.message} ({confidence:.1%} confidence)."
+        return result
+
+
+def build_label_table(id2label, plant_prefixes, advice_dict):
+    """Resolve every model label up front; returns (table indexed by class id, problems)"""
+    size = max(int(i) for i in id2label) + 1 if id2label else 0
+    table = [None] * size
+    problems = []
+    for i, label in id2label.items():
+        label = display_label(label)
+        info = LabelInfo(int(i), label, plant_prefixes, advice_dict)
+        table[int(i)] = info
+        if info.plant is None:
+            problems.append(f"{i}: '{label}' does not match any known plant")
+        elif not info.healthy and label not in advice_dict:
+            problems.append(f"{i}: '{label}' has no entry in advice_dict")
+    for i, info in enumerate(table):
+        if info is None:
+            table[i] = LabelInfo(i, f"LABEL_{i}", plant_prefixes, advice_dict)
+            problems.append(f"{i}: missing from id2label")
+    return table, problems
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import time
+
+GEMINI_MODEL_NAME = 'gemini-1.5-flash-latest'
+
+
+class GeminiProvider:
+    """Google Gemini via google-generativeai, with one model client reused for every request"""
+
+    name = 'gemini'
+
+    def __init__(self, api_key, model_name=GEMINI_MODEL_NAME):
+        import google.generativeai as palm
+
+        palm.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = palm.GenerativeModel(model_name)
+
+    def generate(self, prompt):
+        return self.model.generate_content(prompt).text
+
+    def generate_stream(self, prompt):
+        """Yield text chunks as Gemini produces them; closing the generator stops the stream"""
+        response = self.model.generate_content(prompt, stream=True)
+        try:
+            for chunk in response:
+                text = chunk.text
+                if text:
+                    yield text
+        finally:
+            close = getattr(response, 'close', None)
+            if close:
+                close()
+
+
+class FakeProvider:
+    """Offline stand-in for tests and benchmarks: fixed latency, deterministic answer per prompt"""
+
+    name = 'fake'
+
+    def __init__(self, latency_ms=0.0):
+        self.latency = max(0.0, float(latency_ms)) / 1000.0
+        self.calls = 0
+        self.chunks_sent = 0
+
+    def _answer(self, prompt):
+        digest = hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:8]
+        return (f"Apply a copper-based fungicide and remove infected leaves. "
+                f"Improve air circulation and avoid overhead watering. "
+                f"Monitor the crop over the next week. [fake:{digest}]")
+
+    def generate(self, prompt):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self._answer(prompt)
+
+    def generate_stream(self, prompt):
+        """Same answer as generate(), one word per chunk with the latency spread across them"""
+        self.calls += 1
+        words = self._answer(prompt).split(' ')
+        delay = self.latency / len(words)
+        for i, word in enumerate(words):
+            if delay:
+                time.sleep(delay)
+            self.chunks_sent += 1
+            yield word if i == len(words) - 1 else word + ' '
+
+
+def limit_stream(chunks, max_sentences=None, max_chars=None):
+    """Pass chunks through until `max_sentences` sentences or `max_chars` characters.
+
+    Stops pulling from (and closes) the upstream generator as soon as the
+    limit is reached, so the rest of the answer is never generated.
+    """
+    text = ''
+    sentences = 0
+    try:
+        for chunk in chunks:
+            if max_sentences:
+                end = -1
+                for i, ch in enumerate(chunk):
+                    if ch == '.':
+                        sentences += 1
+                        if sentences >= max_sentences:
+                            end = i + 1
+                            break
+                if end >= 0:
+                    chunk = chunk[:end]
+            if max_chars and len(text) + len(chunk) > max_chars:
+                yield chunk[:max_chars - len(text)] + "..."
+                return
+            text += chunk
+            yield chunk
+            if max_sentences and sentences >= max_sentences:
+                return
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+
+
+def load_provider(name=None):
+    """Build the provider named by PALM_PROVIDER (gemini or fake)"""
+    name = name or os.environ.get("PALM_PROVIDER", "gemini")
+    if name == 'fake':
+        return FakeProvider(latency_ms=os.environ.get("FAKE_LLM_LATENCY_MS", "0"))
+    if name == 'gemini':
+        # Set your Gemini 1.5 (PaLM) API key from environment variable
+        api_key = os.environ.get("PALM_API_KEY")
+        if not api_key:
+            raise ValueError("PALM_API_KEY environment variable not set.")
+        return GeminiProvider(api_key, os.environ.get("GEMINI_MODEL", GEMINI_MODEL_NAME))
+    raise ValueError(f"Unknown PALM_PROVIDER '{name}'. Choose gemini or fake.")
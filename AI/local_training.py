@@ -0,0 +1,204 @@
+"""Offline, CPU-friendly training helpers for train_my_model.py.
+
+  * ImageFolderSource reads a class-per-folder tree such as
+    egypt_model_data/train and splits it per class into train/eval.
+  * StreamingImageDataset decodes each image only when the DataLoader asks
+    for it, using the draft-decode preprocessor.
+  * choose_precision picks bf16 where the hardware runs it natively, else fp32.
+  * extract_features / train_linear_head implement the frozen-backbone fast
+    path: one forward pass to cache features, then a linear head trained on
+    them in seconds.
+"""
+import hashlib
+import os
+import time
+
+import numpy as np
+import torch
+
+from fast_preprocess import load_preprocessor
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+class ImageFolderSplit:
+    """List of (path, label) that slices like a HF dataset: split[a:b] -> {'image': [...], 'label': [...]}"""
+
+    def __init__(self, samples, fingerprint):
+        self.samples = samples
+        self._fingerprint = fingerprint
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        from PIL import Image
+
+        if isinstance(index, slice):
+            chunk = self.samples[index]
+            return {'image': [Image.open(p) for p, _ in chunk], 'label': [label for _, label in chunk]}
+        path, label = self.samples[index]
+        return {'image': Image.open(path), 'label': label}
+
+
+class ImageFolderSource:
+    """Class-per-subfolder image tree; classes are the sorted folder names"""
+
+    def __init__(self, root):
+        self.root = root
+        self.classes = sorted(d for d in os.listdir(root)
+                              if os.path.isdir(os.path.join(root, d)) and not d.startswith('.'))
+        if not self.classes:
+            raise FileNotFoundError(f"No class folders found in {root}")
+        self.samples = []
+        for label, name in enumerate(self.classes):
+            folder = os.path.join(root, name)
+            for filename in sorted(os.listdir(folder)):
+                if filename.lower().endswith(IMAGE_EXTENSIONS) and not filename.startswith('.'):
+                    self.samples.append((os.path.join(folder, filename), label))
+
+    def fingerprint(self, samples):
+        """Changes whenever a file is added, removed, renamed or rewritten"""
+        h = hashlib.blake2b(digest_size=12)
+        for path, label in samples:
+            st = os.stat(path)
+            h.update(f"{os.path.relpath(path, self.root)}|{label}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+        return h.hexdigest()
+
+    def split(self, eval_fraction=0.1, seed=0):
+        """Per-class shuffled train/eval split, so every class is in both"""
+        rng = np.random.default_rng(seed)
+        train, evaluation = [], []
+        for label in range(len(self.classes)):
+            items = [s for s in self.samples if s[1] == label]
+            order = rng.permutation(len(items))
+            n_eval = int(round(len(items) * eval_fraction)) if len(items) > 1 else 0
+            evaluation += [items[i] for i in order[:n_eval]]
+            train += [items[i] for i in order[n_eval:]]
+        return (ImageFolderSplit(train, self.fingerprint(train)),
+                ImageFolderSplit(evaluation, self.fingerprint(evaluation)))
+
+
+class StreamingImageDataset(torch.utils.data.Dataset):
+    """Decode + preprocess one image per __getitem__ (runs inside DataLoader workers)"""
+
+    def __init__(self, split, processor):
+        self.split = split
+        self.preprocessor = load_preprocessor(processor)
+
+    def __len__(self):
+        return len(self.split)
+
+    def __getitem__(self, index):
+        path, label = self.split.samples[index]
+        with open(path, 'rb') as f:
+            img = self.preprocessor.decode(f)
+        return {'pixel_values': self.preprocessor([img])[0], 'labels': label}
+
+
+def collate_streaming(batch):
+    return {
+        'pixel_values': torch.stack([x['pixel_values'] for x in batch]),
+        'labels': torch.tensor([x['labels'] for x in batch]),
+    }
+
+
+def bf16_supported():
+    """True when this machine runs bf16 matmuls natively"""
+    if torch.cuda.is_available():
+        return torch.cuda.is_bf16_supported()
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def choose_precision(requested='auto'):
+    """'bf16', 'fp16' or 'fp32'. auto: bf16 when native, fp16 on older GPUs, else fp32"""
+    if requested != 'auto':
+        if requested == 'fp16' and not torch.cuda.is_available():
+            raise ValueError("fp16 training needs a CUDA GPU; use bf16 or fp32 on CPU")
+        return requested
+    if bf16_supported():
+        return 'bf16'
+    return 'fp16' if torch.cuda.is_available() else 'fp32'
+
+
+def precision_kwargs(precision, supported):
+    """TrainingArguments flags for a precision from choose_precision().
+
+    `supported` holds the TrainingArguments parameter names: `use_cpu`
+    replaced `no_cuda` in transformers 4.34.
+    """
+    return {
+        'bf16': precision == 'bf16',
+        'fp16': precision == 'fp16',
+        'use_cpu' if 'use_cpu' in supported else 'no_cuda': not torch.cuda.is_available(),
+    }
+
+
+def autocast(precision):
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if precision == 'fp32':
+        return torch.autocast(device, enabled=False)
+    return torch.autocast(device, dtype=torch.bfloat16 if precision == 'bf16' else torch.float16)
+
+
+def extract_features(model, loader, precision='fp32'):
+    """Inputs to model.classifier for every batch: ([n, d] float32 features, [n] labels)"""
+    captured = []
+    hook = model.classifier.register_forward_hook(
+        lambda module, inputs, output: captured.append(inputs[0].detach().float()))
+    features, labels = [], []
+    model.eval()
+    try:
+        with torch.inference_mode(), autocast(precision):
+            for batch in loader:
+                captured.clear()
+                model(pixel_values=batch['pixel_values'])
+                features.append(captured[0].reshape(len(batch['labels']), -1).numpy())
+                labels.append(np.asarray(batch['labels']))
+    finally:
+        hook.remove()
+    return np.concatenate(features), np.concatenate(labels)
+
+
+def train_linear_head(features, labels, num_labels, epochs=100, lr=1e-3, batch_size=256,
+                      weight_decay=1e-4, seed=0):
+    """Softmax regression on cached features; returns a trained torch.nn.Linear"""
+    torch.manual_seed(seed)
+    X = torch.from_numpy(features)
+    y = torch.from_numpy(labels).long()
+    head = torch.nn.Linear(X.shape[1], num_labels)
+    optimizer = torch.optim.AdamW(head.parameters(), lr=lr, weight_decay=weight_decay)
+    loss_fn = torch.nn.CrossEntropyLoss()
+    for _ in range(epochs):
+        order = torch.randperm(len(X))
+        for start in range(0, len(X), batch_size):
+            idx = order[start:start + batch_size]
+            optimizer.zero_grad()
+            loss_fn(head(X[idx]), y[idx]).backward()
+            optimizer.step()
+    return head
+
+
+def accuracy(head, features, labels):
+    if len(labels) == 0:
+        return None
+    with torch.no_grad():
+        predicted = head(torch.from_numpy(features)).argmax(-1).numpy()
+    return float((predicted == labels).mean())
+
+
+def cached_features(model, loader, cache_path, precision='fp32'):
+    """extract_features(), stored as .npz at cache_path and reused while it exists"""
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            return data['features'], data['labels'], 0.0
+    t0 = time.perf_counter()
+    features, labels = extract_features(model, loader, precision)
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    tmp = cache_path + '.tmp.npz'
+    np.savez(tmp, features=features, labels=labels)
+    os.replace(tmp, cache_path)
+    return features, labels, time.perf_counter() - t0
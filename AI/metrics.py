@@ -0,0 +1,351 @@
+"""Lightweight in-process metrics served in the Prometheus text format.
+
+  * Counter, Gauge and Histogram with labels; thread-safe, no dependencies.
+  * Registry.stage('decode') times a block into <prefix>_stage_seconds and
+    into the current request's breakdown, which is returned to clients in a
+    Server-Timing header.
+  * Collectors are callables run at scrape time that turn the existing
+    stats() dictionaries (caches, batchers, sessions) into samples, so those
+    subsystems keep their own counters.
+  * install(app, registry) counts and times every request per endpoint and
+    adds GET /metrics.
+  * SlowRequestProfiler (PROFILE_SLOW_MS, off by default) samples the stacks
+    of in-flight request threads every PROFILE_INTERVAL_MS. For requests
+    slower than the threshold it writes them as folded stacks (input for
+    flamegraph.pl or speedscope) under PROFILE_DIR.
+
+Metrics live in each process: behind gunicorn every worker keeps its own, and
+a scrape of /metrics reads whichever worker answers it.
+"""
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+AI_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PROFILE_DIR = os.path.join(AI_DIR, 'profiles')
+
+# Seconds; covers cache hits (sub-millisecond) up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sequence of numbers (0.0 when empty)"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key):
+        return dict(zip(self.labelnames, key))
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name + '_total', self._labels(key), value) for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        samples = []
+        for key, counts, total, count in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                samples.append((self.name + '_bucket', dict(labels, le=_format_value(float(bound))), cumulative))
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, count))
+        return samples
+
+
+class Registry:
+    """Metrics of one service; every name gets the registry's prefix"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._metrics = []
+        self._collectors = []
+        self._local = threading.local()
+        self.stage_seconds = self.histogram('stage_seconds', 'Time spent in each request stage', ['stage'])
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(f"{self.prefix}_{name}", documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(f"{self.prefix}_{name}", documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(f"{self.prefix}_{name}", documentation, labelnames, buckets))
+
+    def collector(self, collect):
+        """Register collect() -> [(name, kind, help, [(labels, value)])], called on every scrape"""
+        self._collectors.append(collect)
+        return collect
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block as one stage of the current request"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(name, time.perf_counter() - t0)
+
+    def observe_stage(self, name, seconds):
+        self.stage_seconds.observe(seconds, stage=name)
+        breakdown = getattr(self._local, 'stages', None)
+        if breakdown is not None:
+            breakdown[name] = breakdown.get(name, 0.0) + seconds
+
+    def begin_request(self):
+        self._local.stages = {}
+
+    def end_request(self):
+        """The stage breakdown of the request on this thread: {stage: seconds}"""
+        stages = getattr(self._local, 'stages', None) or {}
+        self._local.stages = None
+        return stages
+
+    def render(self):
+        lines = []
+        families = [(m.name, m.kind, m.documentation, m.samples()) for m in self._metrics]
+        for collect in self._collectors:
+            try:
+                for name, kind, documentation, values in collect():
+                    suffix = '_total' if kind == 'counter' else ''
+                    families.append((f"{self.prefix}_{name}", kind, documentation,
+                                     [(f"{self.prefix}_{name}{suffix}", labels, value)
+                                      for labels, value in values]))
+            except Exception as e:
+                print(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} {_escape(documentation)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+class SlowRequestProfiler:
+    """Samples in-flight request stacks; dumps folded stacks of requests slower than threshold_ms.
+
+    Threads whose names start with one of `shared_threads` (e.g. the
+    inference batcher) do work for every request, so their stacks are added
+    to each in-flight request's profile under a root frame named after the thread.
+    """
+
+    def __init__(self, threshold_ms, interval_ms=10.0, output_dir=DEFAULT_PROFILE_DIR, max_files=200,
+                 shared_threads=('inference-batcher',)):
+        self.threshold = threshold_ms / 1000.0
+        self.interval = max(0.001, interval_ms / 1000.0)
+        self.output_dir = output_dir
+        self.max_files = max_files
+        self.shared_threads = tuple(shared_threads)
+        self.files_written = 0
+        self._lock = threading.Lock()
+        self._active = {}  # thread ident -> {folded stack: samples}
+        self._pid = None
+
+    def _ensure_started(self):
+        # The sampling thread does not survive fork(); start one per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._active = {}
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='slow-request-profiler', daemon=True).start()
+
+    @staticmethod
+    def _fold(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                shared = []
+                if self.shared_threads:
+                    for thread in threading.enumerate():
+                        if thread.name.startswith(self.shared_threads) and thread.ident in frames:
+                            shared.append(f"{thread.name};{self._fold(frames[thread.ident])}")
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is None or ident == me:
+                        continue
+                    for stack in [self._fold(frame)] + shared:
+                        stacks[stack] = stacks.get(stack, 0) + 1
+
+    def begin(self):
+        self._ensure_started()
+        with self._lock:
+            self._active[threading.get_ident()] = {}
+
+    def end(self, seconds, name):
+        """Stop sampling this thread's request; returns the profile path if it was slow enough to dump"""
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), None)
+        if not stacks or seconds < self.threshold or self.files_written >= self.max_files:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        slug = ''.join(c if c.isalnum() else '_' for c in name).strip('_') or 'request'
+        path = os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+                                             f"{slug}-{seconds * 1000:.0f}ms.folded")
+        with open(path, 'w') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+        self.files_written += 1
+        print(f"Slow request {name} took {seconds * 1000:.0f} ms; profile written to {path}")
+        return path
+
+
+def load_profiler():
+    """SlowRequestProfiler when PROFILE_SLOW_MS is set, else None"""
+    threshold = os.environ.get("PROFILE_SLOW_MS")
+    if not threshold:
+        return None
+    return SlowRequestProfiler(
+        float(threshold),
+        interval_ms=float(os.environ.get("PROFILE_INTERVAL_MS", "10")),
+        output_dir=os.environ.get("PROFILE_DIR", DEFAULT_PROFILE_DIR),
+        max_files=int(os.environ.get("PROFILE_MAX_FILES", "200")))
+
+
+def install(app, registry, profiler=None):
+    """Per-endpoint request count and latency, Server-Timing breakdowns and GET /metrics on a Flask app.
+
+    For streamed responses the latency is the time until the response starts.
+    """
+    from flask import Response, g, request
+
+    requests_total = registry.counter('requests', 'HTTP requests', ['endpoint', 'method', 'status'])
+    request_seconds = registry.histogram('request_seconds', 'HTTP request latency', ['endpoint'])
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        registry.begin_request()
+        if profiler is not None:
+            profiler.begin()
+
+    def finish(status, response=None):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        requests_total.inc(endpoint=endpoint, method=request.method, status=status)
+        request_seconds.observe(seconds, endpoint=endpoint)
+        stages = registry.end_request()
+        if stages and response is not None:
+            response.headers['Server-Timing'] = ', '.join(
+                f"{name};dur={1000.0 * value:.1f}" for name, value in stages.items())
+        if profiler is not None:
+            profiler.end(seconds, f"{request.method} {endpoint}")
+
+    @app.after_request
+    def record_request(response):
+        finish(response.status_code, response)
+        return response
+
+    @app.teardown_request
+    def record_failed_request(error):
+        # after_request is skipped when a view raises; count those as 500s
+        finish(500)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    return requests_total, request_seconds
@@ -0,0 +1,252 @@
+"""Several image classifiers served side by side, loaded on demand.
+
+Models are listed in a JSON file (MODEL_REGISTRY):
+
+  {
+    "default": "plantvillage",
+    "models": [
+      {"name": "plantvillage", "path": "linkanjarad/mobilenet_v2_1.0_224-plant-disease-identification"},
+      {"name": "mango", "path": "./my_mango_model", "crops": ["Mango"]},
+      {"name": "vit", "path": "./my_plant_disease_model", "crops": ["Tomato"], "backend": "quantized"}
+    ]
+  }
+
+A model is loaded the first time a request is routed to it. Loaded models
+are kept in LRU order under a memory budget (the size of the weights their
+backends serve); loading one that does not fit unloads the least recently
+used ones first. Requests are routed by an optional crop hint. Models
+without a "crops" list serve the plants their labels name; explicit lists
+take precedence, then the first model listed wins. Unhinted or unknown crops go to the
+default model.
+
+The path "random" builds a tiny randomly initialised MobileNetV2 over the
+built-in advice labels instead of loading weights, for benchmarks and
+offline tests (see benchmark.py).
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from metrics import percentile
+
+# Per-model latency samples kept for the p50/p95 in stats()
+LATENCY_WINDOW = 1000
+
+# ModelSpec path of the random benchmark classifier
+RANDOM_MODEL = 'random'
+
+
+class ModelSpec:
+    """Where to load one model from and which crops it serves"""
+
+    __slots__ = ('name', 'path', 'crops', 'backend', 'onnx_path')
+
+    def __init__(self, name, path, crops=None, backend=None, onnx_path=None):
+        self.name = name
+        self.path = path
+        self.crops = list(crops) if crops else None
+        self.backend = backend
+        self.onnx_path = onnx_path
+
+
+def load_specs(path=None, default_name='default', default_path=None):
+    """(specs, default model name) from a MODEL_REGISTRY file, or the single default_path model"""
+    if not path:
+        return [ModelSpec(default_name, default_path)], default_name
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    specs = []
+    for entry in config['models']:
+        model_path = entry['path']
+        # Relative local directories are relative to the registry file
+        if model_path.startswith('.') and not os.path.isabs(model_path):
+            model_path = os.path.normpath(os.path.join(base, model_path))
+        specs.append(ModelSpec(entry['name'], model_path, entry.get('crops'),
+                               entry.get('backend'), entry.get('onnx_path')))
+    names = [spec.name for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate model names in {path}")
+    default = config.get('default', names[0])
+    if default not in names:
+        raise ValueError(f"Default model '{default}' is not listed in {path}")
+    return specs, default
+
+
+def random_classifier(labels, seed=0):
+    """(image processor, model): an untrained MobileNetV2 at a third of the usual width"""
+    import torch
+    from transformers import MobileNetV2Config, MobileNetV2ForImageClassification, MobileNetV2ImageProcessor
+
+    torch.manual_seed(seed)
+    config = MobileNetV2Config(depth_multiplier=0.35, num_labels=len(labels),
+                               id2label=dict(enumerate(labels)),
+                               label2id={label: i for i, label in enumerate(labels)})
+    return MobileNetV2ImageProcessor(), MobileNetV2ForImageClassification(config).eval()
+
+
+class ModelRegistry:
+    """Lazily loaded, memory-bounded set of models with crop-hint routing.
+
+    `loader(spec)` builds the served object; it must have a `memory_bytes`
+    attribute and a `close()` method that releases background resources.
+    `aliases` maps lower-case crop words (any language) to plant names.
+    """
+
+    def __init__(self, specs, default, loader, memory_budget_bytes=0, aliases=None):
+        self.specs = OrderedDict((spec.name, spec) for spec in specs)
+        self.default = default
+        self.loader = loader
+        self.memory_budget_bytes = max(0, int(memory_budget_bytes))
+        self.aliases = {k.lower(): v for k, v in (aliases or {}).items()}
+
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in self.specs}
+        self._loaded = OrderedDict()  # name -> served model, least recently used first
+        self._sizes = {}  # name -> bytes at the last load, to make room before reloading
+        self._counters = {name: {'loads': 0, 'evictions': 0, 'load_errors': 0, 'load_seconds': 0.0,
+                                 'requests': 0, 'images': 0, 'routed': 0}
+                          for name in self.specs}
+        self._latencies = {name: deque(maxlen=LATENCY_WINDOW) for name in self.specs}
+        self._routes = {}
+        self.set_crops()
+
+    def set_crops(self, crops_by_model=None):
+        """Rebuild the crop -> model table; crops_by_model fills in specs without explicit crops"""
+        routes = {}
+        # Explicitly listed crops win over the ones inferred from model labels
+        for name, spec in self.specs.items():
+            for crop in spec.crops or []:
+                routes.setdefault(crop.lower(), name)
+        for name, crops in (crops_by_model or {}).items():
+            if not self.specs[name].crops:
+                for crop in crops:
+                    routes.setdefault(crop.lower(), name)
+        self._routes = routes
+
+    def resolve_crop(self, hint):
+        """Plant name for a crop hint such as 'tomatoes' or 'طماطم', or the hint itself"""
+        key = hint.strip().lower()
+        return self.aliases.get(key, hint.strip())
+
+    def route(self, hint=None):
+        """Model name to serve a request with this crop hint"""
+        name = self.default
+        if hint and hint.strip():
+            name = self._routes.get(self.resolve_crop(hint).lower(), self.default)
+        with self._lock:
+            self._counters[name]['routed'] += 1
+        return name
+
+    def peek(self, name):
+        """The loaded model, or None without loading it"""
+        with self._lock:
+            return self._loaded.get(name)
+
+    def get(self, name):
+        """The loaded model `name`, loading it (and unloading others to fit) if needed"""
+        if name not in self.specs:
+            raise KeyError(f"Unknown model '{name}'")
+        with self._lock:
+            served = self._loaded.get(name)
+            if served is not None:
+                self._loaded.move_to_end(name)
+                return served
+
+        # One load per model at a time; other models keep serving meanwhile
+        with self._load_locks[name]:
+            with self._lock:
+                served = self._loaded.get(name)
+                if served is not None:
+                    self._loaded.move_to_end(name)
+                    return served
+                # Make room using the size from the previous load, if any
+                evicted = self._evict(self._sizes.get(name, 0))
+            self._close(evicted)
+
+            t0 = time.perf_counter()
+            try:
+                served = self.loader(self.specs[name])
+            except Exception:
+                with self._lock:
+                    self._counters[name]['load_errors'] += 1
+                raise
+            seconds = time.perf_counter() - t0
+
+            with self._lock:
+                self._loaded[name] = served
+                self._sizes[name] = served.memory_bytes
+                counters = self._counters[name]
+                counters['loads'] += 1
+                counters['load_seconds'] = seconds
+                evicted = self._evict(0, keep=name)
+            self._close(evicted)
+            print(f"Loaded model '{name}' in {seconds:.1f}s "
+                  f"({served.memory_bytes / 2 ** 20:.0f} MB, {len(self._loaded)} loaded)")
+            return served
+
+    def _evict(self, incoming_bytes, keep=None):
+        # Called with self._lock held; returns the unloaded models to close
+        evicted = []
+        if not self.memory_budget_bytes:
+            return evicted
+        while self._loaded:
+            used = sum(served.memory_bytes for served in self._loaded.values())
+            if used + incoming_bytes <= self.memory_budget_bytes:
+                break
+            name = next(iter(self._loaded))
+            if name == keep:
+                # Never unload the model just loaded, even if it alone is over budget
+                if len(self._loaded) == 1:
+                    break
+                self._loaded.move_to_end(name)
+                name = next(iter(self._loaded))
+            evicted.append((name, self._loaded.pop(name)))
+            self._counters[name]['evictions'] += 1
+        return evicted
+
+    def _close(self, evicted):
+        # Requests already holding a model finish with it; it is freed afterwards
+        for name, served in evicted:
+            print(f"Unloading model '{name}' to stay within the memory budget")
+            served.close()
+
+    def record(self, name, seconds, images=1):
+        """Account one inference call on `name`"""
+        with self._lock:
+            counters = self._counters[name]
+            counters['requests'] += 1
+            counters['images'] += images
+            self._latencies[name].append(seconds)
+
+    def stats(self):
+        with self._lock:
+            loaded = dict(self._loaded)
+            models = {}
+            for name, spec in self.specs.items():
+                latencies = list(self._latencies[name])
+                served = loaded.get(name)
+                models[name] = {
+                    'path': spec.path,
+                    'crops': sorted(crop for crop, target in self._routes.items() if target == name),
+                    'loaded': served is not None,
+                    'memory_mb': self._sizes.get(name, 0) / 2 ** 20,
+                    'latency_ms': {
+                        'mean': 1000.0 * sum(latencies) / len(latencies) if latencies else 0.0,
+                        'p50': 1000.0 * percentile(latencies, 50),
+                        'p95': 1000.0 * percentile(latencies, 95),
+                        'max': 1000.0 * max(latencies) if latencies else 0.0,
+                    },
+                    **self._counters[name],
+                }
+                if served is not None and hasattr(served, 'stats'):
+                    models[name].update(served.stats())
+        return {
+            'default': self.default,
+            'memory_budget_mb': self.memory_budget_bytes / 2 ** 20,
+            'loaded_mb': sum(served.memory_bytes for served in loaded.values()) / 2 ** 20,
+            'loaded': list(loaded),
+            'models': models,
+        }
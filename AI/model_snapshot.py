@@ -0,0 +1,257 @@
+"""Pinned local model snapshots for a fast, offline cold start.
+
+`from_pretrained(<hub id>)` resolves the model through the Hugging Face hub
+on every boot and materialises a fresh copy of the weights in each process.
+A snapshot is the model and image processor saved once to
+model_snapshots/<org>--<name>/ as safetensors, plus a snapshot.json manifest
+recording where it came from. ServedModel loads from it with no network
+access. The weights are memory-mapped copy-on-write, so they are read
+lazily from the page cache and every worker maps the same physical pages.
+That sharing only lasts while the eager model is what gets served: the
+quantized and ONNX backends build their own copy of the weights in each
+process and the mapped model is then dropped (see KEEP_EAGER_MODEL).
+
+  python model_snapshot.py save                  # every hub model the API serves
+  python model_snapshot.py save --model linkanjarad/mobilenet_v2_1.0_224-plant-disease-identification
+  python model_snapshot.py startup --runs 3      # boot-to-ready: hub vs snapshot, eager vs lazy
+
+Local model directories that already hold model.safetensors (e.g. from
+train_my_model.py) are loaded the same way.
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+AI_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SNAPSHOT_DIR = os.path.join(AI_DIR, 'model_snapshots')
+MANIFEST = 'snapshot.json'
+WEIGHTS = 'model.safetensors'
+WEIGHTS_INDEX = 'model.safetensors.index.json'
+
+# safetensors dtype names -> torch dtype attribute names
+SAFETENSORS_DTYPES = {
+    'F64': 'float64', 'F32': 'float32', 'F16': 'float16', 'BF16': 'bfloat16',
+    'I64': 'int64', 'I32': 'int32', 'I16': 'int16', 'I8': 'int8', 'U8': 'uint8', 'BOOL': 'bool',
+}
+
+
+@contextmanager
+def timed(phases, name):
+    """Add the time spent in the block to phases[name]"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = phases.get(name, 0.0) + time.perf_counter() - t0
+
+
+def snapshot_path(model_id, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, model_id.replace('/', '--'))
+
+
+def has_weights(path):
+    return os.path.isfile(os.path.join(path, WEIGHTS)) or os.path.isfile(os.path.join(path, WEIGHTS_INDEX))
+
+
+def find_snapshot(path, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    """Local directory to load `path` (hub id or directory) from with mmap'd weights, or None"""
+    if os.path.isdir(path):
+        return path if has_weights(path) else None
+    local = snapshot_path(path, snapshot_dir)
+    return local if has_weights(local) else None
+
+
+def read_id2label(path):
+    """Class labels from a local model directory's config.json, without importing transformers"""
+    with open(os.path.join(path, 'config.json'), encoding='utf-8') as f:
+        return {int(k): v for k, v in json.load(f)['id2label'].items()}
+
+
+def read_manifest(path):
+    """snapshot.json of a snapshot directory, or None (e.g. for a train_my_model.py output)"""
+    try:
+        with open(os.path.join(path, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def mmap_safetensors(path):
+    """{name: tensor} backed by a private (copy-on-write) memory map of a .safetensors file"""
+    import torch
+
+    with open(path, 'rb') as f:
+        header_len = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_len))
+        # Untouched pages stay shared with the page cache and with other workers
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    start = 8 + header_len
+    tensors = {}
+    for name, info in header.items():
+        if name == '__metadata__':
+            continue
+        dtype = getattr(torch, SAFETENSORS_DTYPES[info['dtype']])
+        begin, end = info['data_offsets']
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        if count == 0:
+            tensors[name] = torch.empty(info['shape'], dtype=dtype)
+        else:
+            tensors[name] = torch.frombuffer(buf, dtype=dtype, count=count,
+                                             offset=start + begin).reshape(info['shape'])
+    return tensors
+
+
+def mmap_state_dict(path):
+    """All weights of a local model directory, single-file or sharded"""
+    index = os.path.join(path, WEIGHTS_INDEX)
+    if not os.path.isfile(index):
+        return mmap_safetensors(os.path.join(path, WEIGHTS))
+    with open(index, encoding='utf-8') as f:
+        shards = sorted(set(json.load(f)['weight_map'].values()))
+    state = {}
+    for shard in shards:
+        state.update(mmap_safetensors(os.path.join(path, shard)))
+    return state
+
+
+def load_snapshot(path, phases=None):
+    """(image processor, model) from a local directory, offline, with memory-mapped weights.
+
+    The model is built on the meta device and its parameters are then
+    pointed at the mapped tensors, so nothing is randomly initialised or
+    copied. Falls back to a regular local from_pretrained when the weights
+    don't cover the model (or torch is too old for load_state_dict(assign=True)).
+    """
+    phases = {} if phases is None else phases
+    manifest = read_manifest(path)
+    if manifest and manifest.get('reinitialized_keys'):
+        print(f"Warning: snapshot {path} has randomly initialised weights from {manifest['source']}: "
+              f"{', '.join(manifest['reinitialized_keys'])}")
+    with timed(phases, 'imports'):
+        import torch
+        from transformers import AutoConfig, AutoImageProcessor, AutoModelForImageClassification
+
+    with timed(phases, 'config'):
+        processor = AutoImageProcessor.from_pretrained(path, local_files_only=True)
+        config = AutoConfig.from_pretrained(path, local_files_only=True)
+    with timed(phases, 'weights'):
+        state = mmap_state_dict(path)
+        with torch.device('meta'):
+            model = AutoModelForImageClassification.from_config(config)
+        try:
+            missing, unexpected = model.load_state_dict(state, strict=False, assign=True)
+        except TypeError:
+            missing, unexpected = ['<assign unsupported>'], []
+        if missing or unexpected or any(t.is_meta for t in list(model.parameters()) + list(model.buffers())):
+            print(f"Snapshot {path} does not map onto the model "
+                  f"({len(missing)} missing, {len(unexpected)} unexpected); loading it without mmap")
+            model = AutoModelForImageClassification.from_pretrained(path, local_files_only=True)
+    return processor, model.eval()
+
+
+def save_snapshot(model_id, output_dir):
+    """Download `model_id` once and save it with its processor as a local safetensors snapshot"""
+    from transformers import AutoImageProcessor, AutoModelForImageClassification
+
+    processor = AutoImageProcessor.from_pretrained(model_id)
+    # Same load as the API's hub path. Weights it had to initialise randomly
+    # (e.g. a head whose size does not match) would be frozen into the
+    # snapshot, so they are recorded in the manifest and warned about on load
+    model, info = AutoModelForImageClassification.from_pretrained(
+        model_id, ignore_mismatched_sizes=True, output_loading_info=True)
+    reinitialized = sorted(set(info.get('missing_keys', []))
+                           | {key for key, *_ in info.get('mismatched_keys', [])})
+    os.makedirs(output_dir, exist_ok=True)
+    processor.save_pretrained(output_dir)
+    model.save_pretrained(output_dir, safe_serialization=True)
+    files = {name: os.path.getsize(os.path.join(output_dir, name))
+             for name in sorted(os.listdir(output_dir)) if name != MANIFEST}
+    manifest = {
+        'source': model_id,
+        'revision': getattr(model.config, '_commit_hash', None),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'files': files,
+        'reinitialized_keys': reinitialized,
+    }
+    with open(os.path.join(output_dir, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+# Run in a fresh interpreter per measurement so imports and page cache state are real
+STARTUP_PROBE = (
+    "import json, detect_disease_api as api; api.warm_up(); "
+    "print('STARTUP ' + json.dumps(api.startup_report()))")
+
+
+def measure_startup(env):
+    t0 = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', STARTUP_PROBE], cwd=AI_DIR, env=env,
+                            capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    for line in result.stdout.splitlines():
+        if line.startswith('STARTUP '):
+            report = json.loads(line[len('STARTUP '):])
+            if report['ready_seconds'] is None:
+                break
+            report['wall_seconds'] = wall
+            return report
+    raise RuntimeError(f"Startup probe failed:\n{result.stdout[-2000:]}{result.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--snapshot-dir', default=os.environ.get('MODEL_SNAPSHOT_DIR', DEFAULT_SNAPSHOT_DIR))
+    sub = parser.add_subparsers(dest='command', required=True)
+    save_cmd = sub.add_parser('save', help='Snapshot hub models locally')
+    save_cmd.add_argument('--model', action='append',
+                          help='Hub model id (repeatable; default: every hub model in MODEL_REGISTRY)')
+    startup_cmd = sub.add_parser('startup', help='Measure boot-to-ready time in fresh processes')
+    startup_cmd.add_argument('--runs', type=int, default=3)
+    startup_cmd.add_argument('--json', action='store_true', help='Print the full reports as JSON')
+    args = parser.parse_args()
+
+    if args.command == 'save':
+        model_ids = args.model
+        if not model_ids:
+            # Only the model specs are needed here, not the weights
+            os.environ['LAZY_STARTUP'] = '1'
+            from detect_disease_api import RANDOM_MODEL, models
+            model_ids = [spec.path for spec in models.specs.values()
+                         if spec.path != RANDOM_MODEL and not os.path.isdir(spec.path)]
+        for model_id in model_ids:
+            output_dir = snapshot_path(model_id, args.snapshot_dir)
+            t0 = time.perf_counter()
+            manifest = save_snapshot(model_id, output_dir)
+            size = sum(manifest['files'].values())
+            print(f"{model_id} -> {output_dir} ({size / 2 ** 20:.1f} MB, {time.perf_counter() - t0:.1f}s)")
+            if manifest['reinitialized_keys']:
+                print(f"  Warning: randomly initialised, not from the hub: "
+                      f"{', '.join(manifest['reinitialized_keys'])}")
+        return
+
+    modes = [('hub, eager', {'MODEL_SNAPSHOT': '0', 'LAZY_STARTUP': '0'}),
+             ('snapshot, eager', {'MODEL_SNAPSHOT': '1', 'LAZY_STARTUP': '0'}),
+             ('snapshot, lazy', {'MODEL_SNAPSHOT': '1', 'LAZY_STARTUP': '1'})]
+    results = {}
+    for label, overrides in modes:
+        env = dict(os.environ, MODEL_SNAPSHOT_DIR=args.snapshot_dir, **overrides)
+        runs = [measure_startup(env) for _ in range(args.runs)]
+        results[label] = runs
+        best = min(runs, key=lambda r: r['ready_seconds'])
+        phases = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in best['phases'].items())
+        print(f"{label:16s} ready in {best['ready_seconds']:.2f}s "
+              f"(process {best['wall_seconds']:.2f}s; {phases})"
+              + ('' if best['snapshot'] else ' [no snapshot]'))
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,51 +1,224 @@
-from flask import Flask, request, jsonify
-import google.generativeai as palm
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import os  # Import the os module
 from dotenv import load_dotenv  # Import load_dotenv      
 from datetime import datetime
+import hashlib
+import json
+import threading
+import time
 import uuid
+from llm_providers import load_provider, limit_stream
+from generation_cache import GenerationCache, generation_key
+from session_store import load_session_store
+from conversation_context import ConversationContext
+from retrieval_index import DEFAULT_INDEX_PATH, RetrievalIndex, index_status, refresh_index
+from metrics import Registry, install as install_metrics, load_profiler
 
 load_dotenv()  # Load environment variables from .env file
 
 app = Flask(__name__)
 CORS(app)
 
-# Set your Gemini 1.5 (PaLM) API key from environment variable
-api_key = os.environ.get("PALM_API_KEY")
-if not api_key:
-    raise ValueError("PALM_API_KEY environment variable not set.")
-palm.configure(api_key=api_key)
+# Per-stage timers, upstream LLM latency/errors and cache/session state at
+# GET /metrics (Prometheus format, see metrics.py)
+metrics = Registry('palm_api')
+install_metrics(app, metrics, load_profiler())
+llm_seconds = metrics.histogram('llm_seconds', 'Latency of upstream LLM generations', ['provider', 'mode'])
+llm_errors = metrics.counter('llm_errors', 'Failed upstream LLM generations', ['provider', 'error'])
+chat_responses = metrics.counter('chat_responses', '/palm-chat answers by source', ['source'])
 
-# ENHANCED: Conversation memory storage
-conversation_sessions = {}
+# One model client for the whole process. PALM_PROVIDER=fake swaps Gemini
+# for an offline stub (no API key needed) for tests and benchmarks.
+provider = load_provider()
+
+# Identical requests (same prompt, disease context and history) are served
+# from this cache, and concurrent duplicates share one upstream call.
+generation_cache = GenerationCache(
+    max_entries=int(os.environ.get("GENERATION_CACHE_MAX_ENTRIES", "1000")),
+    ttl=float(os.environ.get("GENERATION_CACHE_TTL", "3600")),
+    wait_timeout=float(os.environ.get("GENERATION_WAIT_TIMEOUT", "120")))
+
+# ENHANCED: Conversation memory storage. Bounded: idle sessions expire,
+# least recently used ones are evicted past the caps, and SESSION_STORE=sqlite
+# keeps them on disk so they survive restarts and are shared by all workers.
+conversation_sessions = load_session_store()
+
+# Prompt history budget. Turns past it are folded into a short rolling summary.
+CONTEXT_MAX_CHARS = int(os.environ.get("CONTEXT_MAX_CHARS", "6000"))
+CONTEXT_MAX_TURNS = int(os.environ.get("CONTEXT_MAX_TURNS", "10"))
+CONTEXT_SUMMARY_MAX_CHARS = int(os.environ.get("CONTEXT_SUMMARY_MAX_CHARS", "1000"))
+
+# Local agronomy knowledge base (AI/Data). Questions that closely match a
+# stored one are answered from it directly; otherwise the best passages are
+# added to the prompt as grounding.
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "3"))
+RETRIEVAL_DIRECT_THRESHOLD = float(os.environ.get("RETRIEVAL_DIRECT_THRESHOLD", "0.8"))
+RETRIEVAL_MIN_SIMILARITY = float(os.environ.get("RETRIEVAL_MIN_SIMILARITY", "0.25"))
+RETRIEVAL_INDEX_PATH = os.environ.get("RETRIEVAL_INDEX_PATH", DEFAULT_INDEX_PATH)
+retrieval_index = None
+
+
+def refresh_retrieval_index():
+    """Rebuild a missing or outdated index off the request path and switch to it"""
+    global retrieval_index
+    try:
+        if refresh_index(RETRIEVAL_INDEX_PATH) or retrieval_index is None:
+            retrieval_index = RetrievalIndex(RETRIEVAL_INDEX_PATH)
+            print(f"Retrieval index: {retrieval_index.n_docs} passages")
+    except Exception as e:
+        print(f"Retrieval index refresh failed ({e})")
+
+
+if os.environ.get("RETRIEVAL", "1") == "1":
+    # Only file stats are checked here; hashing and building happen in the background
+    status = index_status(RETRIEVAL_INDEX_PATH)
+    try:
+        if status != 'missing':
+            retrieval_index = RetrievalIndex(RETRIEVAL_INDEX_PATH)
+            print(f"Retrieval index: {retrieval_index.n_docs} passages")
+    except Exception as e:
+        print(f"Retrieval index unavailable ({e}); every question goes to the model.")
+        status = 'changed'
+    if status != 'fresh':
+        print(f"Retrieval index is {status}; refreshing it in the background")
+        threading.Thread(target=refresh_retrieval_index, name='retrieval-index', daemon=True).start()
+# Updated from concurrent request threads, read by /stats and /metrics
+retrieval_counts = {'direct_answers': 0, 'grounded': 0}
+retrieval_counts_lock = threading.Lock()
+
+
+def count_retrieval(kind):
+    with retrieval_counts_lock:
+        retrieval_counts[kind] += 1
+
+
+def retrieval_counts_snapshot():
+    with retrieval_counts_lock:
+        return dict(retrieval_counts)
 
 
 def get_or_create_session(session_id):
     """Get existing session or create new one"""
-    if session_id not in conversation_sessions:
-        conversation_sessions[session_id] = {
-            'messages': [],
-            'created_at': datetime.now(),
-            'last_activity': datetime.now()
-        }
-    else:
-        conversation_sessions[session_id]['last_activity'] = datetime.now()
-    return conversation_sessions[session_id]
+    return conversation_sessions.get_or_create(session_id)
+
+
+def history_digest(history):
+    """Digest of the history that goes into the prompt, for the generation cache key"""
+    return hashlib.blake2b(history.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def session_context(session, save=True):
+    """Cached rendered history for a session, caught up with its latest messages.
+
+    Written back to the session store only when new turns were rendered;
+    with save=False the caller saves it after updating it further.
+    """
+    if session.context is None:
+        session.context = ConversationContext(
+            CONTEXT_MAX_CHARS, CONTEXT_MAX_TURNS, CONTEXT_SUMMARY_MAX_CHARS)
+        if session.context_state:
+            # Saved by a persistent store: only turns added since then are rendered
+            session.context.restore(session.context_state)
+    context = session.context
+    revision = context.revision
+    context.sync(session.messages)
+    context.history()
+    if save and context.revision != revision:
+        conversation_sessions.save_context(session)
+    return context
 
 
 def build_conversation_context(session):
     """Build conversation context from message history"""
-    context = "You are AgroMind, an expert agricultural AI assistant specializing in crop disease detection and agricultural advice. You help farmers with CONCISE, FOCUSED advice. Keep responses brief and practical - aim for 2-3 sentences unless specifically asked for more detail.\n\n"
+    return session_context(session).history()
 
-    if session['messages']:
-        context += "Previous conversation:\n"
-        for msg in session['messages'][-10:]:  # Keep last 10 messages for context
-            context += f"User: {msg['user']}\n"
-            context += f"Assistant: {msg['assistant']}\n\n"
 
-    context += "Current conversation:\n"
-    return context
+def retrieve(prompt):
+    """Knowledge base passages similar enough to the prompt to be useful, best first"""
+    if retrieval_index is None or not prompt.strip():
+        return []
+    return [hit for hit in retrieval_index.search(prompt, k=RETRIEVAL_TOP_K)
+            if hit['similarity'] >= RETRIEVAL_MIN_SIMILARITY]
+
+
+def build_grounding(passages):
+    """Prompt section with retrieved passages for the model to draw on"""
+    lines = ["Reference notes from the local agronomy knowledge base (use them if relevant):\n"]
+    for hit in passages:
+        lines.append(f"- Q: {hit['question']}\n  A: {hit['answer']}\n")
+    lines.append("\n")
+    return ''.join(lines)
+
+
+def timed_stream(prompt):
+    """provider.generate_stream with its latency and failures recorded as upstream LLM metrics"""
+    t0 = time.perf_counter()
+    try:
+        yield from provider.generate_stream(prompt)
+    except Exception as e:
+        llm_errors.inc(provider=provider.name, error=type(e).__name__)
+        raise
+    finally:
+        # Also reached when the stream is closed early by limit_stream
+        llm_seconds.observe(time.perf_counter() - t0, provider=provider.name, mode='stream')
+
+
+def timed_generate(prompt):
+    t0 = time.perf_counter()
+    try:
+        text = provider.generate(prompt)
+    except Exception as e:
+        llm_errors.inc(provider=provider.name, error=type(e).__name__)
+        raise
+    llm_seconds.observe(time.perf_counter() - t0, provider=provider.name, mode='complete')
+    return text
+
+
+def parse_limit(value):
+    """Positive int from the request, or None for no limit"""
+    try:
+        return max(0, int(value or 0)) or None
+    except (TypeError, ValueError):
+        return None
+
+
+def sse(payload, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload)}\n\n"
+
+
+def stream_chat(session, prompt, disease_context, full_prompt, cache_key, max_sentences, max_chars,
+                direct_answer=None):
+    """Server-sent events: one event per generated chunk, then `done` with the full response"""
+    if direct_answer is not None:
+        assistant_response, source = direct_answer, 'retrieval'
+    else:
+        assistant_response, source = generation_cache.get(cache_key), 'cache'
+    if assistant_response is not None:
+        yield sse({'chunk': assistant_response})
+    else:
+        source = 'upstream'
+        parts = []
+        try:
+            for chunk in limit_stream(timed_stream(full_prompt), max_sentences, max_chars):
+                parts.append(chunk)
+                yield sse({'chunk': chunk})
+        except Exception as e:
+            yield sse({'error': f'AI service error: {str(e)}'}, event='error')
+            return
+        assistant_response = ''.join(parts)
+        generation_cache.put(cache_key, assistant_response)
+    chat_responses.inc(source=source)
+
+    # Store the complete answer once the stream has finished
+    conversation_sessions.append(session, prompt, assistant_response, disease_context)
+    yield sse({
+        'response': assistant_response,
+        'session_id': session.id,
+        'source': source,
+        'early_stop': bool(max_sentences or max_chars)
+    }, event='done')
 
 
 @app.route('/palm-chat', methods=['POST'])
@@ -55,12 +228,30 @@ def palm_chat():
     session_id = data.get('session_id', 'default')
     # NEW: Disease detection context
     disease_context = data.get('disease_context', '')
+    # Streaming (server-sent events) and early stop after N sentences / chars
+    stream = bool(data.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
+    max_sentences = parse_limit(data.get('max_sentences'))
+    max_chars = parse_limit(data.get('max_chars'))
 
     # Get or create conversation session
-    session = get_or_create_session(session_id)
+    with metrics.stage('session'):
+        session = get_or_create_session(session_id)
 
-    # Build conversation context with history
-    conversation_context = build_conversation_context(session)
+    # Build conversation context with history (only new turns are rendered)
+    with metrics.stage('context'):
+        context = session_context(session, save=False)
+        conversation_context = context.history()
+
+    # Answer from the knowledge base on a near-identical question, else ground the prompt
+    with metrics.stage('retrieval'):
+        passages = retrieve(prompt)
+    direct_answer = None
+    if passages and not disease_context and passages[0]['similarity'] >= RETRIEVAL_DIRECT_THRESHOLD:
+        direct_answer = ''.join(limit_stream(iter([passages[0]['answer']]), max_sentences, max_chars))
+        count_retrieval('direct_answers')
+    elif passages:
+        conversation_context += build_grounding(passages)
+        count_retrieval('grounded')
 
     # Add disease context if provided
     if disease_context:
@@ -68,23 +259,48 @@ def palm_chat():
 
     # Add current user prompt
     full_prompt = conversation_context + f"User: {prompt}\nAssistant: "
+    context.last_prompt_chars = len(full_prompt)
+    conversation_sessions.save_context(session)
+
+    cache_key = generation_key(
+        prompt, disease_context, history_digest(conversation_context),
+        f"{max_sentences}:{max_chars}")
+
+    if stream:
+        return Response(
+            stream_chat(session, prompt, disease_context, full_prompt, cache_key, max_sentences, max_chars,
+                        direct_answer),
+            mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    if direct_answer is not None:
+        conversation_sessions.append(session, prompt, direct_answer, disease_context)
+        chat_responses.inc(source='retrieval')
+        return jsonify({
+            'response': direct_answer,
+            'session_id': session_id,
+            'source': 'retrieval',
+            'early_stop': bool(max_sentences or max_chars)
+        })
+
+    def generate():
+        if max_sentences or max_chars:
+            # Stop generating once the answer is long enough instead of truncating afterwards
+            return ''.join(limit_stream(timed_stream(full_prompt), max_sentences, max_chars))
+        return timed_generate(full_prompt)
 
     try:
-        model = palm.GenerativeModel('gemini-1.5-flash-latest')
-        response = model.generate_content(full_prompt)
-        assistant_response = response.text
+        with metrics.stage('generation'):
+            assistant_response, source = generation_cache.get_or_generate(cache_key, generate)
+        chat_responses.inc(source=source)
 
         # Store conversation in session memory
-        session['messages'].append({
-            'user': prompt,
-            'assistant': assistant_response,
-            'timestamp': datetime.now(),
-            'disease_context': disease_context if disease_context else None
-        })
+        conversation_sessions.append(session, prompt, assistant_response, disease_context)
 
         return jsonify({
             'response': assistant_response,
-            'session_id': session_id
+            'session_id': session_id,
+            'source': source,
+            'early_stop': bool(max_sentences or max_chars)
         })
 
     except Exception as e:
@@ -105,8 +321,7 @@ def clear_session():
     data = request.json
     session_id = data.get('session_id', 'default')
 
-    if session_id in conversation_sessions:
-        conversation_sessions[session_id]['messages'] = []
+    if conversation_sessions.clear(session_id):
         return jsonify({'message': 'Session cleared successfully'})
     else:
         return jsonify({'message': 'Session not found'}), 404
@@ -118,17 +333,50 @@ def session_info():
     data = request.json
     session_id = data.get('session_id', 'default')
 
-    if session_id in conversation_sessions:
-        session = conversation_sessions[session_id]
+    session = conversation_sessions.get(session_id)
+    if session is not None:
         return jsonify({
             'session_id': session_id,
-            'message_count': len(session['messages']),
-            'created_at': session['created_at'].isoformat(),
-            'last_activity': session['last_activity'].isoformat()
+            'message_count': len(session.messages),
+            'created_at': datetime.fromtimestamp(session.created_at).isoformat(),
+            'last_activity': datetime.fromtimestamp(session.last_activity).isoformat(),
+            'context': session_context(session).stats()
         })
     else:
         return jsonify({'message': 'Session not found'}), 404
 
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Generation cache, provider and session store statistics"""
+    return jsonify({
+        'provider': provider.name,
+        'generation_cache': generation_cache.stats(),
+        'sessions': conversation_sessions.stats(),
+        'retrieval': dict(retrieval_index.stats(), **retrieval_counts_snapshot()) if retrieval_index else None
+    })
+
+
+@metrics.collector
+def collect_metrics():
+    """Generation cache, session store and retrieval state for /metrics"""
+    cache = generation_cache.stats()
+    sessions = conversation_sessions.stats()
+    families = [
+        ('generation_cache_lookups', 'counter', 'Generation cache lookups by result',
+         [({'result': result}, cache[result]) for result in ('hits', 'coalesced', 'misses')]),
+        ('generation_cache_entries', 'gauge', 'Generations held in the cache', [({}, cache['entries'])]),
+        ('generation_cache_in_flight', 'gauge', 'Upstream generations in flight', [({}, cache['in_flight'])]),
+        ('sessions', 'gauge', 'Conversation sessions held by the session store',
+         [({'backend': sessions['backend']}, sessions['sessions'])]),
+        ('sessions_removed', 'counter', 'Sessions dropped by the session store',
+         [({'reason': 'expired'}, sessions['expired']), ({'reason': 'evicted'}, sessions['evicted'])]),
+    ]
+    if retrieval_index is not None:
+        families.append(('retrieval_answers', 'counter', 'Prompts answered or grounded from the knowledge base',
+                         [({'kind': kind}, count) for kind, count in retrieval_counts_snapshot().items()]))
+    return families
+
+
 if __name__ == '__main__':
-    app.run(port=5005)
+    app.run(port=int(os.environ.get("PORT", "5005")))
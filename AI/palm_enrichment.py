@@ -0,0 +1,310 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_ENRICHMENT_PROMPT = "Give me ONLY the essential treatment in 1-2 sentences. No explanations, no background, just the immediate action needed."
+ADVICE_MAX_SENTENCES = 3
+ADVICE_MAX_CHARS = 250
+
+
+def truncate_advice(ai_response, max_sentences=ADVICE_MAX_SENTENCES, max_chars=ADVICE_MAX_CHARS):
+    """Aggressive truncation to keep the AI advice concise"""
+    sentences = ai_response.split('.')
+    if len(sentences) > max_sentences:
+        # Keep only first 2-3 sentences
+        ai_response = '. '.join(sentences[:max_sentences]) + '.'
+
+    # Final character limit
+    if len(ai_response) > max_chars:
+        ai_response = ai_response[:max_chars] + "..."
+    return ai_response
+
+
+class CircuitBreaker:
+    """Stop calling Palm AI after repeated failures, then probe again after a cool-down.
+
+    closed -> open after `failure_threshold` consecutive failures; open ->
+    half-open once `reset_timeout` seconds have passed, letting one request
+    through; a success closes the circuit, a failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._failures >= self.failure_threshold or self._opened_at is not None:
+                self._opened_at = time.monotonic()
+
+
+class Ticket:
+    __slots__ = ('id', 'status', 'response', 'error', 'created_at', 'done')
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = 'pending'
+        self.response = None
+        self.error = None
+        # Wall-clock, so tickets stored in sqlite expire consistently across workers
+        self.created_at = time.time()
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {
+            'ticket': self.id,
+            'status': self.status,
+            'response': self.response,
+            'error': self.error,
+        }
+
+
+class PalmEnrichment:
+    """Runs Palm AI enrichment of detection results off the request path.
+
+    `submit()` returns a ticket immediately; a bounded thread pool calls
+    /palm-chat over one keep-alive session and the client fetches (or waits
+    on) the ticket. When Palm AI is slow, failing or the circuit is open the
+    ticket resolves to the plain advice as a fallback.
+
+    `observer(seconds, error)` is called after every /palm-chat call, with
+    error None on success.
+
+    Tickets live in the memory of the worker that issued them. With
+    `db_path` they are also written to a sqlite file, so a poll that reaches
+    another worker finds them there (polling the row while it is pending).
+    """
+
+    def __init__(self, palm_url, max_concurrency=4, max_pending=64, timeout=30.0,
+                 ticket_ttl=600.0, failure_threshold=5, reset_timeout=30.0, observer=None,
+                 db_path=None, poll_interval=0.2):
+        self.palm_url = palm_url
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.observer = observer
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_pending = max(1, int(max_pending))
+        self.timeout = timeout
+        self.ticket_ttl = ticket_ttl
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self._lock = threading.Lock()
+        self._tickets = {}
+        self._pending = 0
+        self._pid = None
+        self._session = None
+        self._executor = None
+        self._db = None
+        self._db_pid = None
+
+        self.submitted = 0
+        self.completed = 0
+        self.fallbacks = 0
+        self.rejected = 0
+
+    def _ensure_started(self):
+        # Sessions and thread pools don't survive fork(); build them per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency, thread_name_prefix='palm-enrichment')
+            self._tickets = {}
+            self._pending = 0
+            self._pid = os.getpid()
+
+    def _connection(self):
+        # Called with self._lock held; sqlite connections must not cross fork()
+        if self._db is None or self._db_pid != os.getpid():
+            db = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS tickets ("
+                "id TEXT PRIMARY KEY, status TEXT, response TEXT, error TEXT, created_at REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS tickets_created ON tickets (created_at)")
+            db.commit()
+            self._db = db
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _store(self, ticket):
+        # Called with self._lock held
+        db = self._connection()
+        db.execute("INSERT OR REPLACE INTO tickets VALUES (?, ?, ?, ?, ?)",
+                   (ticket.id, ticket.status, ticket.response, ticket.error, ticket.created_at))
+        db.commit()
+
+    def _load(self, ticket_id):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT status, response, error FROM tickets WHERE id = ?", (ticket_id,)).fetchone()
+        if row is None:
+            return None
+        return {'ticket': ticket_id, 'status': row[0], 'response': row[1], 'error': row[2]}
+
+    def request_palm(self, disease_context, user_prompt="", session_id="default"):
+        """Blocking call to /palm-chat on the pooled session; returns truncated advice or raises"""
+        self._ensure_started()
+        payload = {
+            'prompt': user_prompt or DEFAULT_ENRICHMENT_PROMPT,
+            'session_id': session_id,
+            'disease_context': disease_context,
+            # Palm AI stops generating at these limits rather than us truncating afterwards
+            'max_sentences': ADVICE_MAX_SENTENCES,
+            'max_chars': ADVICE_MAX_CHARS
+        }
+        t0 = time.perf_counter()
+        try:
+            response = self._session.post(self.palm_url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            if self.observer is not None:
+                self.observer(time.perf_counter() - t0, e)
+            raise
+        if self.observer is not None:
+            self.observer(time.perf_counter() - t0, None)
+        ai_response = data.get('response', 'AI response not available')
+        if data.get('early_stop'):
+            return ai_response
+        # Older Palm AI servers ignore the limits
+        return truncate_advice(ai_response, ADVICE_MAX_SENTENCES, ADVICE_MAX_CHARS)
+
+    def _expire(self):
+        cutoff = time.time() - self.ticket_ttl
+        expired = [tid for tid, t in self._tickets.items() if t.done.is_set() and t.created_at < cutoff]
+        for tid in expired:
+            del self._tickets[tid]
+        if self.db_path and self.submitted % 100 == 0:
+            db = self._connection()
+            db.execute("DELETE FROM tickets WHERE created_at < ? AND status != 'pending'", (cutoff,))
+            # Pending rows of a worker that died never resolve
+            db.execute("DELETE FROM tickets WHERE created_at < ?", (cutoff - self.ticket_ttl,))
+            db.commit()
+
+    def _finish(self, ticket, status, response, error=None):
+        ticket.status = status
+        ticket.response = response
+        ticket.error = error
+        with self._lock:
+            self._pending -= 1
+            if status == 'done':
+                self.completed += 1
+            else:
+                self.fallbacks += 1
+            if self.db_path:
+                try:
+                    self._store(ticket)
+                except sqlite3.Error as e:
+                    print(f"Could not store enrichment ticket {ticket.id}: {e}")
+        ticket.done.set()
+
+    def _run(self, ticket, disease_context, user_prompt, session_id):
+        if not self.breaker.allow():
+            self._finish(ticket, 'fallback', disease_context, 'Palm AI circuit open')
+            return
+        try:
+            response = self.request_palm(disease_context, user_prompt, session_id)
+        except Exception as e:
+            self.breaker.record_failure()
+            self._finish(ticket, 'fallback', disease_context, f'Palm AI error: {e}')
+            return
+        self.breaker.record_success()
+        self._finish(ticket, 'done', response)
+
+    def submit(self, disease_context, user_prompt="", session_id="default"):
+        """Queue an enrichment and return its ticket id, or None if the queue is full"""
+        self._ensure_started()
+        ticket = Ticket()
+        with self._lock:
+            self._expire()
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                return None
+            if self.db_path:
+                self._store(ticket)
+            self._pending += 1
+            self.submitted += 1
+            self._tickets[ticket.id] = ticket
+        self._executor.submit(self._run, ticket, disease_context, user_prompt, session_id)
+        return ticket.id
+
+    def get(self, ticket_id, wait=0.0):
+        """Ticket status, optionally waiting up to `wait` seconds for it to resolve"""
+        with self._lock:
+            ticket = self._tickets.get(ticket_id)
+        if ticket is not None:
+            if wait > 0:
+                ticket.done.wait(wait)
+            return ticket.to_dict()
+        if not self.db_path:
+            return None
+        # Issued by another worker: poll the shared row
+        deadline = time.monotonic() + wait
+        while True:
+            found = self._load(ticket_id)
+            if found is None or found['status'] != 'pending' or time.monotonic() >= deadline:
+                return found
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'palm_url': self.palm_url,
+                'shared_tickets': bool(self.db_path),
+                'circuit': self.breaker.state,
+                'pending': self._pending,
+                'tickets': len(self._tickets),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'fallbacks': self.fallbacks,
+                'rejected': self.rejected,
+            }
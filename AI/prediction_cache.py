@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+# Disk-tier LRU timestamps of read hits are buffered and written together,
+# every TOUCH_FLUSH_SECONDS or TOUCH_FLUSH_ENTRIES hits, whichever comes first
+TOUCH_FLUSH_SECONDS = 30.0
+TOUCH_FLUSH_ENTRIES = 256
+
+
+def content_key(data):
+    """Hash of the raw upload bytes, used as the exact-match cache key"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def perceptual_hash(img):
+    """64-bit difference hash (dHash) as hex, stable across re-encoding and resizing"""
+    small = img.convert('L').resize((9, 8), Image.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return format(bits, '016x')
+
+
+class PredictionCache:
+    """LRU cache of model predictions keyed on upload content.
+
+    Entries live in memory, bounded by `max_entries` and `max_bytes` (the
+    size of the JSON-encoded value plus its key). An optional sqlite file
+    keeps predictions across restarts. Everything is tagged with
+    `namespace` (the model and the settings that change its output) and
+    stale disk entries written under another namespace are dropped when the
+    cache is opened.
+    """
+
+    def __init__(self, namespace, max_entries=10000, max_bytes=16 * 1024 * 1024,
+                 disk_path=None, disk_max_entries=200000, use_phash=False):
+        self.namespace = namespace
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self.disk_max_entries = max(1, int(disk_max_entries))
+        self.use_phash = use_phash
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size, phash)
+        self._phash_index = {}  # phash -> key
+        self._bytes = 0
+
+        self.hits = 0
+        self.phash_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db_path = disk_path
+        self._db = None
+        self._db_pid = None
+        self._disk_puts = 0
+        self._touches = {}  # key -> last_used not yet written to disk
+        self._touches_flushed = time.monotonic()
+        if disk_path:
+            self._connection()
+
+    # Disk tier
+
+    def _connection(self):
+        # sqlite connections must not cross fork(); each worker opens its own
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = self._open_disk(self._db_path)
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _open_disk(self, path):
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "key TEXT PRIMARY KEY, phash TEXT, value TEXT, last_used REAL)")
+        db.execute("CREATE INDEX IF NOT EXISTS predictions_phash ON predictions (phash)")
+        row = db.execute("SELECT value FROM meta WHERE key = 'namespace'").fetchone()
+        if row is None or row[0] != self.namespace:
+            # Model changed since these predictions were written
+            db.execute("DELETE FROM predictions")
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('namespace', ?)", (self.namespace,))
+        db.commit()
+        return db
+
+    def _disk_get(self, column, key):
+        db = self._connection()
+        row = db.execute(
+            f"SELECT key, value FROM predictions WHERE {column} = ? LIMIT 1", (key,)).fetchone()
+        if row is None:
+            return None, None
+        # Hits only queue their LRU touch; reads don't pay for a write each
+        self._touches[row[0]] = time.time()
+        if (len(self._touches) >= TOUCH_FLUSH_ENTRIES
+                or time.monotonic() - self._touches_flushed >= TOUCH_FLUSH_SECONDS):
+            self._flush_touches(db)
+            db.commit()
+        return row[0], json.loads(row[1])
+
+    def _flush_touches(self, db):
+        if self._touches:
+            db.executemany("UPDATE predictions SET last_used = ? WHERE key = ?",
+                           [(used, key) for key, used in self._touches.items()])
+            self._touches.clear()
+        self._touches_flushed = time.monotonic()
+
+    def _disk_put(self, key, encoded, phash):
+        db = self._connection()
+        db.execute(
+            "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+            (key, phash, encoded, time.time()))
+        self._disk_puts += 1
+        if self._disk_puts % 256 == 0:
+            # Evict by up-to-date recency
+            self._flush_touches(db)
+            (count,) = db.execute("SELECT COUNT(*) FROM predictions").fetchone()
+            excess = count - self.disk_max_entries
+            if excess > 0:
+                db.execute(
+                    "DELETE FROM predictions WHERE key IN "
+                    "(SELECT key FROM predictions ORDER BY last_used ASC LIMIT ?)", (excess,))
+        db.commit()
+
+    # Memory tier
+
+    def _remember(self, key, value, size, phash):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (value, size, phash)
+        self._bytes += size
+        if phash is not None:
+            self._phash_index[phash] = key
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            old_key, (_, old_size, old_phash) = self._entries.popitem(last=False)
+            self._bytes -= old_size
+            if old_phash is not None and self._phash_index.get(old_phash) == old_key:
+                del self._phash_index[old_phash]
+            self.evictions += 1
+
+    def get(self, key):
+        """Look up a prediction by content key, falling back to the disk tier"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if self._db_path:
+                _, value = self._disk_get('key', key)
+                if value is not None:
+                    self.disk_hits += 1
+                    encoded = json.dumps(value)
+                    self._remember(key, value, len(encoded) + len(key), None)
+                    return value
+            # With phash enabled the miss is counted by get_similar()
+            if not self.use_phash:
+                self.misses += 1
+            return None
+
+    def get_similar(self, img):
+        """Second-chance lookup by perceptual hash for re-encoded copies of a known image"""
+        if not self.use_phash:
+            return None, None
+        phash = perceptual_hash(img)
+        with self._lock:
+            key = self._phash_index.get(phash)
+            entry = self._entries.get(key) if key is not None else None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.phash_hits += 1
+                return entry[0], phash
+            if self._db_path:
+                key, value = self._disk_get('phash', phash)
+                if value is not None:
+                    self.disk_hits += 1
+                    encoded = json.dumps(value)
+                    self._remember(key, value, len(encoded) + len(key), phash)
+                    return value, phash
+            self.misses += 1
+            return None, phash
+
+    def put(self, key, value, phash=None):
+        """Store a JSON-serialisable prediction under its content key"""
+        encoded = json.dumps(value)
+        # Hand back the same shape (lists, not tuples or arrays) from memory as from disk
+        value = json.loads(encoded)
+        with self._lock:
+            self._remember(key, value, len(encoded) + len(key), phash)
+            if self._db_path:
+                self._disk_put(key, encoded, phash)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._phash_index.clear()
+            self._bytes = 0
+            if self._db_path:
+                db = self._connection()
+                self._touches.clear()
+                db.execute("DELETE FROM predictions")
+                db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.phash_hits + self.disk_hits + self.misses
+            return {
+                'namespace': self.namespace,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'phash_hits': self.phash_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': ((lookups - self.misses) / lookups) if lookups else 0.0,
+                'disk_enabled': bool(self._db_path),
+                'phash_enabled': self.use_phash,
+            }
@@ -0,0 +1,433 @@
+"""Offline BM25 retrieval over the bundled agronomy Q&A corpora in AI/Data.
+
+The index is built once into a directory of .npy arrays (postings, doc ids,
+precomputed BM25 weights, idf) plus a UTF-8 text blob, and loaded with
+memory mapping, so workers share the pages and startup is near instant.
+A query is a handful of vectorized scatter-adds over the posting lists.
+
+Each build goes to its own versioned subdirectory and the CURRENT pointer
+file is then replaced atomically, so readers never see a half-written or
+missing index while it is rebuilt.
+
+Usage:
+  python retrieval_index.py build
+  python retrieval_index.py query "how do I prevent soil erosion"
+  python retrieval_index.py bench --queries 500
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import shutil
+import socket
+import time
+from collections import Counter
+from contextlib import suppress
+
+import numpy as np
+
+from metrics import percentile
+
+AI_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(AI_DIR, 'Data')
+DEFAULT_INDEX_PATH = os.path.join(AI_DIR, 'retrieval_index')
+INDEX_VERSION = 1
+CURRENT = 'CURRENT'
+SOURCES = 'sources.json'
+BUILD_LOCK_STALE_SECONDS = 600
+INDEX_FILES = ('postings_ptr.npy', 'postings_doc.npy', 'postings_weight.npy', 'idf.npy',
+               'text_ptr.npy', 'doc_source.npy', 'texts.bin', 'meta.json')
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from how i if in into is it its me my of on or
+so such that the their them then there these they this to was what when where which who why
+will with you your should could would about any some
+""".split())
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords, with a light plural strip"""
+    tokens = []
+    for tok in _TOKEN.findall(text.lower()):
+        if tok in STOPWORDS:
+            continue
+        if len(tok) > 3 and tok.endswith('s') and not tok.endswith('ss'):
+            tok = tok[:-1]
+        tokens.append(tok)
+    return tokens
+
+
+def source_files(data_dir=DATA_DIR):
+    return [os.path.join(data_dir, name) for name in
+            ('agri_faiss_qa.csv', 'agriculture_data_5k.csv', 'dataset_plants_v5.jsonl')]
+
+
+def source_digest(data_dir=DATA_DIR):
+    """Digest of the corpus files, stored in the index to detect stale builds"""
+    h = hashlib.blake2b(digest_size=16)
+    for path in source_files(data_dir):
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def source_stats(data_dir=DATA_DIR):
+    """[name, size, mtime_ns] of each corpus file, compared before falling back to hashing"""
+    stats = []
+    for path in source_files(data_dir):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        stats.append([os.path.basename(path), st.st_size, st.st_mtime_ns])
+    return stats
+
+
+def index_dir(path=DEFAULT_INDEX_PATH):
+    """Directory with the live index files: the build CURRENT points at (or `path` for a pre-pointer index)"""
+    try:
+        with open(os.path.join(path, CURRENT), encoding='utf-8') as f:
+            return os.path.join(path, f.read().strip())
+    except FileNotFoundError:
+        return path
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def read_sources(path=DEFAULT_INDEX_PATH):
+    """Version, corpus digest and file stats recorded with the live build, or None"""
+    try:
+        with open(os.path.join(index_dir(path), SOURCES), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def load_corpus(data_dir=DATA_DIR):
+    """(question, answer, source) triples from every corpus file, de-duplicated"""
+    qa_csv, instruct_csv, plants_jsonl = source_files(data_dir)
+    rows = []
+    if os.path.exists(qa_csv):
+        with open(qa_csv, encoding='utf-8') as f:
+            rows += [(r['question'], r['answer'], 'agri_faiss_qa') for r in csv.DictReader(f)]
+    if os.path.exists(instruct_csv):
+        with open(instruct_csv, encoding='utf-8') as f:
+            rows += [(r['input'], r['response'], 'agriculture_data_5k') for r in csv.DictReader(f)]
+    if os.path.exists(plants_jsonl):
+        with open(plants_jsonl, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    r = json.loads(line)
+                    rows.append((r['instruction'], r['response'], 'dataset_plants_v5'))
+
+    seen = set()
+    corpus = []
+    for question, answer, source in rows:
+        question, answer = question.strip(), answer.strip()
+        key = (' '.join(question.lower().split()), ' '.join(answer.lower().split()))
+        if not question or not answer or key in seen:
+            continue
+        seen.add(key)
+        corpus.append((question, answer, source))
+    return corpus
+
+
+def build_index(output=DEFAULT_INDEX_PATH, data_dir=DATA_DIR, k1=1.2, b=0.75, question_boost=2):
+    """Build the BM25 index into a new version directory and point CURRENT at it"""
+    corpus = load_corpus(data_dir)
+    if not corpus:
+        raise FileNotFoundError(f"No corpus files found in {data_dir}")
+
+    vocab = {}
+    doc_terms = []
+    lengths = np.empty(len(corpus), dtype=np.float32)
+    for i, (question, answer, _) in enumerate(corpus):
+        # Question words count extra: they say what the passage is about
+        counts = Counter(tokenize(question) * question_boost + tokenize(answer))
+        lengths[i] = sum(counts.values())
+        doc_terms.append({vocab.setdefault(t, len(vocab)): tf for t, tf in counts.items()})
+
+    n_docs = len(corpus)
+    avgdl = float(lengths.mean())
+    postings = [[] for _ in range(len(vocab))]
+    for doc, terms in enumerate(doc_terms):
+        for term, tf in terms.items():
+            postings[term].append((doc, tf))
+
+    df = np.array([len(p) for p in postings], dtype=np.float32)
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+    ptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(df.astype(np.int64), out=ptr[1:])
+    docs = np.empty(ptr[-1], dtype=np.int32)
+    weights = np.empty(ptr[-1], dtype=np.float32)
+    for term, plist in enumerate(postings):
+        start = ptr[term]
+        ids = np.fromiter((d for d, _ in plist), dtype=np.int32, count=len(plist))
+        tf = np.fromiter((t for _, t in plist), dtype=np.float32, count=len(plist))
+        docs[start:start + len(plist)] = ids
+        norm = k1 * (1 - b + b * lengths[ids] / avgdl)
+        weights[start:start + len(plist)] = idf[term] * tf * (k1 + 1) / (tf + norm)
+
+    # Texts: question and answer of doc i are blob[text_ptr[2i]:text_ptr[2i+1]]
+    # and blob[text_ptr[2i+1]:text_ptr[2i+2]]
+    pieces = []
+    for question, answer, _ in corpus:
+        pieces += [question.encode('utf-8'), answer.encode('utf-8')]
+    text_ptr = np.zeros(len(pieces) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in pieces], out=text_ptr[1:])
+
+    sources = sorted({s for _, _, s in corpus})
+    doc_source = np.array([sources.index(s) for _, _, s in corpus], dtype=np.int8)
+
+    digest = source_digest(data_dir)
+    # Unique per build, so concurrent builds (e.g. several workers) never share a directory
+    version = f"v{time.strftime('%Y%m%d%H%M%S')}-{socket.gethostname()}-{os.getpid()}"
+    tmp = os.path.join(output, version)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, 'postings_ptr.npy'), ptr)
+    np.save(os.path.join(tmp, 'postings_doc.npy'), docs)
+    np.save(os.path.join(tmp, 'postings_weight.npy'), weights)
+    np.save(os.path.join(tmp, 'idf.npy'), idf)
+    np.save(os.path.join(tmp, 'text_ptr.npy'), text_ptr)
+    np.save(os.path.join(tmp, 'doc_source.npy'), doc_source)
+    with open(os.path.join(tmp, 'texts.bin'), 'wb') as f:
+        for piece in pieces:
+            f.write(piece)
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': INDEX_VERSION,
+            'docs': n_docs,
+            'avgdl': avgdl,
+            'k1': k1,
+            'b': b,
+            'question_boost': question_boost,
+            'sources': sources,
+            'source_digest': digest,
+            'vocab': vocab,
+        }, f)
+    _write_json(os.path.join(tmp, SOURCES), {
+        'version': INDEX_VERSION, 'digest': digest, 'files': source_stats(data_dir)})
+
+    previous = index_dir(output)
+    pointer = os.path.join(output, f"{CURRENT}.{version}.tmp")
+    with open(pointer, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(output, CURRENT))
+
+    # Keep the build just replaced (running workers may still map it); drop older
+    # finished ones and the files of a pre-pointer index
+    keep = {version, os.path.basename(previous)}
+    for name in os.listdir(output):
+        entry = os.path.join(output, name)
+        if name not in keep and os.path.isfile(os.path.join(entry, SOURCES)):
+            shutil.rmtree(entry, ignore_errors=True)
+        elif name in INDEX_FILES:
+            with suppress(OSError):
+                os.remove(entry)
+    return output
+
+
+class RetrievalIndex:
+    """Memory-mapped BM25 index; see build_index for the on-disk layout"""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self.version_path = index_dir(path)
+        path = self.version_path
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"Retrieval index at {path} has an old format; rebuild it")
+        self.vocab = self.meta.pop('vocab')
+        self.n_docs = self.meta['docs']
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode='r')
+
+        self.ptr = load('postings_ptr.npy')
+        self.docs = load('postings_doc.npy')
+        self.weights = load('postings_weight.npy')
+        self.idf = load('idf.npy')
+        self.text_ptr = load('text_ptr.npy')
+        self.doc_source = load('doc_source.npy')
+        self.texts = np.memmap(os.path.join(path, 'texts.bin'), dtype=np.uint8, mode='r')
+        self.max_idf = float(self.idf.max()) if len(self.idf) else 1.0
+
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def _text(self, i):
+        return bytes(self.texts[self.text_ptr[i]:self.text_ptr[i + 1]]).decode('utf-8')
+
+    def document(self, doc):
+        return self._text(2 * doc), self._text(2 * doc + 1)
+
+    def _term_idf(self, term):
+        tid = self.vocab.get(term)
+        return float(self.idf[tid]) if tid is not None else self.max_idf
+
+    def similarity(self, query_terms, question):
+        """idf-weighted overlap between the query and a stored question, 0..1"""
+        q, d = set(query_terms), set(tokenize(question))
+        union = sum(self._term_idf(t) for t in q | d)
+        return sum(self._term_idf(t) for t in q & d) / union if union else 0.0
+
+    def search(self, query, k=3):
+        """Top-k passages as dicts with question, answer, source, score and similarity"""
+        t0 = time.perf_counter()
+        terms = tokenize(query)
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for tid in {self.vocab[t] for t in terms if t in self.vocab}:
+            start, end = self.ptr[tid], self.ptr[tid + 1]
+            # Each doc appears once per posting list, so fancy-index += is safe
+            scores[self.docs[start:end]] += self.weights[start:end]
+
+        k = min(k, self.n_docs)
+        top = np.argpartition(-scores, k - 1)[:k] if k else []
+        results = []
+        for doc in sorted(top, key=lambda d: -scores[d]):
+            if scores[doc] <= 0:
+                continue
+            question, answer = self.document(int(doc))
+            results.append({
+                'question': question,
+                'answer': answer,
+                'source': self.meta['sources'][int(self.doc_source[doc])],
+                'score': float(scores[doc]),
+                'similarity': self.similarity(terms, question),
+            })
+        self.queries += 1
+        self.query_seconds += time.perf_counter() - t0
+        return results
+
+    def stats(self):
+        return {
+            'path': self.version_path,
+            'docs': self.n_docs,
+            'terms': len(self.vocab),
+            'queries': self.queries,
+            'mean_query_ms': (self.query_seconds * 1000.0 / self.queries) if self.queries else 0.0,
+        }
+
+
+def index_status(path=DEFAULT_INDEX_PATH, data_dir=DATA_DIR):
+    """'missing', 'fresh', or 'changed' if the corpus files' sizes/mtimes moved since the build.
+
+    Only stats files, so it is cheap enough for startup; refresh_index()
+    decides whether a 'changed' corpus really needs a rebuild.
+    """
+    if not os.path.exists(os.path.join(index_dir(path), 'meta.json')):
+        return 'missing'
+    if not os.path.isdir(data_dir):
+        return 'fresh'
+    sources = read_sources(path)
+    if (sources is None or sources.get('version') != INDEX_VERSION
+            or sources.get('files') != source_stats(data_dir)):
+        return 'changed'
+    return 'fresh'
+
+
+def refresh_index(path=DEFAULT_INDEX_PATH, data_dir=DATA_DIR):
+    """Rebuild the index if the corpus content changed since the live build; True if rebuilt.
+
+    A lock file makes processes starting together leave the build to the first one.
+    """
+    sources = read_sources(path)
+    if sources is not None and sources.get('version') == INDEX_VERSION:
+        if sources.get('digest') == source_digest(data_dir):
+            # Touched but identical files: record the new stats so the next start skips hashing
+            sources['files'] = source_stats(data_dir)
+            _write_json(os.path.join(index_dir(path), SOURCES), sources)
+            return False
+    os.makedirs(path, exist_ok=True)
+    lock = os.path.join(path, 'build.lock')
+    with suppress(FileNotFoundError):
+        if time.time() - os.path.getmtime(lock) > BUILD_LOCK_STALE_SECONDS:
+            os.remove(lock)
+    try:
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        print(f"Retrieval index at {path} is being built by another process")
+        return False
+    try:
+        print(f"Building retrieval index at {path}...")
+        build_index(path, data_dir)
+    finally:
+        os.remove(lock)
+    return True
+
+
+def load_index(path=DEFAULT_INDEX_PATH, data_dir=DATA_DIR):
+    """Open the index, building it first if it is missing or older than the corpus files.
+
+    Blocks on the build, so it is meant for the CLI; the API opens the
+    existing index and refreshes it in the background instead.
+    """
+    if index_status(path, data_dir) != 'fresh':
+        refresh_index(path, data_dir)
+    return RetrievalIndex(path)
+
+
+def benchmark(index, n_queries=500, k=3, seed=0):
+    """Query latency on corpus questions with a word dropped, and how often the source comes back first"""
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(index.n_docs, size=min(n_queries, index.n_docs), replace=False)
+    latencies = []
+    found = 0
+    for doc in picks:
+        question, _ = index.document(int(doc))
+        words = question.split()
+        if len(words) > 4:
+            del words[int(rng.integers(len(words)))]
+        t0 = time.perf_counter()
+        results = index.search(' '.join(words), k=k)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+        found += bool(results) and results[0]['question'] == question
+    return {
+        'queries': len(picks),
+        'top1_recall': found / len(picks) if len(picks) else 0.0,
+        'latency_ms': {'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+                       'p99': percentile(latencies, 99), 'max': max(latencies) if latencies else 0.0},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index', default=os.environ.get('RETRIEVAL_INDEX_PATH', DEFAULT_INDEX_PATH))
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_cmd = sub.add_parser('build', help='(Re)build the index from AI/Data')
+    build_cmd.add_argument('--data-dir', default=DATA_DIR)
+    query_cmd = sub.add_parser('query', help='Print the top passages for a question')
+    query_cmd.add_argument('text')
+    query_cmd.add_argument('-k', type=int, default=3)
+    bench_cmd = sub.add_parser('bench', help='Query latency benchmark')
+    bench_cmd.add_argument('--queries', type=int, default=500)
+    bench_cmd.add_argument('-k', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        t0 = time.perf_counter()
+        build_index(args.index, args.data_dir)
+        index = RetrievalIndex(args.index)
+        print(f"Built {index.n_docs} passages, {len(index.vocab)} terms in "
+              f"{time.perf_counter() - t0:.2f}s -> {args.index}")
+        return
+
+    index = load_index(args.index)
+    if args.command == 'query':
+        print(json.dumps(index.search(args.text, k=args.k), indent=2, ensure_ascii=False))
+    else:
+        print(json.dumps(benchmark(index, args.queries, args.k), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Production entry point for the disease detection API.
+
+The model is loaded once in the gunicorn master and the master then forks
+the workers, so the weights are shared copy-on-write instead of being
+loaded once per worker. Each worker pins its torch thread count (so N
+workers do not oversubscribe the cores) and runs a warm-up inference
+before /ready reports it.
+
+The master must not start torch (OpenMP) or onnxruntime thread pools, since
+they do not survive fork() and can hang the workers. It loads with a single
+torch thread, and only when building the default model's backend runs no
+forward pass: eager, quantized or compile without the cascade. TorchScript
+traces, ONNX sessions and the cascade's resolution probe are built in each
+worker instead, as with LAZY_STARTUP=1.
+
+With LAZY_STARTUP=1 the master only imports the (then cheap) app and each
+worker loads the model in its warm-up instead. Loaded from a snapshot (see
+model_snapshot.py) the weights are memory-mapped, so the workers still share
+one copy of them through the page cache, and the master forks right away.
+
+Warm-up runs in a background thread of each worker, so a model load slower
+than --timeout does not get the worker killed before its heartbeat starts.
+
+Usage (Linux):
+  python serve.py --workers 4 --bind 0.0.0.0:5006
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import threading
+
+from gunicorn.app.base import BaseApplication
+
+from model_registry import load_specs
+
+AI_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ENRICHMENT_DB_PATH = os.path.join(AI_DIR, 'enrichment_tickets.sqlite')
+
+# Backends whose construction runs no forward pass, so they can be built before fork()
+PRELOAD_BACKENDS = ('eager', 'quantized', 'compile')
+
+
+class DiseaseDetectionServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key.lower(), value)
+
+    def load(self):
+        import detect_disease_api
+        return detect_disease_api.app
+
+
+def fork_safe_preload():
+    """Whether the default model can be loaded in the master without starting thread pools"""
+    if os.environ.get("CASCADE", "0") == "1":
+        # load_cascade() probes the model at the cascade resolution
+        return False
+    specs, default = load_specs(os.environ.get("MODEL_REGISTRY"), 'default', 'default')
+    spec = next(spec for spec in specs if spec.name == default)
+    return (spec.backend or os.environ.get("INFERENCE_BACKEND", "eager")) in PRELOAD_BACKENDS
+
+
+def main():
+    cpu_count = multiprocessing.cpu_count()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bind', default=os.environ.get('BIND', '0.0.0.0:5006'))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WORKERS', '2')))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('WORKER_THREADS', '8')),
+                        help='HTTP threads per worker; concurrent requests in a worker are micro-batched')
+    parser.add_argument('--torch-threads', type=int, default=int(os.environ.get('TORCH_NUM_THREADS', '0')),
+                        help='torch intra-op threads per worker (default: cores / workers)')
+    parser.add_argument('--timeout', type=int, default=120)
+    args = parser.parse_args()
+
+    torch_threads = args.torch_threads or max(1, cpu_count // args.workers)
+
+    if os.environ.get("LAZY_STARTUP", "0") != "1" and not fork_safe_preload():
+        print("The default model's backend or cascade runs the model while loading; "
+              "loading it in each worker instead of the master")
+        os.environ["LAZY_STARTUP"] = "1"
+    if args.workers > 1:
+        # Enrichment tickets are polled from whichever worker answers
+        os.environ.setdefault("ENRICHMENT_DB_PATH", DEFAULT_ENRICHMENT_DB_PATH)
+    # A single thread runs torch ops inline, so no OpenMP pool exists at fork()
+    os.environ["TORCH_NUM_THREADS"] = "1"
+
+    # Import (and, unless LAZY_STARTUP, load the model) in the master so workers inherit it
+    import detect_disease_api
+
+    lazy = detect_disease_api.LAZY_STARTUP
+    if not lazy and detect_disease_api.models.peek(detect_disease_api.default_model) is None:
+        raise SystemExit("API could not start because the model failed to load.")
+
+    # One slot per live worker pid, with headroom for workers being replaced
+    detect_disease_api.expected_workers = args.workers
+    detect_disease_api.warm_worker_pids = multiprocessing.Array('i', args.workers * 2)
+
+    def post_fork(server, worker):
+        from inference_backends import configure_threads
+
+        # Before warm_up() so a lazily loaded model is built with these threads
+        detect_disease_api.TORCH_NUM_THREADS = torch_threads
+        configure_threads(torch_threads)
+
+    def post_worker_init(worker):
+        # The heartbeat only starts once this hook returns; requests arriving
+        # meanwhile wait on the model load, and /ready reports 503 until done
+        def warm():
+            if detect_disease_api.warm_up():
+                worker.log.info(f"Worker {worker.pid} warm (torch threads: {torch_threads})")
+            else:
+                worker.log.error(f"Worker {worker.pid} could not load the model; /ready stays 503")
+
+        threading.Thread(target=warm, name='warm-up', daemon=True).start()
+
+    def child_exit(server, worker):
+        pids = detect_disease_api.warm_worker_pids
+        with pids.get_lock():
+            for i, pid in enumerate(pids):
+                if pid == worker.pid:
+                    pids[i] = 0
+
+    # Keep the loaded objects out of the cyclic GC so collections in the
+    # workers don't touch (and un-share) their pages
+    gc.collect()
+    gc.freeze()
+
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'worker_class': 'gthread',
+        'threads': args.threads,
+        'timeout': args.timeout,
+        'preload_app': True,
+        'post_fork': post_fork,
+        'post_worker_init': post_worker_init,
+        'child_exit': child_exit,
+    }
+    print(f"Starting {args.workers} workers x {torch_threads} torch threads on {args.bind}"
+          + (" (lazy startup)" if lazy else ""))
+    DiseaseDetectionServer(options).run()
+
+
+if __name__ == '__main__':
+    main()
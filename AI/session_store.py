@@ -0,0 +1,349 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Rough per-object overhead used for the memory budget, on top of the text
+MESSAGE_OVERHEAD = 120
+SESSION_OVERHEAD = 200
+
+
+class Message:
+    # `seq` is the row id in SqliteSessionStore; in-memory messages have none
+    __slots__ = ('user', 'assistant', 'timestamp', 'disease_context', 'seq')
+
+    def __init__(self, user, assistant, timestamp, disease_context=None, seq=None):
+        self.user = user
+        self.assistant = assistant
+        self.timestamp = timestamp
+        self.disease_context = disease_context
+        self.seq = seq
+
+    @property
+    def size(self):
+        return (MESSAGE_OVERHEAD + len(self.user) + len(self.assistant)
+                + len(self.disease_context or ''))
+
+
+class Session:
+    # `context` holds the caller's cached rendered prompt history, if any, and
+    # `context_state` its saved form as loaded from a persistent store
+    __slots__ = ('id', 'messages', 'created_at', 'last_activity', 'size', 'context',
+                 'context_state', 'context_size')
+
+    def __init__(self, session_id, created_at=None, last_activity=None, messages=None,
+                 context_state=None):
+        now = time.time()
+        self.id = session_id
+        self.messages = messages or []
+        self.created_at = created_at or now
+        self.last_activity = last_activity or now
+        self.size = SESSION_OVERHEAD + len(session_id) + sum(m.size for m in self.messages)
+        self.context = None
+        self.context_state = context_state
+        self.context_size = 0
+
+
+class MemorySessionStore:
+    """In-process conversation sessions with idle expiry and LRU eviction.
+
+    Sessions idle for longer than `idle_ttl` seconds are dropped, the least
+    recently used sessions are evicted once `max_sessions` or `max_bytes` is
+    exceeded, and each session keeps at most `max_messages` messages.
+    """
+
+    name = 'memory'
+
+    def __init__(self, idle_ttl=3600.0, max_sessions=10000, max_bytes=64 * 1024 * 1024,
+                 max_messages=50):
+        self.idle_ttl = float(idle_ttl)
+        self.max_sessions = max(1, int(max_sessions))
+        self.max_bytes = max(1, int(max_bytes))
+        self.max_messages = max(1, int(max_messages))
+
+        self._lock = threading.RLock()
+        self._sessions = OrderedDict()  # least recently used first
+        self._bytes = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _drop(self, session_id):
+        session = self._sessions.pop(session_id)
+        self._bytes -= session.size
+
+    def _enforce_limits(self, now):
+        cutoff = now - self.idle_ttl
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.last_activity >= cutoff:
+                break
+            self._drop(oldest.id)
+            self.expired += 1
+        while len(self._sessions) > self.max_sessions or (
+                self._bytes > self.max_bytes and len(self._sessions) > 1):
+            self._drop(next(iter(self._sessions)))
+            self.evicted += 1
+
+    def get(self, session_id):
+        """Existing session (touched as most recently used) or None"""
+        with self._lock:
+            now = time.time()
+            self._enforce_limits(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_activity = now
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def get_or_create(self, session_id):
+        """Get existing session or create new one"""
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                session = Session(session_id)
+                self._sessions[session_id] = session
+                self._bytes += session.size
+                self._enforce_limits(session.last_activity)
+            return session
+
+    def append(self, session, user, assistant, disease_context=None):
+        """Record one exchange, trimming the session to max_messages"""
+        message = Message(user, assistant, time.time(), disease_context or None)
+        with self._lock:
+            session.messages.append(message)
+            session.size += message.size
+            tracked = self._sessions.get(session.id) is session
+            if tracked:
+                self._bytes += message.size
+            while len(session.messages) > self.max_messages:
+                dropped = session.messages.pop(0)
+                session.size -= dropped.size
+                if tracked:
+                    self._bytes -= dropped.size
+            session.last_activity = message.timestamp
+            if tracked:
+                self._sessions.move_to_end(session.id)
+                self._enforce_limits(message.timestamp)
+        return message
+
+    def clear(self, session_id):
+        """Forget a session's messages; False if the session does not exist"""
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                return False
+            freed = sum(m.size for m in session.messages) + session.context_size
+            session.messages = []
+            session.context = None
+            session.context_size = 0
+            session.size -= freed
+            self._bytes -= freed
+            return True
+
+    def save_context(self, session):
+        """Count the session's cached context towards its size and max_bytes"""
+        with self._lock:
+            size = session.context.size if session.context is not None else 0
+            delta = size - session.context_size
+            if not delta:
+                return
+            session.context_size = size
+            session.size += delta
+            if self._sessions.get(session.id) is session:
+                self._bytes += delta
+                self._enforce_limits(time.time())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.name,
+                'sessions': len(self._sessions),
+                'bytes': self._bytes,
+                'max_sessions': self.max_sessions,
+                'max_bytes': self.max_bytes,
+                'max_messages': self.max_messages,
+                'idle_ttl_seconds': self.idle_ttl,
+                'expired': self.expired,
+                'evicted': self.evicted,
+            }
+
+
+class SqliteSessionStore:
+    """Sessions persisted in a local sqlite file, shared by every worker process.
+
+    Same limits as MemorySessionStore except max_bytes: the data lives on
+    disk, so only the session count and per-session message cap apply.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path, idle_ttl=3600.0, max_sessions=100000, max_messages=50):
+        self.path = path
+        self.idle_ttl = float(idle_ttl)
+        self.max_sessions = max(1, int(max_sessions))
+        self.max_messages = max(1, int(max_messages))
+        self._lock = threading.RLock()
+        self._db = None
+        self._db_pid = None
+        self._writes = 0
+        self.expired = 0
+        self.evicted = 0
+        self._connection()
+
+    def _connection(self):
+        # sqlite connections must not cross fork(); each worker opens its own
+        if self._db is None or self._db_pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA foreign_keys=ON")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, created_at REAL, last_activity REAL)")
+            columns = {row[1] for row in db.execute("PRAGMA table_info(sessions)")}
+            if 'context' not in columns:
+                # Saved ConversationContext state, so history isn't re-rendered from scratch per request
+                db.execute("ALTER TABLE sessions ADD COLUMN context TEXT")
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_activity ON sessions (last_activity)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "session_id TEXT REFERENCES sessions(id) ON DELETE CASCADE, "
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "user TEXT, assistant TEXT, timestamp REAL, disease_context TEXT)")
+            db.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, seq)")
+            db.commit()
+            self._db = db
+            self._db_pid = os.getpid()
+        return self._db
+
+    def __len__(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def _enforce_limits(self, db, now):
+        # Expiry and LRU trimming are batched rather than run on every write
+        self._writes += 1
+        if self._writes % 100 != 1:
+            return
+        cur = db.execute("DELETE FROM sessions WHERE last_activity < ?", (now - self.idle_ttl,))
+        self.expired += cur.rowcount
+        (count,) = db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+        if count > self.max_sessions:
+            cur = db.execute(
+                "DELETE FROM sessions WHERE id IN "
+                "(SELECT id FROM sessions ORDER BY last_activity ASC LIMIT ?)",
+                (count - self.max_sessions,))
+            self.evicted += cur.rowcount
+
+    def get(self, session_id):
+        with self._lock:
+            db = self._connection()
+            now = time.time()
+            row = db.execute(
+                "SELECT created_at, last_activity, context FROM sessions WHERE id = ?",
+                (session_id,)).fetchone()
+            if row is None or row[1] < now - self.idle_ttl:
+                return None
+            db.execute("UPDATE sessions SET last_activity = ? WHERE id = ?", (now, session_id))
+            db.commit()
+            rows = db.execute(
+                "SELECT user, assistant, timestamp, disease_context, seq FROM messages "
+                "WHERE session_id = ? ORDER BY seq", (session_id,)).fetchall()
+            return Session(session_id, row[0], now, [Message(*r) for r in rows],
+                           json.loads(row[2]) if row[2] else None)
+
+    def get_or_create(self, session_id):
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                db = self._connection()
+                session = Session(session_id)
+                db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                db.execute("INSERT INTO sessions (id, created_at, last_activity) VALUES (?, ?, ?)",
+                           (session_id, session.created_at, session.last_activity))
+                self._enforce_limits(db, session.last_activity)
+                db.commit()
+            return session
+
+    def append(self, session, user, assistant, disease_context=None):
+        message = Message(user, assistant, time.time(), disease_context or None)
+        with self._lock:
+            db = self._connection()
+            cur = db.execute("INSERT INTO messages (session_id, user, assistant, timestamp, disease_context) "
+                             "VALUES (?, ?, ?, ?, ?)",
+                             (session.id, user, assistant, message.timestamp, message.disease_context))
+            message.seq = cur.lastrowid
+            db.execute(
+                "DELETE FROM messages WHERE session_id = ? AND seq NOT IN "
+                "(SELECT seq FROM messages WHERE session_id = ? ORDER BY seq DESC LIMIT ?)",
+                (session.id, session.id, self.max_messages))
+            db.execute("UPDATE sessions SET last_activity = ? WHERE id = ?", (message.timestamp, session.id))
+            self._enforce_limits(db, message.timestamp)
+            db.commit()
+
+            session.messages.append(message)
+            session.size += message.size
+            while len(session.messages) > self.max_messages:
+                session.size -= session.messages.pop(0).size
+            session.last_activity = message.timestamp
+        return message
+
+    def clear(self, session_id):
+        with self._lock:
+            if self.get(session_id) is None:
+                return False
+            db = self._connection()
+            db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            db.execute("UPDATE sessions SET context = NULL WHERE id = ?", (session_id,))
+            db.commit()
+            return True
+
+    def save_context(self, session):
+        """Persist the session's rendered context if it moved past what was loaded"""
+        if session.context is None:
+            return
+        state = session.context.state()
+        if state == session.context_state:
+            return
+        with self._lock:
+            db = self._connection()
+            db.execute("UPDATE sessions SET context = ? WHERE id = ?", (json.dumps(state), session.id))
+            db.commit()
+        session.context_state = state
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'path': self.path,
+            'sessions': len(self),
+            'max_sessions': self.max_sessions,
+            'max_messages': self.max_messages,
+            'idle_ttl_seconds': self.idle_ttl,
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
+
+
+def load_session_store():
+    """Build the store selected by SESSION_STORE (memory or sqlite)"""
+    backend = os.environ.get("SESSION_STORE", "memory")
+    idle_ttl = float(os.environ.get("SESSION_IDLE_TTL", "3600"))
+    max_messages = int(os.environ.get("SESSION_MAX_MESSAGES", "50"))
+    if backend == 'sqlite':
+        return SqliteSessionStore(
+            os.environ.get("SESSION_DB_PATH", "sessions.sqlite"),
+            idle_ttl=idle_ttl,
+            max_sessions=int(os.environ.get("SESSION_MAX_SESSIONS", "100000")),
+            max_messages=max_messages)
+    if backend == 'memory':
+        return MemorySessionStore(
+            idle_ttl=idle_ttl,
+            max_sessions=int(os.environ.get("SESSION_MAX_SESSIONS", "10000")),
+            max_bytes=int(os.environ.get("SESSION_MAX_BYTES", str(64 * 1024 * 1024))),
+            max_messages=max_messages)
+    raise ValueError(f"Unknown SESSION_STORE '{backend}'. Choose memory or sqlite.")
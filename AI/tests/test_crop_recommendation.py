@@ -0,0 +1,53 @@
+import pytest
+
+from crop_recommendation import FEATURES, columns_from_csv, parse_samples
+
+SAMPLE = {'N': 90, 'P': 42, 'K': 43, 'temperature': 20.9, 'humidity': 82.0, 'ph': 6.5, 'rainfall': 202.9}
+
+
+def test_single_sample():
+    X = parse_samples(SAMPLE)
+    assert X.shape == (1, len(FEATURES))
+    assert X[0, 0] == 90
+
+
+def test_samples_as_dicts_and_lists():
+    X = parse_samples({'samples': [SAMPLE, [SAMPLE[name] for name in FEATURES]]})
+    assert X.shape == (2, len(FEATURES))
+    assert (X[0] == X[1]).all()
+
+
+def test_columns():
+    columns = {name: [SAMPLE[name], SAMPLE[name] + 1] for name in FEATURES}
+    X = parse_samples({'columns': columns})
+    assert X.shape == (2, len(FEATURES))
+    assert X[1, 0] == 91
+
+
+@pytest.mark.parametrize('payload, message', [
+    ({'samples': []}, 'non-empty'),
+    ({'samples': [{'N': 1}]}, 'Missing field'),
+    ({'samples': [['a'] * len(FEATURES)]}, 'numeric'),
+    ({'samples': [[1, 2, 3]]}, 'values'),
+    ({'samples': [[float('nan')] * len(FEATURES)]}, 'non-finite'),
+    ({'columns': [1, 2]}, 'object'),
+    ({'columns': {'N': [1]}}, 'Missing columns'),
+    ({'columns': {name: [1, 2] if name != 'K' else [1] for name in FEATURES}}, 'equal length'),
+])
+def test_bad_input(payload, message):
+    with pytest.raises(ValueError, match=message):
+        parse_samples(payload)
+
+
+def test_columns_from_csv_ignores_extra_columns():
+    text = ','.join(FEATURES) + ',label\n' + ','.join(str(SAMPLE[name]) for name in FEATURES) + ',rice\n'
+    columns = columns_from_csv(text)
+    assert set(columns) == set(FEATURES)
+    assert parse_samples({'columns': columns}).shape == (1, len(FEATURES))
+
+
+def test_columns_from_csv_errors():
+    with pytest.raises(ValueError, match='no rows'):
+        columns_from_csv(','.join(FEATURES) + '\n')
+    with pytest.raises(ValueError, match='numeric'):
+        columns_from_csv(','.join(FEATURES) + '\n' + ','.join('x' * len(FEATURES)) + '\n')
@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from generation_cache import GenerationCache, generation_key
+
+
+def test_key_normalizes_whitespace_and_case():
+    assert generation_key('  How do I treat  Rust? ') == generation_key('how do i treat rust?')
+    assert generation_key('rust', 'wheat') != generation_key('rust', 'corn')
+
+
+def wait_for_waiters(cache, count):
+    deadline = time.monotonic() + 5
+    while cache.stats()['coalesced'] < count:
+        assert time.monotonic() < deadline, 'waiters never joined the flight'
+        time.sleep(0.001)
+
+
+def test_concurrent_requests_share_one_generation():
+    cache = GenerationCache(wait_timeout=5)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'answer'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_generate('k', generate)))
+    leader.start()
+    assert started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(cache.get_or_generate('k', generate)))
+                 for _ in range(3)]
+    for t in followers:
+        t.start()
+    wait_for_waiters(cache, 3)
+    release.set()
+    for t in [leader] + followers:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert sorted(source for _, source in results) == ['coalesced'] * 3 + ['upstream']
+    assert {text for text, _ in results} == {'answer'}
+    assert cache.get_or_generate('k', generate) == ('answer', 'cache')
+
+
+def test_errors_reach_waiters_and_are_not_cached():
+    cache = GenerationCache(wait_timeout=5)
+    started, release = threading.Event(), threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('upstream down')
+
+    errors = []
+
+    def request():
+        try:
+            cache.get_or_generate('k', failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=request)
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=request)
+    follower.start()
+    wait_for_waiters(cache, 1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert errors == ['upstream down'] * 2
+    assert cache.stats()['upstream_errors'] == 1
+    assert cache.get_or_generate('k', lambda: 'retry') == ('retry', 'upstream')
+
+
+def test_waiter_times_out():
+    cache = GenerationCache(wait_timeout=0.05)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'late'
+
+    leader = threading.Thread(target=cache.get_or_generate, args=('k', slow))
+    leader.start()
+    assert started.wait(5)
+    with pytest.raises(TimeoutError):
+        cache.get_or_generate('k', slow)
+    release.set()
+    leader.join(5)
+
+
+def test_lru_eviction():
+    cache = GenerationCache(max_entries=2)
+    cache.put('a', 'A')
+    cache.put('b', 'B')
+    assert cache.get('a') == 'A'
+    cache.put('c', 'C')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert cache.stats()['evictions'] == 1
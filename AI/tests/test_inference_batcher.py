@@ -0,0 +1,96 @@
+import os
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import pytest
+
+from inference_batcher import MicroBatcher
+
+
+def test_items_are_batched_and_answered_in_order():
+    sizes = []
+
+    def run_batch(items):
+        sizes.append(len(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=50)
+    futures = [batcher.submit(i) for i in range(10)]
+    assert [f.result(5) for f in futures] == [i * 2 for i in range(10)]
+    assert sum(sizes) == 10 and max(sizes) <= 4
+    stats = batcher.stats()
+    assert stats['items_processed'] == 10
+    assert stats['batch_errors'] == 0
+    batcher.close()
+
+
+def test_run_batch_error_fails_the_whole_batch():
+    def run_batch(items):
+        raise RuntimeError('model failed')
+
+    batcher = MicroBatcher(run_batch)
+    with pytest.raises(RuntimeError, match='model failed'):
+        batcher.predict(1, timeout=5)
+    assert batcher.stats()['batch_errors'] == 1
+    batcher.close()
+
+
+def test_short_results_fail_instead_of_hanging():
+    release = threading.Event()
+
+    def run_batch(items):
+        release.wait(5)
+        return [0] * (len(items) - 1)
+
+    batcher = MicroBatcher(run_batch, max_batch_size=2, max_wait_ms=1000)
+    futures = [batcher.submit(1), batcher.submit(2)]
+    release.set()
+    for future in futures:
+        with pytest.raises(RuntimeError, match='returned 1 results for 2 items'):
+            future.result(5)
+    assert batcher.stats()['batch_errors'] == 1
+    batcher.close()
+
+
+def test_set_result_failure_keeps_the_worker_alive():
+    release = threading.Event()
+
+    def run_batch(items):
+        release.wait(5)
+        return list(items)
+
+    batcher = MicroBatcher(run_batch, max_batch_size=2, max_wait_ms=1000)
+    cancelled, kept = batcher.submit('a'), batcher.submit('b')
+    assert cancelled.cancel()
+    release.set()
+    assert kept.result(5) == 'b'
+    assert batcher.predict('c', timeout=5) == 'c'
+    batcher.close()
+
+
+def test_predict_times_out():
+    release = threading.Event()
+    batcher = MicroBatcher(lambda items: release.wait(5) and list(items), timeout=0.05)
+    with pytest.raises(FutureTimeout):
+        batcher.predict(1)
+    release.set()
+    batcher.close()
+
+
+def test_queue_inherited_across_fork_is_failed():
+    batcher = MicroBatcher(lambda items: list(items))
+    inherited = Future()
+    batcher._queue.put((1, inherited))
+    # As after fork(): a worker that belongs to another process
+    batcher._worker = threading.current_thread()
+    batcher._worker_pid = os.getpid() + 1
+    assert batcher.predict(2, timeout=5) == 2
+    with pytest.raises(RuntimeError, match='forked'):
+        inherited.result(0)
+    batcher.close()
+
+
+def test_submit_after_close_runs_unbatched():
+    batcher = MicroBatcher(lambda items: [item + 1 for item in items])
+    batcher.close()
+    assert batcher.submit(1).result(5) == 2
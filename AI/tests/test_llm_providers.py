@@ -0,0 +1,48 @@
+from llm_providers import limit_stream
+
+
+class Upstream:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.pulled = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pulled == len(self.chunks):
+            raise StopIteration
+        self.pulled += 1
+        return self.chunks[self.pulled - 1]
+
+    def close(self):
+        self.closed = True
+
+
+def test_stops_after_max_sentences():
+    upstream = Upstream(['One. Two', '. Three.', ' Four.'])
+    assert ''.join(limit_stream(upstream, max_sentences=2)) == 'One. Two.'
+    assert upstream.pulled == 2
+    assert upstream.closed
+
+
+def test_truncates_at_max_chars():
+    upstream = Upstream(['abcd', 'efgh', 'ijkl'])
+    assert ''.join(limit_stream(upstream, max_chars=6)) == 'abcdef...'
+    assert upstream.pulled == 2
+    assert upstream.closed
+
+
+def test_no_limits_passes_everything_through():
+    upstream = Upstream(['a. ', 'b. ', 'c.'])
+    assert list(limit_stream(upstream)) == ['a. ', 'b. ', 'c.']
+    assert upstream.closed
+
+
+def test_closing_early_closes_upstream():
+    upstream = Upstream(['a', 'b', 'c'])
+    stream = limit_stream(upstream)
+    next(stream)
+    stream.close()
+    assert upstream.closed
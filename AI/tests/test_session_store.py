@@ -0,0 +1,57 @@
+import time
+
+from conversation_context import ConversationContext
+from session_store import MemorySessionStore
+
+
+def test_max_messages_trims_oldest():
+    store = MemorySessionStore(max_messages=3)
+    session = store.get_or_create('s')
+    for i in range(5):
+        store.append(session, f'q{i}', f'a{i}')
+    assert [m.user for m in session.messages] == ['q2', 'q3', 'q4']
+    assert store.stats()['bytes'] == session.size
+
+
+def test_max_sessions_evicts_least_recently_used():
+    store = MemorySessionStore(max_sessions=2)
+    store.get_or_create('a')
+    store.get_or_create('b')
+    store.get('a')
+    store.get_or_create('c')
+    assert store.get('b') is None
+    assert store.get('a') is not None
+    assert store.stats()['evicted'] == 1
+
+
+def test_max_bytes_keeps_the_newest_session():
+    store = MemorySessionStore(max_bytes=2000)
+    a = store.get_or_create('a')
+    store.append(a, 'x' * 1000, 'y' * 500)
+    b = store.get_or_create('b')
+    store.append(b, 'x' * 1000, 'y' * 500)
+    assert store.get('a') is None
+    assert store.get('b') is b
+    assert store.stats()['bytes'] == b.size
+
+
+def test_idle_sessions_expire():
+    store = MemorySessionStore(idle_ttl=60)
+    session = store.get_or_create('old')
+    session.last_activity = time.time() - 120
+    assert store.get('old') is None
+    assert store.stats()['expired'] == 1
+
+
+def test_context_counts_towards_bytes_and_clear_frees_it():
+    store = MemorySessionStore()
+    session = store.get_or_create('s')
+    store.append(session, 'how do I treat leaf rust?', 'use a fungicide.')
+    base = store.stats()['bytes']
+    session.context = ConversationContext().sync(session.messages)
+    session.context.history()
+    store.save_context(session)
+    assert store.stats()['bytes'] == base + session.context.size
+    assert store.clear('s')
+    assert store.stats()['bytes'] == session.size
+    assert not store.clear('missing')
@@ -0,0 +1,52 @@
+import io
+
+import numpy as np
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from tiled_analysis import MAX_ASPECT_RATIO, decode_reduced, tile_origins, tile_std
+
+
+def test_tile_origins_cover_the_far_edge():
+    assert tile_origins(224, 224, 168).tolist() == [0]
+    assert tile_origins(100, 224, 168).tolist() == [0]
+    assert tile_origins(500, 224, 168).tolist() == [0, 168, 276]
+    assert tile_origins(560, 224, 168).tolist() == [0, 168, 336]
+
+
+def test_tile_std_matches_direct_computation():
+    rng = np.random.default_rng(0)
+    gray = rng.integers(0, 256, size=(37, 53)).astype(np.uint8)
+    ys, xs = tile_origins(37, 16, 10), tile_origins(53, 16, 10)
+    std = tile_std(gray, ys, xs, (16, 16))
+    assert std.shape == (len(ys), len(xs))
+    for r, y in enumerate(ys):
+        for c, x in enumerate(xs):
+            assert std[r, c] == pytest.approx(gray[y:y + 16, x:x + 16].std(), abs=1e-6)
+
+
+def test_tile_std_of_flat_image_is_zero():
+    std = tile_std(np.full((32, 32), 7, dtype=np.uint8), np.array([0, 16]), np.array([0, 16]), (16, 16))
+    assert np.allclose(std, 0.0)
+
+
+def png(size):
+    stream = io.BytesIO()
+    Image.new('RGB', size).save(stream, 'PNG')
+    stream.seek(0)
+    return stream
+
+
+def test_decode_reduced_scales_to_max_side_and_min_side():
+    img, original = decode_reduced(png((4000, 3000)), 1120, 224)
+    assert original == (4000, 3000)
+    assert img.size == (1120, 840)
+    img, _ = decode_reduced(png((8, 8)), 1120, 224)
+    assert img.size == (224, 224)
+
+
+def test_decode_reduced_rejects_elongated_images():
+    width = int(224 * MAX_ASPECT_RATIO) + 1
+    with pytest.raises(ValueError, match='aspect ratio'):
+        decode_reduced(png((width, 224)), 1120, 224)
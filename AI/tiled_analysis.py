@@ -0,0 +1,303 @@
+"""Tiled analysis of high-resolution field photos.
+
+A canopy photo shows many leaves at once. Squashed into one 224 px input it
+loses small lesions and gets a single label for a mixed scene. Here the
+photo is decoded at reduced resolution instead (TILE_MAX_SIDE on the long
+side, using the JPEG draft decoder) and cut into overlapping tiles of the
+model's input size. Near-uniform tiles (sky, bare soil, blur) are dropped by
+a variance test computed for every tile at once from integral images. The
+remaining tiles are classified in batches of `chunk_size`, so a large photo
+(with test-time augmentation multiplying every batch) never becomes one
+oversized forward pass.
+
+The result is a per-tile disease heatmap and the share of analysed tiles per
+plant and per label:
+
+  python tiled_analysis.py analyse Images/wheat-crop-disease.jpg
+  python tiled_analysis.py --model mango analyse field.jpg --max-side 1568 --json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_MAX_SIDE = 1120
+DEFAULT_OVERLAP = 0.25
+# Standard deviation of the grey levels (0-255) below which a tile counts as background
+DEFAULT_MIN_STD = 10.0
+# Tiles per forward pass; the API passes BATCH_ENDPOINT_CHUNK
+DEFAULT_CHUNK_SIZE = 16
+# Longest/shortest side ratio accepted. Small photos are upscaled until the short
+# side holds one tile, so this bounds the decoded size at about min_side * ratio
+MAX_ASPECT_RATIO = 8.0
+
+
+def _config_value(config, key):
+    if config is None:
+        return None
+    if isinstance(config, dict):
+        return config.get(key)
+    return getattr(config, key, None)
+
+
+def model_input_size(processor):
+    """(height, width) of the images the processor hands to the model"""
+    crop = getattr(processor, 'crop_size', None)
+    if getattr(processor, 'do_center_crop', False) and _config_value(crop, 'height'):
+        return int(_config_value(crop, 'height')), int(_config_value(crop, 'width'))
+    size = getattr(processor, 'size', None)
+    if _config_value(size, 'height'):
+        return int(_config_value(size, 'height')), int(_config_value(size, 'width'))
+    edge = int(_config_value(size, 'shortest_edge') or 224)
+    return edge, edge
+
+
+def decode_reduced(stream, max_side, min_side):
+    """(RGB image with its long side near max_side and short side >= min_side, original (width, height))
+
+    ValueError for photos more elongated than MAX_ASPECT_RATIO.
+    """
+    img = Image.open(stream)
+    width, height = img.size
+    if max(width, height) > MAX_ASPECT_RATIO * min(width, height):
+        raise ValueError(f"Image aspect ratio {width}x{height} exceeds {MAX_ASPECT_RATIO:g}:1")
+    scale = min(1.0, max_side / max(width, height))
+    # Small or very elongated photos are upscaled to hold at least one tile
+    scale = max(scale, min_side / min(width, height))
+    target = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    if img.format == 'JPEG':
+        # Decodes at the smallest 1/2, 1/4 or 1/8 scale that still covers the target
+        img.draft('RGB', target)
+    img = img.convert('RGB')
+    if img.size != target:
+        img = img.resize(target, resample=Image.BILINEAR, reducing_gap=2.0)
+    return img, (width, height)
+
+
+def tile_origins(length, tile, stride):
+    """Tile start offsets along one axis; the last tile is aligned to the far edge"""
+    if length <= tile:
+        return np.zeros(1, dtype=np.int64)
+    starts = np.arange(0, length - tile, stride, dtype=np.int64)
+    return np.append(starts, length - tile)
+
+
+def tile_std(gray, ys, xs, tile_hw):
+    """(rows, cols) grey-level standard deviation of every tile, O(1) per tile from integral images"""
+    th, tw = tile_hw
+    height, width = gray.shape
+    values = gray.astype(np.float64)
+    integral = np.zeros((2, height + 1, width + 1))
+    integral[0, 1:, 1:] = values.cumsum(0).cumsum(1)
+    integral[1, 1:, 1:] = (values * values).cumsum(0).cumsum(1)
+    y0, y1 = ys[:, None], ys[:, None] + th
+    x0, x1 = xs[None, :], xs[None, :] + tw
+    sums = integral[:, y1, x1] - integral[:, y0, x1] - integral[:, y1, x0] + integral[:, y0, x0]
+    mean = sums[0] / (th * tw)
+    variance = np.maximum(sums[1] / (th * tw) - mean * mean, 0.0)
+    return np.sqrt(variance)
+
+
+def extract_tiles(pixels, ys, xs, tile_hw, keep):
+    """(n, 3, th, tw) uint8 tiles of an (H, W, 3) image for the kept grid cells, row-major"""
+    # (H - th + 1, W - tw + 1, 3, th, tw) view; indexing copies only the kept tiles
+    windows = np.lib.stride_tricks.sliding_window_view(pixels, tile_hw, axis=(0, 1))
+    rows, cols = np.nonzero(keep)
+    return windows[ys[rows], xs[cols]]
+
+
+def classify_tiles(img, classify, tile_hw, scale, offset, overlap=DEFAULT_OVERLAP, min_std=DEFAULT_MIN_STD,
+                   chunk_size=DEFAULT_CHUNK_SIZE):
+    """Grid, background mask and class probabilities for the tiles of a decoded image.
+
+    `classify` maps an (N, 3, th, tw) float tensor to (probabilities, stages),
+    as Cascade.classify does; it is called with at most `chunk_size` tiles at
+    a time. Returns a dict of NumPy arrays.
+    """
+    if not 0.0 <= overlap < 1.0:
+        raise ValueError("overlap must be in [0, 1)")
+    th, tw = tile_hw
+    stride = (max(1, int(round(th * (1 - overlap)))), max(1, int(round(tw * (1 - overlap)))))
+    pixels = np.asarray(img, dtype=np.uint8)
+    ys = tile_origins(pixels.shape[0], th, stride[0])
+    xs = tile_origins(pixels.shape[1], tw, stride[1])
+
+    # ITU-R 601 luma, as PIL's convert('L')
+    gray = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    std = tile_std(gray, ys, xs, tile_hw)
+    keep = std >= min_std
+
+    probs = np.zeros((0, 0), dtype=np.float32)
+    stages = []
+    if keep.any():
+        # Imported here so importing this module stays cheap (see LAZY_STARTUP)
+        import torch
+
+        tiles = extract_tiles(pixels, ys, xs, tile_hw, keep)
+        chunk_size = max(1, int(chunk_size))
+        parts = []
+        for start in range(0, len(tiles), chunk_size):
+            # Only one chunk is held as float32 at a time
+            batch = (tiles[start:start + chunk_size].astype(np.float32) * scale.reshape(1, 3, 1, 1)
+                     + offset.reshape(1, 3, 1, 1))
+            chunk_probs, chunk_stages = classify(torch.from_numpy(batch))
+            parts.append(chunk_probs.float().numpy())
+            stages.extend(chunk_stages)
+        probs = np.concatenate(parts)
+    return {'ys': ys, 'xs': xs, 'stride': stride, 'std': std, 'keep': keep,
+            'probs': probs, 'stages': stages}
+
+
+def _grid(keep, values, digits=4):
+    # Row-major values for the kept cells -> nested lists with None for background
+    grid = [[None] * keep.shape[1] for _ in range(keep.shape[0])]
+    for (row, col), value in zip(zip(*np.nonzero(keep)), values):
+        grid[row][col] = round(float(value), digits) if digits is not None else int(value)
+    return grid
+
+
+def summarize(tiles, label_table, session_id="default"):
+    """Heatmap, per-plant and per-label tile shares and the main finding for classify_tiles() output"""
+    keep, probs = tiles['keep'], tiles['probs']
+    analysed = int(keep.sum())
+    summary = {
+        'analysed_tiles': analysed,
+        'background_tiles': int(keep.size - analysed),
+        'diseased_percent': 0.0,
+        'healthy_percent': 0.0,
+        'unidentified_percent': 0.0,
+        'mean_disease_probability': 0.0,
+        'max_disease_probability': 0.0,
+    }
+    if not analysed:
+        return {'heatmap': {'disease_probability': _grid(keep, []), 'label': _grid(keep, []),
+                            'confidence': _grid(keep, [])},
+                'legend': [], 'summary': summary, 'plants': [], 'labels': [], 'result': None}
+
+    diseased = np.array([entry.plant is not None and not entry.healthy for entry in label_table])
+    disease_probability = np.minimum(probs[:, diseased].sum(axis=1), 1.0)
+    predicted = probs.argmax(axis=1)
+    confidence = probs.max(axis=1)
+
+    indices, counts = np.unique(predicted, return_counts=True)
+    mean_confidence = {int(i): float(confidence[predicted == i].mean()) for i in indices}
+    # Most common first, ties broken by confidence
+    order = sorted(zip(indices.tolist(), counts.tolist()), key=lambda ic: (-ic[1], -mean_confidence[ic[0]]))
+    legend = [label_table[i].label for i, _ in order]
+    position = {i: n for n, (i, _) in enumerate(order)}
+
+    labels, plants = [], {}
+    for i, count in order:
+        entry = label_table[i]
+        percent = 100.0 * count / analysed
+        labels.append({'label': entry.label, 'plant': entry.plant, 'disease': entry.disease,
+                       'healthy': entry.healthy, 'tiles': count, 'percent': percent,
+                       'mean_confidence': mean_confidence[i]})
+        if entry.plant is None:
+            summary['unidentified_percent'] += percent
+            continue
+        plants[entry.plant] = plants.get(entry.plant, 0) + count
+        summary['healthy_percent' if entry.healthy else 'diseased_percent'] += percent
+    summary['mean_disease_probability'] = float(disease_probability.mean())
+    summary['max_disease_probability'] = float(disease_probability.max())
+    if tiles['stages']:
+        summary['stages'] = {stage: tiles['stages'].count(stage) for stage in sorted(set(tiles['stages']))}
+
+    # The main finding: the most widespread disease, else the most common label
+    main = next((i for i, _ in order if diseased[i]), order[0][0])
+    result = label_table[main].result(mean_confidence[main], session_id)
+    result['percent'] = labels[position[main]]['percent']
+
+    return {
+        'heatmap': {
+            'disease_probability': _grid(keep, disease_probability),
+            'label': _grid(keep, [position[int(i)] for i in predicted], digits=None),
+            'confidence': _grid(keep, confidence),
+        },
+        'legend': legend,
+        'summary': summary,
+        'plants': [{'plant': plant, 'tiles': count, 'percent': 100.0 * count / analysed}
+                   for plant, count in sorted(plants.items(), key=lambda pc: -pc[1])],
+        'labels': labels,
+        'result': result,
+    }
+
+
+def analyse(served, stream, max_side=DEFAULT_MAX_SIDE, overlap=DEFAULT_OVERLAP, min_std=DEFAULT_MIN_STD,
+            session_id="default", chunk_size=DEFAULT_CHUNK_SIZE):
+    """Full tiled analysis of one uploaded image with a served model (see detect_disease_api.ServedModel)"""
+    from training_cache import normalization
+
+    tile_hw = model_input_size(served.processor)
+    img, (width, height) = decode_reduced(stream, max_side, max(tile_hw))
+    scale, offset = normalization(served.processor)
+    tiles = classify_tiles(img, served.cascade.classify, tile_hw, scale, offset, overlap, min_std,
+                           chunk_size)
+
+    report = summarize(tiles, served.label_table, session_id)
+    rows, cols = tiles['keep'].shape
+    report['model'] = served.name
+    report['image'] = {'width': width, 'height': height,
+                       'analysed_width': img.size[0], 'analysed_height': img.size[1]}
+    # Tile (row, col) covers x[col]..x[col]+size[1], y[row]..y[row]+size[0] of the
+    # analysed image; multiply by `scale` for original pixel coordinates
+    report['tiles'] = {
+        'size': list(tile_hw),
+        'stride': list(tiles['stride']),
+        'rows': rows,
+        'cols': cols,
+        'x': tiles['xs'].tolist(),
+        'y': tiles['ys'].tolist(),
+        'scale': width / img.size[0],
+    }
+    return report
+
+
+def print_heatmap(report):
+    """Disease probability per tile as a text grid ('.' background, 0-9 tenths)"""
+    for row in report['heatmap']['disease_probability']:
+        print(' '.join('.' if p is None else str(min(9, int(p * 10))) for p in row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', help='MODEL_REGISTRY model name (default: the default model)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    analyse_cmd = sub.add_parser('analyse', help='Tile, filter and classify images, print the heatmap')
+    analyse_cmd.add_argument('images', nargs='+')
+    analyse_cmd.add_argument('--max-side', type=int, default=DEFAULT_MAX_SIDE)
+    analyse_cmd.add_argument('--overlap', type=float, default=DEFAULT_OVERLAP)
+    analyse_cmd.add_argument('--min-std', type=float, default=DEFAULT_MIN_STD)
+    analyse_cmd.add_argument('--json', action='store_true', help='Print the full report as JSON')
+    args = parser.parse_args()
+
+    from detect_disease_api import default_model, models
+
+    name = args.model or default_model
+    try:
+        served = models.get(name)
+    except Exception as e:
+        raise SystemExit(f"Could not load model '{name}': {e}")
+
+    for path in args.images:
+        t0 = time.perf_counter()
+        with open(path, 'rb') as f:
+            report = analyse(served, f, args.max_side, args.overlap, args.min_std)
+        seconds = time.perf_counter() - t0
+        if args.json:
+            print(json.dumps(report, indent=2, ensure_ascii=False))
+            continue
+        summary, tiles = report['summary'], report['tiles']
+        print(f"{path}: {tiles['rows']}x{tiles['cols']} tiles, {summary['analysed_tiles']} analysed, "
+              f"{summary['background_tiles']} background, {seconds * 1000:.0f} ms")
+        print_heatmap(report)
+        print(f"  diseased {summary['diseased_percent']:.0f}%, healthy {summary['healthy_percent']:.0f}%, "
+              f"unidentified {summary['unidentified_percent']:.0f}%")
+        for entry in report['labels'][:5]:
+            print(f"  {entry['percent']:5.1f}%  {entry['label']} ({entry['mean_confidence']:.2f})")
+
+
+if __name__ == '__main__':
+    main()
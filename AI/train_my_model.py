@@ -1,46 +1,161 @@
 # train_my_model.py
+import argparse
+import inspect
+import os
+import time
+import numpy as np
 import torch
-from transformers import ViTForImageClassification, TrainingArguments, Trainer, ViTImageProcessor
-from datasets import load_dataset
+from transformers import AutoImageProcessor, AutoModelForImageClassification, TrainingArguments, Trainer, TrainerCallback
+from training_cache import (CachedImageDataset, build_cache, cache_key, collate_cached, dataset_identity,
+                            time_loader)
+from local_training import (ImageFolderSource, StreamingImageDataset, accuracy, cached_features,
+                            choose_precision, collate_streaming, precision_kwargs, train_linear_head)
+
+
+class EpochTimer(TrainerCallback):
+    """Print how long each training epoch took"""
+
+    def __init__(self):
+        self.started = None
+        self.epoch_seconds = []
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self.started = time.perf_counter()
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        self.epoch_seconds.append(time.perf_counter() - self.started)
+        print(f"Epoch {len(self.epoch_seconds)} took {self.epoch_seconds[-1]:.1f}s")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fine-tune an image classifier on plant disease images")
+    parser.add_argument('--base-model', default='google/vit-base-patch16-224',
+                        help='Hub id or local directory of the model to start from')
+    parser.add_argument('--data-dir', default=None,
+                        help='Train offline on a local class-per-folder tree (e.g. egypt_model_data/train) '
+                             'instead of downloading kerem/plant-village')
+    parser.add_argument('--eval-fraction', type=float, default=0.1)
+    parser.add_argument('--output-dir', default='./my_plant_disease_model')
+    parser.add_argument('--epochs', type=float, default=3)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--grad-accum', type=int, default=1,
+                        help='Gradient accumulation steps (effective batch = batch size x this)')
+    parser.add_argument('--learning-rate', type=float, default=2e-5)
+    parser.add_argument('--precision', choices=('auto', 'bf16', 'fp16', 'fp32'), default='auto',
+                        help='auto: bf16 where the CPU/GPU supports it natively, otherwise fp32 on CPU')
+    parser.add_argument('--threads', type=int, default=0, help='torch intra-op threads (0: torch default)')
+    parser.add_argument('--linear-probe', action='store_true',
+                        help='Fast path: freeze the backbone, cache its features once and train only a linear head')
+    parser.add_argument('--probe-epochs', type=int, default=100)
+    parser.add_argument('--cache-dir', default='./training_cache',
+                        help='Where preprocessed pixel tensors are stored (keyed by processor config)')
+    parser.add_argument('--cache-dtype', choices=('uint8', 'float16'), default='uint8')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Preprocess on the fly every epoch (the old path, for comparison)')
+    parser.add_argument('--num-workers', type=int, default=min(4, os.cpu_count() or 1),
+                        help='DataLoader worker processes')
+    parser.add_argument('--benchmark-loader', type=int, default=0, metavar='BATCHES',
+                        help='Only time this many batches of the on-the-fly and cached loaders, then exit')
+    args = parser.parse_args()
+    if args.no_cache and args.benchmark_loader:
+        parser.error("--benchmark-loader compares against the cached loader; drop --no-cache")
+    return args
+
+
+def compute_metrics(eval_pred):
+    logits, labels = eval_pred
+    return {'accuracy': float((np.argmax(logits, axis=-1) == labels).mean())}
+
+
+def run_linear_probe(args, model, processor, labels, train_dataset, eval_dataset, collate_fn,
+                     dataset_ids, precision):
+    """Frozen backbone: cache classifier-input features once, fit only the classifier.
+
+    `dataset_ids` maps 'train'/'eval' to dataset_identity() of the source splits,
+    so the cached features are rebuilt when the images change.
+    """
+    def features_for(dataset, split):
+        loader = torch.utils.data.DataLoader(
+            dataset, batch_size=64, num_workers=args.num_workers, collate_fn=collate_fn)
+        key = cache_key(processor, f"{args.base_model}|{dataset_ids[split]}|{split}|features",
+                        len(dataset), precision)
+        features, targets, seconds = cached_features(
+            model, loader, os.path.join(args.cache_dir, f"features-{key}.npz"), precision)
+        print(f"{split} features: {features.shape} "
+              f"({'cached' if seconds == 0 else f'extracted in {seconds:.1f}s'})")
+        return features, targets
+
+    train_features, train_labels = features_for(train_dataset, 'train')
+    eval_features, eval_labels = features_for(eval_dataset, 'eval')
+
+    t0 = time.perf_counter()
+    head = train_linear_head(train_features, train_labels, len(labels), epochs=args.probe_epochs)
+    print(f"Linear head trained in {time.perf_counter() - t0:.1f}s; "
+          f"train accuracy {accuracy(head, train_features, train_labels):.3f}, "
+          f"eval accuracy {accuracy(head, eval_features, eval_labels) or 0.0:.3f}")
+
+    with torch.no_grad():
+        model.classifier.weight.copy_(head.weight)
+        model.classifier.bias.copy_(head.bias)
 
 
 def main():
     """
     This script will download a base model from Google, fine-tune it on the
     PlantVillage dataset, and save the resulting expert model locally.
+    With --data-dir it trains offline on a local image folder instead.
     """
+    args = parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    precision = choose_precision(args.precision)
+
     # 1. Define Model and Dataset Names
     # --- This is the stable "engine" from Google ---
-    base_model_name = 'google/vit-base-patch16-224'
-    # --- This is the official, stable dataset ---
-    dataset_name = 'kerem/plant-village'
+    base_model_name = args.base_model
+    # --- This is the official, stable dataset (or a local folder) ---
+    dataset_name = args.data_dir or 'kerem/plant-village'
     # --- This is where your new model will be saved ---
-    output_model_dir = './my_plant_disease_model'
+    output_model_dir = args.output_dir
 
     print(
-        f"Starting process. Base Model: {base_model_name}, Dataset: {dataset_name}")
+        f"Starting process. Base Model: {base_model_name}, Dataset: {dataset_name}, "
+        f"precision: {precision}, threads: {torch.get_num_threads()}")
 
     # 2. Load the Dataset
     print("Loading dataset...")
-    # The 'split' command downloads the training set and automatically splits it.
-    # 90% for training, 10% for validation.
-    train_ds, eval_ds = load_dataset(
-        dataset_name, split=['train[:90%]', 'train[90%:]'])
+    if args.data_dir:
+        # Local ImageFolder tree; images are only decoded when needed
+        source = ImageFolderSource(args.data_dir)
+        train_ds, eval_ds = source.split(args.eval_fraction)
+        labels = source.classes
+        train_id = f"{os.path.abspath(args.data_dir)}:train"
+        eval_id = f"{os.path.abspath(args.data_dir)}:eval"
+    else:
+        from datasets import load_dataset
+
+        # The 'split' command downloads the training set and automatically splits it.
+        # 90% for training, 10% for validation.
+        train_ds, eval_ds = load_dataset(
+            dataset_name, split=['train[:90%]', 'train[90%:]'])
+        # Get the class labels from the dataset
+        labels = train_ds.features['label'].names
+        train_id = f"{dataset_name}:train[:90%]"
+        eval_id = f"{dataset_name}:train[90%:]"
 
-    # Get the class labels from the dataset
-    labels = train_ds.features['label'].names
     num_labels = len(labels)
-    print(f"Dataset loaded. Number of classes: {num_labels}")
+    print(f"Dataset loaded. {len(train_ds)} training / {len(eval_ds)} eval images, "
+          f"number of classes: {num_labels}")
     print("Example labels:", labels[:5])
 
     # 3. Load the Processor and Model
     print("Loading image processor and base model...")
     # The processor prepares images for the model
-    processor = ViTImageProcessor.from_pretrained(base_model_name)
+    processor = AutoImageProcessor.from_pretrained(base_model_name)
 
     # We load the base model and tell it our number of classes.
     # `ignore_mismatched_sizes=True` is crucial for transfer learning.
-    model = ViTForImageClassification.from_pretrained(
+    model = AutoModelForImageClassification.from_pretrained(
         base_model_name,
         num_labels=num_labels,
         id2label={str(i): c for i, c in enumerate(labels)},
@@ -58,10 +173,6 @@ def main():
         inputs['labels'] = example_batch['label']
         return inputs
 
-    # Apply the transformations
-    train_dataset = train_ds.with_transform(transform)
-    eval_dataset = eval_ds.with_transform(transform)
-
     def collate_fn(batch):
         # This function handles creating batches of data
         return {
@@ -69,40 +180,106 @@ def main():
             'labels': torch.tensor([x['labels'] for x in batch])
         }
 
+    # Apply the transformations. By default every image is decoded and
+    # preprocessed once into a memory-mapped cache instead of every epoch.
+    if args.no_cache or args.benchmark_loader:
+        if args.data_dir:
+            train_dataset = StreamingImageDataset(train_ds, processor)
+            eval_dataset = StreamingImageDataset(eval_ds, processor)
+            collate_fn = collate_streaming
+        else:
+            train_dataset = train_ds.with_transform(transform)
+            eval_dataset = eval_ds.with_transform(transform)
+    if not args.no_cache:
+        print("Preparing preprocessed training cache...")
+        cached_train = CachedImageDataset(build_cache(
+            train_ds, processor, args.cache_dir, train_id, args.cache_dtype))
+        cached_eval = CachedImageDataset(build_cache(
+            eval_ds, processor, args.cache_dir, eval_id, args.cache_dtype))
+
+    if args.benchmark_loader:
+        loaders = {
+            'on-the-fly': torch.utils.data.DataLoader(
+                train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers,
+                collate_fn=collate_fn),
+            'cached': torch.utils.data.DataLoader(
+                cached_train, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers,
+                collate_fn=collate_cached),
+        }
+        for name, loader in loaders.items():
+            seconds, images = time_loader(loader, args.benchmark_loader)
+            print(f"{name}: {images} images in {seconds:.2f}s ({images / seconds:.0f} images/s)")
+        return
+
+    if not args.no_cache:
+        train_dataset, eval_dataset, collate_fn = cached_train, cached_eval, collate_cached
+
+    if args.linear_probe:
+        print("--- Linear probe: frozen backbone + cached features ---")
+        t0 = time.perf_counter()
+        dataset_ids = {'train': dataset_identity(train_ds, train_id),
+                       'eval': dataset_identity(eval_ds, eval_id)}
+        run_linear_probe(args, model, processor, labels, train_dataset, eval_dataset, collate_fn,
+                         dataset_ids, precision)
+        model.save_pretrained(output_model_dir)
+        processor.save_pretrained(output_model_dir)
+        print(f"Linear probe finished in {time.perf_counter() - t0:.1f}s. Model saved to {output_model_dir}")
+        return
+
     # 5. Define Training Arguments
     print("Configuring training...")
+    # Small local folders are evaluated once per epoch, the large hub dataset every 500 steps
+    strategy = 'epoch' if args.data_dir else 'steps'
+    # `evaluation_strategy` was renamed to `eval_strategy` in newer transformers
+    supported = inspect.signature(TrainingArguments).parameters
+    eval_strategy_arg = 'eval_strategy' if 'eval_strategy' in supported else 'evaluation_strategy'
+    # Keeping DataLoader workers alive between epochs needs transformers >= 4.38
+    loader_kwargs = ({'dataloader_persistent_workers': args.num_workers > 0}
+                     if 'dataloader_persistent_workers' in supported else {})
     training_args = TrainingArguments(
         output_dir=output_model_dir,
-        per_device_train_batch_size=16,
-        evaluation_strategy="steps",
-        num_train_epochs=3,  # 3 epochs is a good starting point
-        fp16=True,  # Use mixed precision for faster training if you have a capable GPU
+        per_device_train_batch_size=args.batch_size,
+        per_device_eval_batch_size=args.batch_size,
+        gradient_accumulation_steps=args.grad_accum,
+        num_train_epochs=args.epochs,  # 3 epochs is a good starting point
+        save_strategy=strategy,
         save_steps=500,
         eval_steps=500,
         logging_steps=100,
-        learning_rate=2e-5,  # A good learning rate for fine-tuning
+        learning_rate=args.learning_rate,  # 2e-5 is a good learning rate for fine-tuning
         save_total_limit=2,
         remove_unused_columns=False,
         load_best_model_at_end=True,
         metric_for_best_model="accuracy",
         push_to_hub=False,
+        dataloader_num_workers=args.num_workers,
+        **loader_kwargs,
+        # bf16 where the hardware supports it, fp32 otherwise (fp16 only on GPUs)
+        **precision_kwargs(precision, supported),
+        **{eval_strategy_arg: strategy},
     )
 
     # 6. Initialize and Run the Trainer
+    epoch_timer = EpochTimer()
     trainer = Trainer(
         model=model,
         args=training_args,
         data_collator=collate_fn,
         train_dataset=train_dataset,
         eval_dataset=eval_dataset,
+        compute_metrics=compute_metrics,
+        callbacks=[epoch_timer],
     )
 
     print("--- Starting Training ---")
     trainer.train()
     print("--- Training Complete ---")
+    print("Epoch times (s):", ", ".join(f"{t:.1f}" for t in epoch_timer.epoch_seconds),
+          "(cached data)" if not args.no_cache else "(on-the-fly preprocessing)")
 
     print(f"Saving the best model to {output_model_dir}")
     trainer.save_model(output_model_dir)
+    processor.save_pretrained(output_model_dir)
     print("Model saved successfully. You can now use this path in your Flask API.")
 
 
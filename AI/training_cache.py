@@ -0,0 +1,180 @@
+"""One-time preprocessed image cache for training.
+
+The first run resizes and crops every training image with the model's image
+processor and writes the pixels (uint8 before normalization, or float16
+after) plus labels into .npy files under a directory keyed by the processor
+config and the dataset. Later epochs and runs memory-map those files: a
+batch is one fancy-indexed read from the page cache and, for uint8, a fused
+multiply-add to normalize. Nothing is decoded or resized again.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import torch
+
+CACHE_VERSION = 1
+
+
+def processor_config(processor):
+    if hasattr(processor, 'to_dict'):
+        return processor.to_dict()
+    return {k: v for k, v in vars(processor).items() if not k.startswith('_')}
+
+
+def cache_key(processor, dataset_id, num_examples, dtype):
+    """Directory name for a (processor config, dataset, dtype) combination"""
+    identity = {
+        'version': CACHE_VERSION,
+        'processor': processor_config(processor),
+        'dataset': dataset_id,
+        'examples': num_examples,
+        'dtype': dtype,
+    }
+    blob = json.dumps(identity, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.blake2b(blob, digest_size=12).hexdigest()
+
+
+def dataset_identity(dataset, name=''):
+    """Stable id for a dataset: the HF datasets fingerprint when there is one"""
+    return getattr(dataset, '_fingerprint', None) or name or type(dataset).__name__
+
+
+def normalization(processor):
+    """(scale, offset) per channel so that normalized = uint8 pixels * scale + offset"""
+    rescale = float(getattr(processor, 'rescale_factor', 1 / 255)) if getattr(
+        processor, 'do_rescale', True) else 1.0
+    if getattr(processor, 'do_normalize', True):
+        mean = np.asarray(processor.image_mean, dtype=np.float32)
+        std = np.asarray(processor.image_std, dtype=np.float32)
+    else:
+        mean, std = np.zeros(3, dtype=np.float32), np.ones(3, dtype=np.float32)
+    return (rescale / std).astype(np.float32), (-mean / std).astype(np.float32)
+
+
+def build_cache(dataset, processor, cache_root, dataset_id='', dtype='uint8', batch_size=64,
+                image_column='image', label_column='label'):
+    """Preprocess `dataset` once into cache_root/<key>/ and return that directory.
+
+    `dataset` must support len() and slicing to a dict of columns (as HF
+    datasets do). Reuses an existing complete cache with the same key.
+    """
+    if dtype not in ('uint8', 'float16'):
+        raise ValueError("dtype must be 'uint8' or 'float16'")
+    key = cache_key(processor, dataset_identity(dataset, dataset_id), len(dataset), dtype)
+    path = os.path.join(cache_root, key)
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        return path
+
+    t0 = time.perf_counter()
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    pixels = None
+    labels = np.empty(len(dataset), dtype=np.int64)
+    # uint8 keeps the resized pixels and defers rescale/normalize to load time
+    kwargs = {'do_rescale': False, 'do_normalize': False} if dtype == 'uint8' else {}
+    for start in range(0, len(dataset), batch_size):
+        batch = dataset[start:start + batch_size]
+        images = [img.convert('RGB') for img in batch[image_column]]
+        values = processor(images, return_tensors='np', **kwargs)['pixel_values']
+        if pixels is None:
+            pixels = np.lib.format.open_memmap(
+                os.path.join(tmp, 'pixels.npy'), mode='w+', dtype=dtype,
+                shape=(len(dataset),) + tuple(values.shape[1:]))
+        if dtype == 'uint8':
+            values = np.clip(np.rint(values), 0, 255)
+        pixels[start:start + len(images)] = values.astype(dtype)
+        labels[start:start + len(images)] = batch[label_column]
+        done = start + len(images)
+        if done % (batch_size * 20) < batch_size or done == len(dataset):
+            print(f"  cached {done}/{len(dataset)} images")
+    pixels.flush()
+    del pixels
+    np.save(os.path.join(tmp, 'labels.npy'), labels)
+
+    scale, offset = normalization(processor)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({
+            'version': CACHE_VERSION,
+            'examples': len(dataset),
+            'dtype': dtype,
+            'scale': scale.tolist(),
+            'offset': offset.tolist(),
+            'seconds': time.perf_counter() - t0,
+        }, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    print(f"Preprocessed {len(dataset)} images into {path} in {time.perf_counter() - t0:.1f}s")
+    return path
+
+
+class CachedImageDataset(torch.utils.data.Dataset):
+    """Memory-mapped view of a build_cache() directory.
+
+    `__getitems__` lets the DataLoader fetch a whole batch with one indexed
+    read; use `collate_cached` as the collate function.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.labels = np.load(os.path.join(path, 'labels.npy'))
+        self.scale = torch.tensor(self.meta['scale']).view(1, 3, 1, 1)
+        self.offset = torch.tensor(self.meta['offset']).view(1, 3, 1, 1)
+        self._pixels = None
+        self._pid = None
+
+    @property
+    def pixels(self):
+        # Open the memmap lazily so each DataLoader worker maps the file itself
+        if self._pixels is None or self._pid != os.getpid():
+            self._pixels = np.load(os.path.join(self.path, 'pixels.npy'), mmap_mode='r')
+            self._pid = os.getpid()
+        return self._pixels
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_pixels'] = None
+        return state
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitems__(self, indices):
+        order = np.sort(np.asarray(indices))  # sequential reads from the page cache
+        values = torch.from_numpy(np.ascontiguousarray(self.pixels[order]))
+        if values.dtype == torch.uint8:
+            values = values.float().mul_(self.scale).add_(self.offset)
+        else:
+            values = values.float()
+        return {'pixel_values': values, 'labels': torch.from_numpy(self.labels[order])}
+
+    def __getitem__(self, index):
+        batch = self.__getitems__([index])
+        return {'pixel_values': batch['pixel_values'][0], 'labels': batch['labels'][0]}
+
+
+def collate_cached(batch):
+    """Collate for CachedImageDataset: batches from __getitems__ pass straight through"""
+    if isinstance(batch, dict):
+        return batch
+    return {
+        'pixel_values': torch.stack([x['pixel_values'] for x in batch]),
+        'labels': torch.stack([x['labels'] for x in batch]),
+    }
+
+
+def time_loader(loader, max_batches=None):
+    """Seconds to iterate a DataLoader (optionally only the first max_batches) and images seen"""
+    t0 = time.perf_counter()
+    images = 0
+    for i, batch in enumerate(loader):
+        images += len(batch['labels'])
+        if max_batches and i + 1 >= max_batches:
+            break
+    return time.perf_counter() - t0, images